@@ -6,7 +6,7 @@ import enum
 import torch.nn as nn
 import torch.nn.functional as F
 
-from modules import sd_models, cache, errors, hashes, shared
+from modules import metadata_index, errors, hashes, shared
 import modules.models.sd3.mmdit
 
 NetworkWeights = namedtuple('NetworkWeights', ['network_key', 'sd_key', 'w', 'sd_module'])
@@ -25,45 +25,54 @@ class NetworkOnDisk:
     def __init__(self, name, filename):
         self.name = name
         self.filename = filename
-        self.metadata = {}
+        self._metadata = None
+        self.metadata_summary = {}
         self.is_safetensors = os.path.splitext(filename)[1].lower() == ".safetensors"
 
-        def read_metadata():
-            metadata = sd_models.read_metadata_from_safetensors(filename)
-
-            return metadata
-
         if self.is_safetensors:
             try:
-                self.metadata = cache.cached_data_for_file('safetensors-metadata', "lora/" + self.name, filename, read_metadata)
+                self.metadata_summary = metadata_index.index.summary(filename)
             except Exception as e:
                 errors.display(e, f"reading lora {filename}")
+                self._metadata = {}
 
-        if self.metadata:
-            m = {}
-            for k, v in sorted(self.metadata.items(), key=lambda x: metadata_tags_order.get(x[0], 999)):
-                m[k] = v
-
-            self.metadata = m
-
-        self.alias = self.metadata.get('ss_output_name', self.name)
+        self.alias = self.metadata_summary.get('ss_output_name', self.name)
 
         self.hash = None
         self.shorthash = None
         self.set_hash(
-            self.metadata.get('sshs_model_hash') or
+            self.metadata_summary.get('sshs_model_hash') or
             hashes.sha256_from_cache(self.filename, "lora/" + self.name, use_addnet_hash=self.is_safetensors) or
             ''
         )
 
         self.sd_version = self.detect_version()
 
+    @property
+    def metadata(self):
+        """All metadata from the file's header, read from the metadata index when first used; metadata_summary has the short values."""
+
+        if self._metadata is None:
+            self._metadata = {}
+            if self.is_safetensors:
+                try:
+                    metadata = metadata_index.index.metadata(self.filename)
+                    self._metadata = dict(sorted(metadata.items(), key=lambda x: metadata_tags_order.get(x[0], 999)))
+                except Exception as e:
+                    errors.display(e, f"reading lora {self.filename}")
+
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
     def detect_version(self):
-        if str(self.metadata.get('ss_base_model_version', "")).startswith("sdxl_"):
+        if str(self.metadata_summary.get('ss_base_model_version', "")).startswith("sdxl_"):
             return SdVersion.SDXL
-        elif str(self.metadata.get('ss_v2', "")) == "True":
+        elif str(self.metadata_summary.get('ss_v2', "")) == "True":
             return SdVersion.SD2
-        elif len(self.metadata):
+        elif self.metadata_summary or self.metadata:
             return SdVersion.SD1
 
         return SdVersion.Unknown
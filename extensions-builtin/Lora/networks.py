@@ -3,6 +3,8 @@ import gradio as gr
 import logging
 import os
 import re
+import weakref
+from collections import OrderedDict
 
 import lora_patches
 import network
@@ -18,7 +20,7 @@ import network_oft
 import torch
 from typing import Union
 
-from modules import shared, devices, sd_models, errors, scripts, sd_hijack
+from modules import shared, devices, sd_models, errors, scripts, sd_hijack, hashes, metadata_index
 import modules.textual_inversion.textual_inversion as textual_inversion
 import modules.models.sd3.mmdit
 
@@ -388,6 +390,90 @@ def restore_weights_backup(obj, field, weight):
     getattr(obj, field).copy_(weight)
 
 
+class UpdownCache:
+    """
+    LRU cache of weight changes (updown, ex_bias) that networks make to layers, limited by the lora_updown_cache_size
+    option; lets switching between combinations of networks skip calc_updown for combinations seen before.
+
+    Some network types (DoRA, IA3, OFT) calculate changes from the current weight, which already has changes from
+    networks earlier in the list applied, so the key for a change includes all networks up to and including the one
+    that made it.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, layer, key):
+        entry = self.entries.get((id(layer), key))
+        if entry is None or entry[0]() is not layer:
+            return None
+
+        self.entries.move_to_end((id(layer), key))
+        return entry[1], entry[2]
+
+    def put(self, layer, key, updown, ex_bias):
+        limit = shared.opts.lora_updown_cache_size * 1024 * 1024
+        nbytes = updown.nelement() * updown.element_size() + (ex_bias.nelement() * ex_bias.element_size() if ex_bias is not None else 0)
+        if nbytes > limit:
+            return
+
+        if shared.opts.lora_updown_cache_device == "CPU":
+            updown = self.to_cpu(updown)
+            ex_bias = self.to_cpu(ex_bias)
+        elif ex_bias is not None:
+            # ex_bias can become the layer's bias parameter and be changed in place
+            ex_bias = ex_bias.clone()
+
+        self.pop((id(layer), key))
+        self.entries[(id(layer), key)] = (weakref.ref(layer), updown, ex_bias, nbytes)
+        self.size += nbytes
+
+        while self.size > limit:
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, entry_key):
+        entry = self.entries.pop(entry_key, None)
+        if entry is not None:
+            self.size -= entry[3]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    @staticmethod
+    def to_cpu(x):
+        if x is None:
+            return None
+
+        x = x.to(devices.cpu)
+        return x.pin_memory() if torch.cuda.is_available() else x
+
+
+updown_cache = UpdownCache()
+
+
+def calc_updown_cached(self, module, weight, cache_key):
+    """Same as module.calc_updown(weight), including padding for inpainting models, but uses updown_cache."""
+
+    if shared.opts.lora_updown_cache_size > 0:
+        cached = updown_cache.get(self, cache_key)
+        if cached is not None:
+            updown, ex_bias = cached
+            return updown.to(weight.device, non_blocking=True), ex_bias.to(weight.device, copy=True) if ex_bias is not None else None
+
+    updown, ex_bias = module.calc_updown(weight)
+
+    if len(weight.shape) == 4 and weight.shape[1] == 9:
+        # inpainting model. zero pad updown to make channel[1]  4 to 9
+        updown = torch.nn.functional.pad(updown, (0, 0, 0, 0, 0, 5))
+
+    if shared.opts.lora_updown_cache_size > 0:
+        updown_cache.put(self, cache_key, updown, ex_bias)
+
+    return updown, ex_bias
+
+
 def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention]):
     weights_backup = getattr(self, "network_weights_backup", None)
     bias_backup = getattr(self, "network_bias_backup", None)
@@ -412,6 +498,7 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
     """
     Applies the currently selected set of networks to the weights of torch layer self.
     If weights already have this particular set of networks applied, does nothing.
+    If the selected set only adds networks to the end of the applied set, applies just the added networks.
     If not, restores original weights from backup and alters weights according to networks.
     """
 
@@ -451,9 +538,13 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
         self.network_bias_backup = bias_backup
 
     if current_names != wanted_names:
-        network_restore_weights_from_backup(self)
+        if current_names and wanted_names[:len(current_names)] == current_names:
+            first_network = len(current_names)
+        else:
+            network_restore_weights_from_backup(self)
+            first_network = 0
 
-        for net in loaded_networks:
+        for i, net in enumerate(loaded_networks[first_network:], first_network):
             module = net.modules.get(network_layer_name, None)
             if module is not None and hasattr(self, 'weight') and not isinstance(module, modules.models.sd3.mmdit.QkvLinear):
                 try:
@@ -466,11 +557,8 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
                             bias = getattr(self, 'fp16_bias', None)
                             if bias is not None:
                                 bias = bias.clone().to(self.bias.device)
-                        updown, ex_bias = module.calc_updown(weight)
-
-                        if len(weight.shape) == 4 and weight.shape[1] == 9:
-                            # inpainting model. zero pad updown to make channel[1]  4 to 9
-                            updown = torch.nn.functional.pad(updown, (0, 0, 0, 0, 0, 5))
+                        cache_key = tuple((x.mtime, *name) for x, name in zip(loaded_networks[:i + 1], wanted_names))
+                        updown, ex_bias = calc_updown_cached(self, module, weight, cache_key)
 
                         self.weight.copy_((weight.to(dtype=updown.dtype) + updown).to(dtype=self.weight.dtype))
                         if ex_bias is not None and hasattr(self, 'bias'):
@@ -650,6 +738,8 @@ def network_MultiheadAttention_load_state_dict(self, *args, **kwargs):
 def process_network_files(names: list[str] | None = None):
     candidates = list(shared.walk_files(shared.cmd_opts.lora_dir, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
     candidates += list(shared.walk_files(shared.cmd_opts.lyco_dir_backcompat, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
+    metadata_index.index.update([x for x in candidates if os.path.splitext(x)[1].lower() == ".safetensors"])
+
     for filename in candidates:
         if os.path.isdir(filename):
             continue
@@ -687,6 +777,18 @@ def list_available_networks():
 
     process_network_files()
 
+    if shared.cmd_opts.hash_prefetch:
+        prefetch_network_hashes()
+
+
+def prefetch_network_hashes():
+    for entry in available_networks.values():
+        if entry.hash:
+            continue
+
+        for future in hashes.prefetch([(entry.filename, "lora/" + entry.name, entry.is_safetensors)]):
+            future.add_done_callback(lambda f, entry=entry: entry.set_hash(f.result() or ''))
+
 
 re_network_name = re.compile(r"(.*)\s*\([0-9a-fA-F]+\)")
 
@@ -27,6 +27,7 @@ def before_ui():
 networks.originals = lora_patches.LoraPatches()
 
 script_callbacks.on_model_loaded(networks.assign_network_names_to_compvis_modules)
+script_callbacks.on_model_loaded(lambda sd_model: networks.updown_cache.clear())
 script_callbacks.on_script_unloaded(unload)
 script_callbacks.on_before_ui(before_ui)
 script_callbacks.on_infotext_pasted(networks.infotext_pasted)
@@ -40,6 +41,8 @@ shared.options_templates.update(shared.options_section(('extra_networks', "Extra
     "lora_show_all": shared.OptionInfo(False, "Always show all networks on the Lora page").info("otherwise, those detected as for incompatible version of Stable Diffusion will be hidden"),
     "lora_hide_unknown_for_versions": shared.OptionInfo([], "Hide networks of unknown versions for model versions", gr.CheckboxGroup, {"choices": ["SD1", "SD2", "SDXL"]}),
     "lora_in_memory_limit": shared.OptionInfo(0, "Number of Lora networks to keep cached in memory", gr.Number, {"precision": 0}),
+    "lora_updown_cache_size": shared.OptionInfo(0, "Memory for caching calculated Lora weight changes (MB)", gr.Number, {"precision": 0}).info("makes switching between combinations of Loras used before faster; 0 = disable"),
+    "lora_updown_cache_device": shared.OptionInfo("GPU", "Device for cached Lora weight changes", gr.Radio, {"choices": ["GPU", "CPU"]}).info("CPU uses pinned RAM instead of VRAM, but changes have to be copied to GPU every time"),
     "lora_not_found_warning_console": shared.OptionInfo(False, "Lora not found warning in console"),
     "lora_not_found_gradio_warning": shared.OptionInfo(False, "Lora not found warning popup in webui"),
 }))
@@ -49,6 +49,10 @@ function setupExtraNetworksForTab(tabname) {
         }
 
         var applyFilter = function(force) {
+            if (extraNetworksLoadCards(tabname, tabname_full, true)) {
+                return; // the server does the search for this page
+            }
+
             var searchTerm = search.value.toLowerCase();
             gradioApp().querySelectorAll('#' + tabname + '_extra_tabs div.card').forEach(function(elem) {
                 var searchOnly = elem.querySelector('.search_only');
@@ -71,6 +75,10 @@ function setupExtraNetworksForTab(tabname) {
         };
 
         var applySort = function(force) {
+            if (extraNetworksLoadCards(tabname, tabname_full, true)) {
+                return; // the server does the sorting for this page
+            }
+
             var cards = gradioApp().querySelectorAll('#' + tabname_full + ' div.card');
             var parent = gradioApp().querySelector('#' + tabname_full + "_cards");
             var reverse = sort_dir.dataset.sortdir == "Descending";
@@ -192,6 +200,82 @@ function applyExtraNetworkSort(tabname_full) {
     setTimeout(doSort, 1);
 }
 
+function extraNetworksLoadCards(tabname, tabname_full, reset) {
+    /**
+     * Requests the next cards of a page from the server; used for pages that only have a placeholder for cards
+     * in their HTML, which happens when the extra_networks_cards_per_request setting is not 0. More cards are requested
+     * when the placeholder scrolls into view.
+     *
+     * @param tabname       The name of the active tab in the sd webui. Ex: txt2img, img2img, etc.
+     * @param tabname_full  The id of the page, made of tabname and the id of the extra networks tab. Ex: txt2img_lora.
+     * @param reset         Remove loaded cards and start over with the current search text and sort order.
+     * @return              false if the page has all of its cards in HTML.
+     */
+    var cards = gradioApp().getElementById(tabname_full + "_cards");
+    var more = cards ? cards.querySelector(":scope > .extra-network-more-cards") : null;
+    if (!more) {
+        return false;
+    }
+
+    if (reset) {
+        cards.querySelectorAll(":scope > .card").forEach(function(card) {
+            card.remove();
+        });
+        more.dataset.offset = 0;
+        more.dataset.request = (parseInt(more.dataset.request) || 0) + 1;
+        delete more.dataset.total;
+        more.loading = false;
+    } else if (more.loading || parseInt(more.dataset.offset) >= parseInt(more.dataset.total)) {
+        return true;
+    }
+
+    if (!more.observer) {
+        more.observer = new IntersectionObserver(function(entries) {
+            if (entries.some(function(x) {
+                return x.isIntersecting;
+            })) {
+                extraNetworksLoadCards(tabname, tabname_full, false);
+            }
+        }, {root: cards, rootMargin: "0px 0px 400px 0px"});
+        more.observer.observe(more);
+    }
+
+    var search = gradioApp().querySelector("#" + tabname_full + "_extra_search");
+    var sortDir = gradioApp().querySelector("#" + tabname_full + "_extra_sort_dir");
+    var activeSort = gradioApp().querySelector("#" + tabname_full + "_controls .extra-network-control--sort.extra-network-control--enabled");
+    var request = more.dataset.request;
+
+    more.loading = true;
+    requestGet("./sd_extra_networks/cards", {
+        page: tabname_full.substring(tabname.length + 1),
+        tabname: tabname,
+        search: search ? search.value : "",
+        sort: activeSort ? activeSort.dataset.sortkey : "default",
+        sort_dir: sortDir ? sortDir.dataset.sortdir : "Ascending",
+        offset: parseInt(more.dataset.offset) || 0,
+    }, function(data) {
+        if (more.dataset.request != request) {
+            return; // search text or sort order has changed while waiting for the response
+        }
+
+        more.loading = false;
+        more.insertAdjacentHTML("beforebegin", data.html);
+        more.dataset.offset = data.offset;
+        more.dataset.total = data.total;
+
+        // the observer is not called again if the placeholder is still in view after adding cards
+        if (cards.offsetParent && more.getBoundingClientRect().top < cards.getBoundingClientRect().bottom + 400) {
+            extraNetworksLoadCards(tabname, tabname_full, false);
+        }
+    }, function() {
+        if (more.dataset.request == request) {
+            more.loading = false;
+        }
+    });
+
+    return true;
+}
+
 var extraNetworksApplyFilter = {};
 var extraNetworksApplySort = {};
 var activePromptTextarea = {};
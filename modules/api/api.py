@@ -1,8 +1,12 @@
+import asyncio
 import base64
+import functools
 import io
+import json
 import os
 import time
 import datetime
+import uuid
 import uvicorn
 import ipaddress
 import requests
@@ -12,18 +16,20 @@ from io import BytesIO
 from fastapi import APIRouter, Depends, FastAPI, Request, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
-from modules.api import models
+from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, call_queue, cond_cache
+from modules.api import models, batching, jobs
 from modules.shared import opts
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
 from modules.textual_inversion.textual_inversion import create_embedding, train_embedding
 from modules.hypernetworks.hypernetwork import create_hypernetwork, train_hypernetwork
-from PIL import PngImagePlugin
+from PIL import Image, PngImagePlugin
 from modules.sd_models_config import find_checkpoint_config_near_filename
 from modules.realesrgan_model import get_realesrgan_models
 from modules import devices
@@ -31,7 +37,8 @@ from typing import Any
 import piexif
 import piexif.helper
 from contextlib import closing
-from modules.progress import create_task_id, add_task_to_queue, start_task, finish_task, current_task
+from modules.progress import create_task_id, add_task_to_queue, remove_task_from_queue, start_task, finish_task, current_task
+from modules.job_queue import Resource, Priority
 
 def script_name_to_index(name, scripts):
     try:
@@ -75,6 +82,9 @@ def verify_url(url):
 
 
 def decode_base64_to_image(encoding):
+    if isinstance(encoding, Image.Image):  # already decoded from a multipart/form-data request
+        return encoding
+
     if encoding.startswith("http://") or encoding.startswith("https://"):
         if not opts.api_enable_requests:
             raise HTTPException(status_code=500, detail="Requests not allowed")
@@ -99,37 +109,128 @@ def decode_base64_to_image(encoding):
         raise HTTPException(status_code=500, detail="Invalid encoded image") from e
 
 
-def encode_pil_to_base64(image):
-    with io.BytesIO() as output_bytes:
-        if isinstance(image, str):
-            return image
-        if opts.samples_format.lower() == 'png':
-            use_metadata = False
-            metadata = PngImagePlugin.PngInfo()
-            for key, value in image.info.items():
-                if isinstance(key, str) and isinstance(value, str):
-                    metadata.add_text(key, value)
-                    use_metadata = True
-            image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), quality=opts.jpeg_quality)
-
-        elif opts.samples_format.lower() in ("jpg", "jpeg", "webp"):
-            if image.mode in ("RGBA", "P"):
-                image = image.convert("RGB")
-            parameters = image.info.get('parameters', None)
-            exif_bytes = piexif.dump({
-                "Exif": { piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters or "", encoding="unicode") }
-            })
-            if opts.samples_format.lower() in ("jpg", "jpeg"):
-                image.save(output_bytes, format="JPEG", exif = exif_bytes, quality=opts.jpeg_quality)
-            else:
-                image.save(output_bytes, format="WEBP", exif = exif_bytes, quality=opts.jpeg_quality)
+image_media_types = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
 
-        else:
+
+def get_image_encoder(image_format=None, compression=None, lossless=False):
+    """
+    Returns a function that encodes a PIL image, with its generation parameters, into bytes of an image file.
+
+    image_format is one of png, jpg, jpeg and webp, and is the samples_format setting if not given. compression is zlib
+    level 0-9 for PNG (1 is fast; 6 is the default), and quality 1-100 for JPEG and WebP (jpeg_quality setting by default).
+    lossless makes a lossless WebP file, for which compression is the effort spent on making the file smaller.
+    """
+
+    if image_format is None:
+        image_format = opts.samples_format.lower()
+        if image_format not in image_media_types:
             raise HTTPException(status_code=500, detail="Invalid image format")
+    else:
+        image_format = image_format.lower()
+        if image_format not in image_media_types:
+            raise HTTPException(status_code=422, detail=f"Unsupported image format: {image_format}; use one of {', '.join(image_media_types)}")
+
+    def encode(image):
+        with io.BytesIO() as output_bytes:
+            if image_format == 'png':
+                use_metadata = False
+                metadata = PngImagePlugin.PngInfo()
+                for key, value in image.info.items():
+                    if isinstance(key, str) and isinstance(value, str):
+                        metadata.add_text(key, value)
+                        use_metadata = True
+                kwargs = {} if compression is None else {"compress_level": min(max(int(compression), 0), 9)}
+                image.save(output_bytes, format="PNG", pnginfo=(metadata if use_metadata else None), **kwargs)
+
+            else:
+                if image.mode in ("RGBA", "P"):
+                    image = image.convert("RGB")
+                parameters = image.info.get('parameters', None)
+                exif_bytes = piexif.dump({
+                    "Exif": { piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters or "", encoding="unicode") }
+                })
+                quality = opts.jpeg_quality if compression is None else min(max(int(compression), 1), 100)
+                if image_format in ("jpg", "jpeg"):
+                    image.save(output_bytes, format="JPEG", exif = exif_bytes, quality=quality)
+                else:
+                    image.save(output_bytes, format="WEBP", exif = exif_bytes, quality=quality, lossless=lossless)
+
+            return output_bytes.getvalue()
+
+    encode.media_type = image_media_types[image_format]
+    encode.extension = image_format
+
+    return encode
+
+
+def encode_pil_to_base64(image, encoder=None):
+    if isinstance(image, str):
+        return image
+
+    return base64.b64encode((encoder or get_image_encoder())(image))
+
+
+def images_response(request, images, encoder, **fields):
+    """
+    Returns a response with generated images and other fields, written out one image at a time as soon as it is encoded,
+    instead of as one JSON body built in memory.
+
+    If the client's Accept header has multipart/mixed, the response is a multipart/mixed body with a JSON part for the
+    fields followed by a part with the binary file of each image. Otherwise it is the usual JSON object, with images as
+    base64 strings.
+    """
+
+    fields_json = json.dumps(jsonable_encoder(fields), ensure_ascii=False, separators=(",", ":")).encode("utf8")
+
+    if request is not None and "multipart/mixed" in request.headers.get("accept", ""):
+        boundary = uuid.uuid4().hex
+
+        def parts():
+            yield f'--{boundary}\r\nContent-Type: application/json\r\nContent-Disposition: inline; name="response"\r\n\r\n'.encode() + fields_json + b"\r\n"
+            for index, image in enumerate(images):
+                data = image.encode() if isinstance(image, str) else encoder(image)
+                yield f'--{boundary}\r\nContent-Type: {encoder.media_type}\r\nContent-Disposition: inline; name="images"; filename="{index}.{encoder.extension}"\r\n\r\n'.encode() + data + b"\r\n"
+            yield f"--{boundary}--\r\n".encode()
+
+        return StreamingResponse(parts(), media_type=f"multipart/mixed; boundary={boundary}")
+
+    def json_parts():
+        yield b'{"images":['
+        for index, image in enumerate(images):
+            data = encode_pil_to_base64(image, encoder)
+            yield (b',"' if index else b'"') + (data.encode() if isinstance(data, str) else data) + b'"'
+        yield b"]" + (b"," + fields_json[1:] if fields else b"}")
 
-        bytes_data = output_bytes.getvalue()
+    return StreamingResponse(json_parts(), media_type="application/json")
 
-    return base64.b64encode(bytes_data)
+
+GenerationResult = namedtuple("GenerationResult", ["images", "encoder", "parameters", "info"])
+
+
+def generation_response(request, result):
+    return images_response(request, result.images, result.encoder, parameters=result.parameters, info=result.info)
+
+
+def in_event_loop(func):
+    """
+    Wraps a handler that only reads values in memory to run in the event loop, so that it answers at once even when all
+    threads of FastAPI's threadpool are busy.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def decode_uploaded_image(upload):
+    """Reads an image from a file of a multipart/form-data request."""
+
+    try:
+        return images.read(upload.file)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Invalid image file: {upload.filename}") from e
 
 
 def api_middleware(app: FastAPI):
@@ -207,43 +308,66 @@ class Api:
         self.router = APIRouter()
         self.app = app
         self.queue_lock = queue_lock
+        self.generation_lock = call_queue.job_lock(*call_queue.generation_resources, name="api generation")
+        self.extras_lock = call_queue.job_lock(Resource.upscaler, Resource.progress, priority=Priority.high, name="api extras")
+        self.interrogate_lock = call_queue.job_lock(Resource.sd_model, Resource.interrogator, Resource.progress, priority=Priority.high, name="api interrogate")
+        self.deepbooru_lock = call_queue.job_lock(Resource.interrogator, priority=Priority.high, name="api deepbooru")
+        self.refresh_lock = call_queue.job_lock(Resource.sd_model, priority=Priority.high, name="api refresh")
+        self.executor = ThreadPoolExecutor(max_workers=max(1, shared.cmd_opts.api_workers), thread_name_prefix="api worker")
+        self.generation_executor = ThreadPoolExecutor(max_workers=max(1, shared.cmd_opts.api_workers), thread_name_prefix="api generation")
+        # a job that fails before it starts generating, like one with an unknown sampler, must not stay queued
+        self.jobs = jobs.JobStore(ThreadPoolExecutor(max_workers=max(1, shared.cmd_opts.api_workers), thread_name_prefix="api job"), on_finish=lambda job: remove_task_from_queue(job.task_id))
+        self.txt2img_batcher = None
+        if shared.cmd_opts.api_batch_window > 0:
+            self.txt2img_batcher = batching.RequestBatcher(self.run_txt2img_batch, self.generation_lock, shared.cmd_opts.api_batch_window, shared.cmd_opts.api_batch_max_size)
         api_middleware(self.app)
-        self.add_api_route("/sdapi/v1/txt2img", self.text2imgapi, methods=["POST"], response_model=models.TextToImageResponse)
-        self.add_api_route("/sdapi/v1/img2img", self.img2imgapi, methods=["POST"], response_model=models.ImageToImageResponse)
-        self.add_api_route("/sdapi/v1/extra-single-image", self.extras_single_image_api, methods=["POST"], response_model=models.ExtrasSingleImageResponse)
-        self.add_api_route("/sdapi/v1/extra-batch-images", self.extras_batch_images_api, methods=["POST"], response_model=models.ExtrasBatchImagesResponse)
-        self.add_api_route("/sdapi/v1/png-info", self.pnginfoapi, methods=["POST"], response_model=models.PNGInfoResponse)
+        self.add_api_route("/sdapi/v1/txt2img", self.offloaded(self.text2imgapi, self.generation_executor), methods=["POST"], response_model=models.TextToImageResponse)
+        self.add_api_route("/sdapi/v1/img2img", self.offloaded(self.img2imgapi, self.generation_executor), methods=["POST"], response_model=models.ImageToImageResponse)
+        self.add_api_route("/sdapi/v1/img2img-multipart", self.img2imgapi_multipart, methods=["POST"], response_model=models.ImageToImageResponse)
+        self.add_api_route("/sdapi/v1/jobs/txt2img", in_event_loop(self.submit_txt2img_job), methods=["POST"], response_model=models.JobResponse)
+        self.add_api_route("/sdapi/v1/jobs/img2img", in_event_loop(self.submit_img2img_job), methods=["POST"], response_model=models.JobResponse)
+        self.add_api_route("/sdapi/v1/jobs/{job_id}", in_event_loop(self.get_job_status), methods=["GET"], response_model=models.JobResponse)
+        self.add_api_route("/sdapi/v1/jobs/{job_id}/result", in_event_loop(self.get_job_result), methods=["GET"])
+        self.add_api_route("/sdapi/v1/jobs/{job_id}", in_event_loop(self.remove_job), methods=["DELETE"], response_model=models.JobResponse)
+        self.add_api_route("/sdapi/v1/extra-single-image", self.offloaded(self.extras_single_image_api), methods=["POST"], response_model=models.ExtrasSingleImageResponse)
+        self.add_api_route("/sdapi/v1/extra-batch-images", self.offloaded(self.extras_batch_images_api), methods=["POST"], response_model=models.ExtrasBatchImagesResponse)
+        self.add_api_route("/sdapi/v1/png-info", self.offloaded(self.pnginfoapi), methods=["POST"], response_model=models.PNGInfoResponse)
         self.add_api_route("/sdapi/v1/progress", self.progressapi, methods=["GET"], response_model=models.ProgressResponse)
-        self.add_api_route("/sdapi/v1/interrogate", self.interrogateapi, methods=["POST"])
-        self.add_api_route("/sdapi/v1/interrupt", self.interruptapi, methods=["POST"])
-        self.add_api_route("/sdapi/v1/skip", self.skip, methods=["POST"])
-        self.add_api_route("/sdapi/v1/options", self.get_config, methods=["GET"], response_model=models.OptionsModel)
-        self.add_api_route("/sdapi/v1/options", self.set_config, methods=["POST"])
-        self.add_api_route("/sdapi/v1/cmd-flags", self.get_cmd_flags, methods=["GET"], response_model=models.FlagsModel)
-        self.add_api_route("/sdapi/v1/samplers", self.get_samplers, methods=["GET"], response_model=list[models.SamplerItem])
-        self.add_api_route("/sdapi/v1/schedulers", self.get_schedulers, methods=["GET"], response_model=list[models.SchedulerItem])
-        self.add_api_route("/sdapi/v1/upscalers", self.get_upscalers, methods=["GET"], response_model=list[models.UpscalerItem])
-        self.add_api_route("/sdapi/v1/latent-upscale-modes", self.get_latent_upscale_modes, methods=["GET"], response_model=list[models.LatentUpscalerModeItem])
+        self.add_api_route("/sdapi/v1/queue", in_event_loop(self.queueapi), methods=["GET"], response_model=models.QueueStatusResponse)
+        self.add_api_route("/sdapi/v1/interrogate", self.offloaded(self.interrogateapi), methods=["POST"])
+        self.add_api_route("/sdapi/v1/interrogate-batch", self.interrogatebatchapi, methods=["POST"])
+        self.add_api_route("/sdapi/v1/interrupt", in_event_loop(self.interruptapi), methods=["POST"])
+        self.add_api_route("/sdapi/v1/skip", in_event_loop(self.skip), methods=["POST"])
+        self.add_api_route("/sdapi/v1/options", in_event_loop(self.get_config), methods=["GET"], response_model=models.OptionsModel)
+        self.add_api_route("/sdapi/v1/options", self.offloaded(self.set_config), methods=["POST"])
+        self.add_api_route("/sdapi/v1/cmd-flags", in_event_loop(self.get_cmd_flags), methods=["GET"], response_model=models.FlagsModel)
+        self.add_api_route("/sdapi/v1/samplers", in_event_loop(self.get_samplers), methods=["GET"], response_model=list[models.SamplerItem])
+        self.add_api_route("/sdapi/v1/schedulers", in_event_loop(self.get_schedulers), methods=["GET"], response_model=list[models.SchedulerItem])
+        self.add_api_route("/sdapi/v1/upscalers", in_event_loop(self.get_upscalers), methods=["GET"], response_model=list[models.UpscalerItem])
+        self.add_api_route("/sdapi/v1/latent-upscale-modes", in_event_loop(self.get_latent_upscale_modes), methods=["GET"], response_model=list[models.LatentUpscalerModeItem])
         self.add_api_route("/sdapi/v1/sd-models", self.get_sd_models, methods=["GET"], response_model=list[models.SDModelItem])
-        self.add_api_route("/sdapi/v1/sd-vae", self.get_sd_vaes, methods=["GET"], response_model=list[models.SDVaeItem])
-        self.add_api_route("/sdapi/v1/hypernetworks", self.get_hypernetworks, methods=["GET"], response_model=list[models.HypernetworkItem])
-        self.add_api_route("/sdapi/v1/face-restorers", self.get_face_restorers, methods=["GET"], response_model=list[models.FaceRestorerItem])
+        self.add_api_route("/sdapi/v1/sd-vae", in_event_loop(self.get_sd_vaes), methods=["GET"], response_model=list[models.SDVaeItem])
+        self.add_api_route("/sdapi/v1/hypernetworks", in_event_loop(self.get_hypernetworks), methods=["GET"], response_model=list[models.HypernetworkItem])
+        self.add_api_route("/sdapi/v1/face-restorers", in_event_loop(self.get_face_restorers), methods=["GET"], response_model=list[models.FaceRestorerItem])
         self.add_api_route("/sdapi/v1/realesrgan-models", self.get_realesrgan_models, methods=["GET"], response_model=list[models.RealesrganItem])
-        self.add_api_route("/sdapi/v1/prompt-styles", self.get_prompt_styles, methods=["GET"], response_model=list[models.PromptStyleItem])
+        self.add_api_route("/sdapi/v1/prompt-styles", in_event_loop(self.get_prompt_styles), methods=["GET"], response_model=list[models.PromptStyleItem])
         self.add_api_route("/sdapi/v1/embeddings", self.get_embeddings, methods=["GET"], response_model=models.EmbeddingsResponse)
-        self.add_api_route("/sdapi/v1/refresh-embeddings", self.refresh_embeddings, methods=["POST"])
-        self.add_api_route("/sdapi/v1/refresh-checkpoints", self.refresh_checkpoints, methods=["POST"])
-        self.add_api_route("/sdapi/v1/refresh-vae", self.refresh_vae, methods=["POST"])
-        self.add_api_route("/sdapi/v1/create/embedding", self.create_embedding, methods=["POST"], response_model=models.CreateResponse)
-        self.add_api_route("/sdapi/v1/create/hypernetwork", self.create_hypernetwork, methods=["POST"], response_model=models.CreateResponse)
-        self.add_api_route("/sdapi/v1/train/embedding", self.train_embedding, methods=["POST"], response_model=models.TrainResponse)
-        self.add_api_route("/sdapi/v1/train/hypernetwork", self.train_hypernetwork, methods=["POST"], response_model=models.TrainResponse)
+        self.add_api_route("/sdapi/v1/refresh-embeddings", self.offloaded(self.refresh_embeddings), methods=["POST"])
+        self.add_api_route("/sdapi/v1/refresh-checkpoints", self.offloaded(self.refresh_checkpoints), methods=["POST"])
+        self.add_api_route("/sdapi/v1/refresh-vae", self.offloaded(self.refresh_vae), methods=["POST"])
+        self.add_api_route("/sdapi/v1/create/embedding", self.offloaded(self.create_embedding), methods=["POST"], response_model=models.CreateResponse)
+        self.add_api_route("/sdapi/v1/create/hypernetwork", self.offloaded(self.create_hypernetwork), methods=["POST"], response_model=models.CreateResponse)
+        self.add_api_route("/sdapi/v1/train/embedding", self.offloaded(self.train_embedding), methods=["POST"], response_model=models.TrainResponse)
+        self.add_api_route("/sdapi/v1/train/hypernetwork", self.offloaded(self.train_hypernetwork), methods=["POST"], response_model=models.TrainResponse)
         self.add_api_route("/sdapi/v1/memory", self.get_memory, methods=["GET"], response_model=models.MemoryResponse)
-        self.add_api_route("/sdapi/v1/unload-checkpoint", self.unloadapi, methods=["POST"])
-        self.add_api_route("/sdapi/v1/reload-checkpoint", self.reloadapi, methods=["POST"])
-        self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
-        self.add_api_route("/sdapi/v1/script-info", self.get_script_info, methods=["GET"], response_model=list[models.ScriptInfo])
-        self.add_api_route("/sdapi/v1/extensions", self.get_extensions_list, methods=["GET"], response_model=list[models.ExtensionItem])
+        self.add_api_route("/sdapi/v1/cond-cache", in_event_loop(self.get_cond_cache), methods=["GET"], response_model=models.CondCacheResponse)
+        self.add_api_route("/sdapi/v1/checkpoint-cache", in_event_loop(self.get_checkpoint_cache), methods=["GET"], response_model=models.CheckpointCacheResponse)
+        self.add_api_route("/sdapi/v1/checkpoint-cache/warmup", self.offloaded(self.warmup_checkpoint_cache), methods=["POST"], response_model=models.CheckpointCacheResponse)
+        self.add_api_route("/sdapi/v1/unload-checkpoint", self.offloaded(self.unloadapi), methods=["POST"])
+        self.add_api_route("/sdapi/v1/reload-checkpoint", self.offloaded(self.reloadapi), methods=["POST"])
+        self.add_api_route("/sdapi/v1/scripts", in_event_loop(self.get_scripts_list), methods=["GET"], response_model=models.ScriptsList)
+        self.add_api_route("/sdapi/v1/script-info", in_event_loop(self.get_script_info), methods=["GET"], response_model=list[models.ScriptInfo])
+        self.add_api_route("/sdapi/v1/extensions", self.offloaded(self.get_extensions_list), methods=["GET"], response_model=list[models.ExtensionItem])
 
         if shared.cmd_opts.api_server_stop:
             self.add_api_route("/sdapi/v1/server-kill", self.kill_webui, methods=["POST"])
@@ -276,6 +400,22 @@ class Api:
             return self.app.add_api_route(path, endpoint, dependencies=[Depends(self.auth)], **kwargs)
         return self.app.add_api_route(path, endpoint, **kwargs)
 
+    def offloaded(self, func, executor=None):
+        """
+        Wraps a handler that takes long, like generation, to run in executor (self.executor by default) instead of FastAPI's
+        threadpool, so that it does not hold a thread that quick handlers like progress need. Requests waiting for a worker
+        wait as coroutines. Generation runs in self.generation_executor, so that requests queued for the GPU do not hold
+        workers that other slow handlers like png-info or options need.
+        """
+
+        executor = executor or self.executor
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await asyncio.wrap_future(executor.submit(func, *args, **kwargs))
+
+        return wrapper
+
     def auth(self, credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
         if credentials.username in self.credentials:
             if compare_digest(credentials.password, self.credentials[credentials.username]):
@@ -429,8 +569,12 @@ class Api:
 
         return params
 
-    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+    def text2imgapi(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI, request: Request = None):
+        return generation_response(request, self.txt2img(txt2imgreq))
+
+    def txt2img(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI) -> GenerationResult:
         task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
+        encoder = get_image_encoder(txt2imgreq.image_format, txt2imgreq.image_compression, txt2imgreq.image_lossless)
 
         script_runner = scripts.scripts_txt2img
 
@@ -461,10 +605,20 @@ class Api:
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
+        args.pop('image_format', None)
+        args.pop('image_compression', None)
+        args.pop('image_lossless', None)
 
         add_task_to_queue(task_id)
 
-        with self.queue_lock:
+        batch_key = batching.txt2img_batch_key(txt2imgreq, args, script_args, selectable_scripts) if self.txt2img_batcher is not None else None
+        if batch_key is not None:
+            processed = self.txt2img_batcher.submit(batch_key, batching.BatchItem(task_id, args, script_args))
+            processed.wait_for_saving()
+
+            return GenerationResult(processed.images if send_images else [], encoder, vars(txt2imgreq), processed.js())
+
+        with self.generation_lock:
             with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
                 p.is_api = True
                 p.scripts = script_runner
@@ -485,12 +639,41 @@ class Api:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        # outside of the lock, so that the next request can start generating meanwhile
+        processed.wait_for_saving()
+
+        return GenerationResult(processed.images if send_images else [], encoder, vars(txt2imgreq), processed.js())
+
+    def run_txt2img_batch(self, items):
+        """Runs txt2img requests merged by self.txt2img_batcher as one batch; called with self.generation_lock held."""
+
+        with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **batching.merge_txt2img_args(items))) as p:
+            p.is_api = True
+            p.scripts = scripts.scripts_txt2img
+            p.outpath_grids = opts.outdir_txt2img_grids
+            p.outpath_samples = opts.outdir_txt2img_samples
+            p.script_args = tuple(items[0].script_args)  # batched requests have the same script args
 
-        return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+            try:
+                shared.state.begin(job="scripts_txt2img")
+                start_task(*[item.task_id for item in items])
+
+                processed = process_images(p)
+            finally:
+                for item in items:
+                    finish_task(item.task_id)
+
+                shared.state.end()
+                shared.total_tqdm.clear()
+
+            return batching.split_processed(p, processed, len(items))
+
+    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI, request: Request = None):
+        return generation_response(request, self.img2img(img2imgreq))
 
-    def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+    def img2img(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI) -> GenerationResult:
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
+        encoder = get_image_encoder(img2imgreq.image_format, img2imgreq.image_compression, img2imgreq.image_lossless)
 
         init_images = img2imgreq.init_images
         if init_images is None:
@@ -531,10 +714,13 @@ class Api:
 
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
+        args.pop('image_format', None)
+        args.pop('image_compression', None)
+        args.pop('image_lossless', None)
 
         add_task_to_queue(task_id)
 
-        with self.queue_lock:
+        with self.generation_lock:
             with closing(StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)) as p:
                 p.init_images = [decode_base64_to_image(x) for x in init_images]
                 p.is_api = True
@@ -556,20 +742,92 @@ class Api:
                     shared.state.end()
                     shared.total_tqdm.clear()
 
-        b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+        processed.wait_for_saving()
 
         if not img2imgreq.include_init_images:
             img2imgreq.init_images = None
             img2imgreq.mask = None
 
-        return models.ImageToImageResponse(images=b64images, parameters=vars(img2imgreq), info=processed.js())
+        return GenerationResult(processed.images if send_images else [], encoder, vars(img2imgreq), processed.js())
+
+    async def img2imgapi_multipart(self, request: Request):
+        """
+        img2img for a multipart/form-data request, which saves encoding images as base64: init images are files in the
+        init_images field, the mask is a file in the mask field, and other parameters are a JSON object in the request field.
+        """
+
+        form = await request.form()
+
+        try:
+            try:
+                img2imgreq = models.StableDiffusionImg2ImgProcessingAPI(**json.loads(form.get("request") or "{}"))
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=f"Invalid request field: {e}") from e
+
+            init_files = [x for x in form.getlist("init_images") if not isinstance(x, str)]
+            mask_file = form.get("mask")
+
+            def run():
+                if init_files:
+                    img2imgreq.init_images = [decode_uploaded_image(x) for x in init_files]
+                if mask_file is not None and not isinstance(mask_file, str):
+                    img2imgreq.mask = decode_uploaded_image(mask_file)
+
+                img2imgreq.include_init_images = False  # decoded images can't be sent back as parameters
+
+                return self.img2imgapi(img2imgreq, request)
+
+            return await asyncio.wrap_future(self.generation_executor.submit(run))
+        finally:
+            await form.close()
+
+    def job_response(self, job):
+        return models.JobResponse(id=job.id, kind=job.kind, status=job.status, task_id=job.task_id, submitted_at=job.submitted_at, started_at=job.started_at, finished_at=job.finished_at, error=job.error)
+
+    def submit_txt2img_job(self, txt2imgreq: models.StableDiffusionTxt2ImgProcessingAPI):
+        txt2imgreq.force_task_id = txt2imgreq.force_task_id or create_task_id("txt2img")
+        add_task_to_queue(txt2imgreq.force_task_id)
+
+        return self.job_response(self.jobs.submit("txt2img", txt2imgreq.force_task_id, self.txt2img, txt2imgreq))
+
+    def submit_img2img_job(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
+        img2imgreq.force_task_id = img2imgreq.force_task_id or create_task_id("img2img")
+        add_task_to_queue(img2imgreq.force_task_id)
+
+        return self.job_response(self.jobs.submit("img2img", img2imgreq.force_task_id, self.img2img, img2imgreq))
+
+    def get_job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+        return job
+
+    def get_job_status(self, job_id: str):
+        return self.job_response(self.get_job(job_id))
+
+    def get_job_result(self, job_id: str, request: Request):
+        """Returns the result of a finished job in the same form as txt2img and img2img endpoints do, or the job's error."""
+
+        job = self.get_job(job_id)
+        if job.status in ("pending", "running", "cancelled"):
+            raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+
+        return generation_response(request, job.future.result())
+
+    def remove_job(self, job_id: str):
+        job = self.jobs.remove(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+        return self.job_response(job)
 
     def extras_single_image_api(self, req: models.ExtrasSingleImageRequest):
         reqDict = setUpscalers(req)
 
         reqDict['image'] = decode_base64_to_image(reqDict['image'])
 
-        with self.queue_lock:
+        with self.extras_lock:
             result = postprocessing.run_extras(extras_mode=0, image_folder="", input_dir="", output_dir="", save_output=False, **reqDict)
 
         return models.ExtrasSingleImageResponse(image=encode_pil_to_base64(result[0][0]), html_info=result[1])
@@ -580,7 +838,7 @@ class Api:
         image_list = reqDict.pop('imageList', [])
         image_folder = [decode_base64_to_image(x.data) for x in image_list]
 
-        with self.queue_lock:
+        with self.extras_lock:
             result = postprocessing.run_extras(extras_mode=1, image_folder=image_folder, image="", input_dir="", output_dir="", save_output=False, **reqDict)
 
         return models.ExtrasBatchImagesResponse(images=list(map(encode_pil_to_base64, result[0])), html_info=result[1])
@@ -627,6 +885,9 @@ class Api:
 
         return models.ProgressResponse(progress=progress, eta_relative=eta_relative, state=shared.state.dict(), current_image=current_image, textinfo=shared.state.textinfo, current_task=current_task)
 
+    def queueapi(self):
+        return models.QueueStatusResponse(**call_queue.scheduler.stats())
+
     def interrogateapi(self, interrogatereq: models.InterrogateRequest):
         image_b64 = interrogatereq.image
         if image_b64 is None:
@@ -636,21 +897,68 @@ class Api:
         img = img.convert('RGB')
 
         # Override object param
-        with self.queue_lock:
-            if interrogatereq.model == "clip":
+        if interrogatereq.model == "clip":
+            with self.interrogate_lock:
                 processed = shared.interrogator.interrogate(img)
-            elif interrogatereq.model == "deepdanbooru":
+        elif interrogatereq.model == "deepdanbooru":
+            with self.deepbooru_lock:
                 processed = deepbooru.model.tag(img)
-            else:
-                raise HTTPException(status_code=404, detail="Model not found")
+        else:
+            raise HTTPException(status_code=404, detail="Model not found")
 
         return models.InterrogateResponse(caption=processed)
 
+    def interrogatebatchapi(self, req: models.InterrogateBatchRequest):
+        """Interrogates many images with the models kept loaded; streams one JSON line per image as soon as it is done."""
+
+        if req.model == "clip":
+            lock = self.interrogate_lock
+            interrogate_batch = shared.interrogator.interrogate_batch
+        elif req.model == "deepdanbooru":
+            lock = self.deepbooru_lock
+            interrogate_batch = deepbooru.model.tag_batch
+        else:
+            raise HTTPException(status_code=404, detail="Model not found")
+
+        def decoded_images():
+            for image_b64 in req.images:
+                yield decode_base64_to_image(image_b64).convert('RGB')
+
+        def results():
+            with lock:
+                for index, caption in enumerate(interrogate_batch(decoded_images(), batch_size=max(1, req.batch_size))):
+                    yield json.dumps({"index": index, "caption": caption}) + "\n"
+
+        return StreamingResponse(results(), media_type="application/x-ndjson")
+
     def interruptapi(self):
         shared.state.interrupt()
 
         return {}
 
+    def get_cond_cache(self):
+        return models.CondCacheResponse(**cond_cache.conds.stats())
+
+    def get_checkpoint_cache(self):
+        return models.CheckpointCacheResponse(**sd_models.checkpoints_loaded.stats())
+
+    def warmup_checkpoint_cache(self, req: models.CheckpointCacheWarmupRequest):
+        checkpoint_infos = []
+        for title in req.checkpoints:
+            checkpoint_info = sd_models.get_closet_checkpoint_match(title)
+            if checkpoint_info is None:
+                raise HTTPException(status_code=404, detail=f"Checkpoint not found: {title}")
+
+            checkpoint_infos.append(checkpoint_info)
+
+        if not sd_models.checkpoints_loaded.enabled():
+            raise HTTPException(status_code=400, detail="Checkpoint cache is disabled; set sd_checkpoint_cache or sd_checkpoint_cache_ram")
+
+        with call_queue.job_lock(Resource.checkpoint_cache, priority=Priority.low, name="checkpoint cache warm-up"):
+            sd_models.warm_up_checkpoint_cache(checkpoint_infos)
+
+        return self.get_checkpoint_cache()
+
     def unloadapi(self):
         sd_models.unload_model_weights()
 
@@ -769,15 +1077,15 @@ class Api:
         }
 
     def refresh_embeddings(self):
-        with self.queue_lock:
+        with self.refresh_lock:
             sd_hijack.model_hijack.embedding_db.load_textual_inversion_embeddings(force_reload=True)
 
     def refresh_checkpoints(self):
-        with self.queue_lock:
+        with self.refresh_lock:
             shared.refresh_checkpoints()
 
     def refresh_vae(self):
-        with self.queue_lock:
+        with self.refresh_lock:
             shared_items.refresh_vae_list()
 
     def create_embedding(self, args: dict):
@@ -0,0 +1,165 @@
+import threading
+
+from modules import extra_networks, shared
+from modules.processing import Processed, get_fixed_seed
+
+# request fields that can differ between the requests merged into one batch
+per_item_fields = ('prompt', 'negative_prompt', 'seed', 'subseed', 'hr_prompt', 'hr_negative_prompt', 'force_task_id')
+
+
+class BatchItem:
+    def __init__(self, task_id, args, script_args):
+        self.task_id = task_id
+        self.args = args
+        self.script_args = script_args
+        self.result = None
+        self.error = None
+
+
+class BatchGroup:
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class RequestBatcher:
+    """
+    Merges compatible API requests that arrive close together into one batch.
+
+    The first request of a group waits for up to `window` seconds (and then for the lock) while other compatible requests
+    join it, then runs the whole group with `run_batch`; the other requests wait for their part of the results. A group
+    stops accepting requests once it has `max_size` items or once it starts running.
+    """
+
+    def __init__(self, run_batch, lock, window, max_size):
+        self.run_batch = run_batch
+        self.lock = lock
+        self.window = window
+        self.max_size = max(1, max_size)
+        self.groups_lock = threading.Lock()
+        self.open_groups = {}
+
+    def submit(self, key, item):
+        with self.groups_lock:
+            group = self.open_groups.get(key)
+            is_leader = group is None
+            if is_leader:
+                group = self.open_groups[key] = BatchGroup()
+
+            group.items.append(item)
+            if len(group.items) >= self.max_size:
+                self.close(key, group)
+
+        if is_leader:
+            group.full.wait(self.window)
+
+            with self.lock:
+                with self.groups_lock:
+                    self.close(key, group)
+
+                try:
+                    results = self.run_batch(group.items)
+                    for x, result in zip(group.items, results):
+                        x.result = result
+                except Exception as e:
+                    for x in group.items:
+                        x.error = e
+                finally:
+                    group.done.set()
+        else:
+            group.done.wait()
+
+        if item.error is not None:
+            raise item.error
+
+        return item.result
+
+    def close(self, key, group):
+        if self.open_groups.get(key) is group:
+            del self.open_groups[key]
+
+        group.full.set()
+
+
+def txt2img_batch_key(request, args, script_args, selectable_scripts):
+    """Returns a value that is equal for requests that can run as one batch, or None if the request can't be batched."""
+
+    if selectable_scripts is not None or request.alwayson_scripts or request.override_settings:
+        return None
+
+    if args.get('batch_size', 1) != 1 or args.get('n_iter', 1) != 1:
+        return None
+
+    if isinstance(args.get('prompt'), list) or isinstance(args.get('negative_prompt'), list):
+        return None
+
+    # extra networks of the first prompt are used for the whole batch, so only prompts with the same ones can be merged
+    styles = args.get('styles') or []
+    prompts = [
+        shared.prompt_styles.apply_styles_to_prompt(args.get('prompt', ''), styles),
+        shared.prompt_styles.apply_negative_styles_to_prompt(args.get('negative_prompt', ''), styles),
+    ]
+    if args.get('enable_hr'):
+        prompts += [
+            shared.prompt_styles.apply_styles_to_prompt(args.get('hr_prompt') or args.get('prompt', ''), styles),
+            shared.prompt_styles.apply_negative_styles_to_prompt(args.get('hr_negative_prompt') or args.get('negative_prompt', ''), styles),
+        ]
+
+    networks = [extra_networks.extra_networks_key(x) for x in prompts]
+
+    shared_args = {k: v for k, v in args.items() if k not in per_item_fields}
+    return repr(sorted(shared_args.items(), key=lambda x: x[0])), repr(script_args), repr(networks)
+
+
+def merge_txt2img_args(items):
+    """Builds arguments for a StableDiffusionProcessingTxt2Img that makes every item's image in one batch."""
+
+    args = dict(items[0].args)
+
+    args['prompt'] = [x.args.get('prompt', '') for x in items]
+    args['negative_prompt'] = [x.args.get('negative_prompt', '') for x in items]
+    args['seed'] = [get_fixed_seed(x.args.get('seed', -1)) for x in items]
+    args['subseed'] = [get_fixed_seed(x.args.get('subseed', -1)) for x in items]
+    args['batch_size'] = len(items)
+    args['n_iter'] = 1
+    args['do_not_save_grid'] = True
+    args['force_task_id'] = None
+
+    if args.get('enable_hr'):
+        args['hr_prompt'] = [x.args.get('hr_prompt') or x.args.get('prompt', '') for x in items]
+        args['hr_negative_prompt'] = [x.args.get('hr_negative_prompt') or x.args.get('negative_prompt', '') for x in items]
+
+    return args
+
+
+def split_processed(p, processed, count):
+    """Splits the result of a merged batch back into one Processed per request."""
+
+    images = processed.images[processed.index_of_first_image:]
+    if len(images) != count:
+        raise RuntimeError(f"merged batch of {count} requests produced {len(images)} images")
+
+    res = []
+    for i, image in enumerate(images):
+        infotext = processed.infotexts[processed.index_of_first_image + i]
+
+        item = Processed(
+            p,
+            images_list=[image],
+            seed=processed.all_seeds[i],
+            info=infotext,
+            subseed=processed.all_subseeds[i],
+            all_prompts=[processed.all_prompts[i]],
+            all_negative_prompts=[processed.all_negative_prompts[i]],
+            all_seeds=[processed.all_seeds[i]],
+            all_subseeds=[processed.all_subseeds[i]],
+            infotexts=[infotext],
+        )
+        item.prompt = processed.all_prompts[i]
+        item.negative_prompt = processed.all_negative_prompts[i]
+        item.batch_size = 1
+
+        res.append(item)
+
+    return res
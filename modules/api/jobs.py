@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class Job:
+    def __init__(self, kind, task_id):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.task_id = task_id
+        self.future = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def status(self):
+        if self.future.cancelled():
+            return "cancelled"
+        if not self.future.done():
+            return "running" if self.started_at is not None else "pending"
+
+        return "failed" if self.future.exception() is not None else "done"
+
+    @property
+    def error(self):
+        if self.status != "failed":
+            return None
+
+        e = self.future.exception()
+        return getattr(e, "detail", None) or str(e) or type(e).__name__
+
+
+class JobStore:
+    """
+    Requests submitted to the API to run in background: the client gets a job id at once and asks for the result later,
+    so that requests waiting for their turn hold neither an HTTP connection nor a thread.
+
+    Jobs run in `executor`. Finished jobs are kept with their results for `keep_seconds`, and at most `max_finished` of
+    them; older ones are dropped when new jobs are submitted or looked up. `on_finish` is called with the job when it
+    ends, whether it is done, failed or cancelled.
+    """
+
+    def __init__(self, executor, keep_seconds=3600, max_finished=256, on_finish=None):
+        self.executor = executor
+        self.on_finish = on_finish
+        self.keep_seconds = keep_seconds
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+
+    def submit(self, kind, task_id, func, *args):
+        job = Job(kind, task_id)
+
+        def run():
+            job.started_at = time.time()
+            try:
+                return func(*args)
+            finally:
+                job.finished_at = time.time()
+                if self.on_finish is not None:
+                    self.on_finish(job)
+
+        with self.lock:
+            self.prune()
+            job.future = self.executor.submit(run)
+            self.jobs[job.id] = job
+
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            self.prune()
+            return self.jobs.get(job_id)
+
+    def remove(self, job_id):
+        """Forgets the job, cancelling it if it has not started yet; returns the job, or None if there is no such job."""
+
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+
+        if job is not None and job.future.cancel():
+            job.finished_at = time.time()
+            if self.on_finish is not None:
+                self.on_finish(job)
+
+        return job
+
+    def prune(self):
+        finished = [job for job in self.jobs.values() if job.future.done()]
+        finished.sort(key=lambda job: job.finished_at or job.submitted_at)
+
+        now = time.time()
+        for index, job in enumerate(finished):
+            if len(finished) - index > self.max_finished or (job.finished_at or job.submitted_at) < now - self.keep_seconds:
+                del self.jobs[job.id]
@@ -109,6 +109,9 @@ StableDiffusionTxt2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "image_format", "type": str, "default": None},
+        {"key": "image_compression", "type": int, "default": None},
+        {"key": "image_lossless", "type": bool, "default": False},
     ]
 ).generate_model()
 
@@ -128,6 +131,9 @@ StableDiffusionImg2ImgProcessingAPI = PydanticModelGenerator(
         {"key": "alwayson_scripts", "type": dict, "default": {}},
         {"key": "force_task_id", "type": str, "default": None},
         {"key": "infotext", "type": str, "default": None},
+        {"key": "image_format", "type": str, "default": None},
+        {"key": "image_compression", "type": int, "default": None},
+        {"key": "image_lossless", "type": bool, "default": False},
     ]
 ).generate_model()
 
@@ -141,6 +147,16 @@ class ImageToImageResponse(BaseModel):
     parameters: dict
     info: str
 
+class JobResponse(BaseModel):
+    id: str = Field(title="Job ID", description="The ID to get the job's status and result with.")
+    kind: str = Field(title="Kind", description="What the job does: txt2img or img2img.")
+    status: Literal["pending", "running", "done", "failed", "cancelled"] = Field(title="Status")
+    task_id: str = Field(title="Task ID", description="The ID to follow the job's progress with /internal/progress.")
+    submitted_at: float = Field(title="Submitted at", description="Unix time when the job was submitted.")
+    started_at: Optional[float] = Field(default=None, title="Started at", description="Unix time when the job started running.")
+    finished_at: Optional[float] = Field(default=None, title="Finished at", description="Unix time when the job finished.")
+    error: Optional[str] = Field(default=None, title="Error", description="Why the job failed.")
+
 class ExtrasBaseRequest(BaseModel):
     resize_mode: Literal[0, 1] = Field(default=0, title="Resize Mode", description="Sets the resize mode: 0 to upscale by upscaling_resize amount, 1 to upscale up to upscaling_resize_h x upscaling_resize_w.")
     show_extras_results: bool = Field(default=True, title="Show results", description="Should the backend return the generated image?")
@@ -193,6 +209,16 @@ class ProgressResponse(BaseModel):
     current_image: str = Field(default=None, title="Current image", description="The current image in base64 format. opts.show_progress_every_n_steps is required for this to work.")
     textinfo: str = Field(default=None, title="Info text", description="Info text used by WebUI.")
 
+class QueueStatusResponse(BaseModel):
+    queued: dict[str, int] = Field(title="Queued", description="Number of jobs waiting, by priority")
+    queue_depth: int = Field(title="Queue depth", description="Total number of jobs waiting")
+    waiting: list[dict] = Field(title="Waiting", description="Jobs waiting for resources, in the order they will be started")
+    running: list[dict] = Field(title="Running", description="Jobs holding resources right now")
+    busy_resources: list[str] = Field(title="Busy resources", description="Resources held by running jobs")
+    completed: int = Field(title="Completed", description="Number of jobs finished since startup")
+    average_wait: float = Field(title="Average wait", description="Average time jobs spent waiting in queue, in seconds")
+    max_wait: float = Field(title="Max wait", description="Longest time a job spent waiting in queue, in seconds")
+
 class InterrogateRequest(BaseModel):
     image: str = Field(default="", title="Image", description="Image to work on, must be a Base64 string containing the image's data.")
     model: str = Field(default="clip", title="Model", description="The interrogate model used.")
@@ -200,6 +226,11 @@ class InterrogateRequest(BaseModel):
 class InterrogateResponse(BaseModel):
     caption: str = Field(default=None, title="Caption", description="The generated caption for the image.")
 
+class InterrogateBatchRequest(BaseModel):
+    images: list[str] = Field(default=[], title="Images", description="Images to work on, each a Base64 string containing the image's data.")
+    model: str = Field(default="clip", title="Model", description="The interrogate model used.")
+    batch_size: int = Field(default=8, title="Batch size", description="Number of images processed at once.")
+
 class TrainResponse(BaseModel):
     info: str = Field(title="Train info", description="Response string from train embedding or hypernetwork task.")
 
@@ -298,6 +329,35 @@ class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
 
+class CondCacheResponse(BaseModel):
+    size: int = Field(title="Size", description="Number of text encoder results in memory")
+    max_size: int = Field(title="Max size", description="Maximum number of text encoder results kept in memory")
+    hits: int = Field(title="Hits", description="Number of lookups answered from memory")
+    disk_hits: int = Field(title="Disk hits", description="Number of lookups answered from the disk cache")
+    misses: int = Field(title="Misses", description="Number of lookups that required running the text encoder")
+
+
+class CheckpointCacheEntry(BaseModel):
+    title: str = Field(title="Title", description="Title of the checkpoint")
+    size: int = Field(title="Size", description="Size of the cached state dict, in bytes")
+    hits: int = Field(title="Hits", description="Number of times the checkpoint was loaded from cache")
+    time_added: float = Field(title="Time added", description="When the checkpoint was put into cache, as a unix timestamp")
+    time_used: float = Field(title="Time used", description="When the checkpoint was last loaded from cache, as a unix timestamp")
+
+
+class CheckpointCacheResponse(BaseModel):
+    size: int = Field(title="Size", description="Total size of cached state dicts, in bytes")
+    max_size: int = Field(title="Max size", description="Maximum total size, in bytes; 0 means no limit by size")
+    max_count: int = Field(title="Max count", description="Maximum number of cached checkpoints; 0 means no limit by count")
+    storage: str = Field(title="Storage", description="Type of memory used for cached checkpoints")
+    misses: int = Field(title="Misses", description="Number of checkpoint loads that had to read from disk")
+    evictions: int = Field(title="Evictions", description="Number of checkpoints removed from cache to stay within limits")
+    entries: list[CheckpointCacheEntry] = Field(title="Entries", description="Cached checkpoints, least recently used first")
+
+
+class CheckpointCacheWarmupRequest(BaseModel):
+    checkpoints: list[str] = Field(default=[], title="Checkpoints", description="Titles or names of checkpoints to read into cache")
+
 
 class ScriptsList(BaseModel):
     txt2img: list = Field(default=None, title="Txt2img", description="Titles of scripts (txt2img)")
@@ -3,14 +3,29 @@ from functools import wraps
 import html
 import time
 
-from modules import shared, progress, errors, devices, fifo_lock, profiling
+from modules import shared, progress, errors, devices, job_queue, profiling
+from modules.job_queue import Resource, Priority  # noqa: F401
 
-queue_lock = fifo_lock.FIFOLock()
+scheduler = job_queue.JobScheduler()
 
+# locks every resource; kept for code that needs to run with nothing else going on
+queue_lock = scheduler.lock(name="queue_lock")
+
+# what txt2img and img2img use: everything except the interrogation models
+generation_resources = (Resource.sd_model, Resource.upscaler, Resource.progress, Resource.cpu)
+
+
+def job_lock(*resources, priority=Priority.normal, name=None):
+    """Returns a lock for just the listed resources (all of them if none are listed); see job_queue.JobScheduler."""
+
+    return scheduler.lock(*resources, priority=priority, name=name)
+
+
+def wrap_queued_call(func, resources=None, priority=Priority.normal):
+    lock = job_lock(*(resources or ()), priority=priority, name=getattr(func, "__name__", None))
 
-def wrap_queued_call(func):
     def f(*args, **kwargs):
-        with queue_lock:
+        with lock:
             res = func(*args, **kwargs)
 
         return res
@@ -18,7 +33,9 @@ def wrap_queued_call(func):
     return f
 
 
-def wrap_gradio_gpu_call(func, extra_outputs=None):
+def wrap_gradio_gpu_call(func, extra_outputs=None, resources=None, priority=Priority.normal):
+    lock = job_lock(*(resources or ()), priority=priority, name=getattr(func, "__name__", None))
+
     @wraps(func)
     def f(*args, **kwargs):
 
@@ -29,7 +46,7 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         else:
             id_task = None
 
-        with queue_lock:
+        with lock:
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
 
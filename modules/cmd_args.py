@@ -101,6 +101,9 @@ parser.add_argument("--disable-safe-unpickle", action='store_true', help="disabl
 parser.add_argument("--api", action='store_true', help="use api=True to launch the API together with the webui (use --nowebui instead for only the API)")
 parser.add_argument("--api-auth", type=str, help='Set authentication for API like "username:password"; or comma-delimit multiple like "u1:p1,u2:p2,u3:p3"', default=None)
 parser.add_argument("--api-log", action='store_true', help="use api-log=True to enable logging of all API requests")
+parser.add_argument("--api-batch-window", type=float, default=0, help="merge compatible /sdapi/v1/txt2img requests that arrive within this many seconds of each other into one batch; 0 disables batching")
+parser.add_argument("--api-batch-max-size", type=int, default=8, help="maximum number of requests merged into one batch by --api-batch-window")
+parser.add_argument("--api-workers", type=int, default=16, help="number of threads that run slow API requests; generation, other slow requests and background jobs each get this many, and requests beyond that wait without holding a thread")
 parser.add_argument("--nowebui", action='store_true', help="use api=True to launch the API instead of the webui")
 parser.add_argument("--ui-debug-mode", action='store_true', help="Don't load model to quickly launch UI")
 parser.add_argument("--device-id", type=str, help="Select the default CUDA device to use (export CUDA_VISIBLE_DEVICES=0,1,etc might be needed before)", default=None)
@@ -115,6 +118,8 @@ parser.add_argument("--gradio-queue", action='store_true', help="does not do any
 parser.add_argument("--no-gradio-queue", action='store_true', help="Disables gradio queue; causes the webpage to use http requests instead of websockets; was the default in earlier versions")
 parser.add_argument("--skip-version-check", action='store_true', help="Do not check versions of torch and xformers")
 parser.add_argument("--no-hashing", action='store_true', help="disable sha256 hashing of checkpoints to help loading performance", default=False)
+parser.add_argument("--hash-prefetch", action='store_true', help="calculate sha256 of all checkpoints, LoRAs and embeddings that are not in cache yet in background at startup", default=False)
+parser.add_argument("--hash-workers", type=int, help="number of threads used by --hash-prefetch to calculate hashes", default=2)
 parser.add_argument("--no-download-sd-model", action='store_true', help="don't download SD1.5 model even if no model is found in --ckpt-dir", default=False)
 parser.add_argument('--subpath', type=str, help='customize the subpath for gradio, use with reverse proxy')
 parser.add_argument('--add-stop-route', action='store_true', help='does not do anything')
@@ -0,0 +1,175 @@
+import collections
+import hashlib
+import threading
+
+import torch
+
+from modules import cache, devices, shared
+
+cache_lock = threading.Lock()
+
+
+class CondCache:
+    """
+    LRU cache for text encoder outputs, shared by all generations.
+
+    Entries are keyed by the texts of one prompt's schedule plus everything about the loaded model that changes the result
+    (see get_state_key), and can optionally be written to the disk cache so they survive restarts.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with cache_lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if shared.opts.cond_cache_disk:
+            entry = cache.cache("conds").get(disk_key(key))
+            if entry is not None:
+                entry = (to_device(entry[0], devices.device), entry[1])
+                self.store(key, entry)
+
+                with cache_lock:
+                    self.disk_hits += 1
+
+                return entry
+
+        with cache_lock:
+            self.misses += 1
+
+        return None
+
+    def put(self, key, entry):
+        self.store(key, entry)
+
+        if shared.opts.cond_cache_disk:
+            cache.cache("conds")[disk_key(key)] = (to_device(entry[0], devices.cpu), entry[1])
+
+    def store(self, key, entry):
+        with cache_lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > max(0, shared.opts.cond_cache_size):
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with cache_lock:
+            self.entries.clear()
+
+    def stats(self):
+        with cache_lock:
+            return {
+                "size": len(self.entries),
+                "max_size": shared.opts.cond_cache_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+class BoundCondCache:
+    """CondCache lookups for one model state; passed to prompt_parser.get_learned_conditioning."""
+
+    def __init__(self, cond_cache, state_key):
+        self.cond_cache = cond_cache
+        self.state_key = state_key
+
+    def get_learned_conditioning(self, model, texts):
+        from modules.sd_hijack import model_hijack
+
+        key = (self.state_key, tuple(texts), getattr(texts, 'is_negative_prompt', False), getattr(texts, 'width', None), getattr(texts, 'height', None))
+
+        entry = self.cond_cache.get(key)
+        if entry is not None:
+            conds, extra_generation_params = entry
+            apply_extra_generation_params(model_hijack.extra_generation_params, extra_generation_params)
+            return conds
+
+        params_before = dict(model_hijack.extra_generation_params)
+        conds = model.get_learned_conditioning(texts)
+        extra_generation_params = {k: v for k, v in model_hijack.extra_generation_params.items() if params_before.get(k) != v}
+
+        self.cond_cache.put(key, (conds, extra_generation_params))
+        return conds
+
+
+def apply_extra_generation_params(dest, params):
+    """Re-adds infotext fields the text encoder would have added if it ran; TI hashes are merged like sd_hijack_clip does."""
+
+    for k, v in params.items():
+        if k == "TI hashes" and dest.get(k) and v not in dest[k]:
+            v = f"{v}, {dest[k]}"
+
+        dest[k] = v
+
+
+def to_device(x, device):
+    if isinstance(x, torch.Tensor):
+        return x.to(device)
+
+    if isinstance(x, dict):
+        return type(x)({k: to_device(v, device) for k, v in x.items()})
+
+    if isinstance(x, (list, tuple)):
+        return type(x)(to_device(v, device) for v in x)
+
+    return x
+
+
+def disk_key(key):
+    return hashlib.sha256(repr(key).encode("utf8")).hexdigest()
+
+
+def embeddings_fingerprint():
+    """Identifies the set of loaded textual inversion embeddings and their contents."""
+
+    from modules.sd_hijack import model_hijack
+
+    embeddings = model_hijack.embedding_db.word_embeddings.values()
+    return tuple((x.name, x.step, x.vectors, x.hash or x.checksum()) for x in embeddings)
+
+
+def get_state_key(sd_model, extra_network_data):
+    """Returns a value describing everything besides prompt text that changes text encoder outputs."""
+
+    checkpoint_info = sd_model.sd_checkpoint_info
+
+    return (
+        checkpoint_info.sha256 or checkpoint_info.filename,
+        embeddings_fingerprint(),
+        tuple((name, tuple(tuple(map(str, params.items)) for params in params_list)) for name, params_list in sorted((extra_network_data or {}).items())),
+        shared.opts.emphasis,
+        shared.opts.CLIP_stop_at_last_layers,
+        shared.opts.sdxl_clip_l_skip,
+        shared.opts.sd3_enable_t5,
+        shared.opts.sdxl_refiner_low_aesthetic_score,
+        shared.opts.sdxl_refiner_high_aesthetic_score,
+        shared.opts.textual_inversion_add_hashes_to_infotext,
+        shared.opts.comma_padding_backtrack,
+        shared.opts.use_old_emphasis_implementation,
+        shared.opts.sdxl_crop_left,
+        shared.opts.sdxl_crop_top,
+        shared.opts.fp8_storage,
+        shared.opts.cache_fp16_weight,
+    )
+
+
+conds = CondCache()
+
+
+def bind(sd_model, extra_network_data):
+    """Returns a BoundCondCache for the current model state, or None if the cache is disabled."""
+
+    if shared.opts.cond_cache_size <= 0:
+        return None
+
+    return BoundCondCache(conds, get_state_key(sd_model, extra_network_data))
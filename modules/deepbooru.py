@@ -4,7 +4,7 @@ import re
 import torch
 import numpy as np
 
-from modules import modelloader, paths, deepbooru_model, devices, images, shared
+from modules import modelloader, paths, deepbooru_model, devices, images, shared, util
 
 re_special = re.compile(r'([\\()])')
 
@@ -46,20 +46,36 @@ class DeepDanbooru:
 
         return res
 
+    def tag_batch(self, pil_images, batch_size=8, force_disable_ranks=False):
+        """Same as tag(), for many images; yields tags for each image, in order, running the model on batch_size images at a time."""
+
+        self.start()
+        try:
+            for batch in util.batched(pil_images, batch_size):
+                for y in self.run_model(batch):
+                    yield self.tags_from_probabilities(y, force_disable_ranks)
+        finally:
+            self.stop()
+
+    def run_model(self, pil_images):
+        a = np.stack([np.array(images.resize_image(2, x.convert("RGB"), 512, 512), dtype=np.float32) for x in pil_images]) / 255
+
+        with torch.no_grad(), devices.autocast():
+            x = torch.from_numpy(a).to(devices.device, devices.dtype)
+            y = self.model(x).detach().cpu().numpy()
+
+        return y
+
     def tag_multi(self, pil_image, force_disable_ranks=False):
+        return self.tags_from_probabilities(self.run_model([pil_image])[0], force_disable_ranks)
+
+    def tags_from_probabilities(self, y, force_disable_ranks=False):
         threshold = shared.opts.interrogate_deepbooru_score_threshold
         use_spaces = shared.opts.deepbooru_use_spaces
         use_escape = shared.opts.deepbooru_escape
         alpha_sort = shared.opts.deepbooru_sort_alpha
         include_ranks = shared.opts.interrogate_return_ranks and not force_disable_ranks
 
-        pic = images.resize_image(2, pil_image.convert("RGB"), 512, 512)
-        a = np.expand_dims(np.array(pic, dtype=np.float32), 0) / 255
-
-        with torch.no_grad(), devices.autocast():
-            x = torch.from_numpy(a).to(devices.device, devices.dtype)
-            y = self.model(x)[0].detach().cpu().numpy()
-
         probability_dict = {}
 
         for tag, probability in zip(self.model.tags, y):
@@ -206,6 +206,19 @@ def parse_prompts(prompts):
     return res, extra_data
 
 
+def extra_networks_key(prompt):
+    """
+    Returns a hashable description of extra networks used by the prompt and their arguments.
+
+    parse_prompts uses extra networks of the first prompt for the whole batch, so prompts can only go into the same batch
+    if their keys are equal.
+    """
+
+    _, extra_data = parse_prompt(prompt)
+
+    return tuple(sorted((name, tuple(tuple(params.items) for params in params_list)) for name, params_list in extra_data.items()))
+
+
 def get_user_metadata(filename, lister=None):
     if filename is None:
         return {}
@@ -1,5 +1,4 @@
 import os
-import re
 import shutil
 import json
 
@@ -7,7 +6,7 @@ import json
 import torch
 import tqdm
 
-from modules import shared, images, sd_models, sd_vae, sd_models_config, errors
+from modules import shared, images, sd_models, sd_vae, sd_models_config, sd_models_merge, errors
 from modules.ui_common import plaintext_to_html
 import gradio as gr
 import safetensors.torch
@@ -62,16 +61,6 @@ def create_config(ckpt_result, config_source, a, b, c):
     shutil.copyfile(cfg, checkpoint_filename)
 
 
-checkpoint_dict_skip_on_merge = ["cond_stage_model.transformer.text_model.embeddings.position_ids"]
-
-
-def to_half(tensor, enable):
-    if enable and tensor.dtype == torch.float:
-        return tensor.half()
-
-    return tensor
-
-
 def read_metadata(primary_model_name, secondary_model_name, tertiary_model_name):
     metadata = {}
 
@@ -144,103 +133,77 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
 
     tertiary_model_info = sd_models.checkpoints_list[tertiary_model_name] if theta_func1 else None
 
-    result_is_inpainting_model = False
-    result_is_instruct_pix2pix_model = False
-
-    if theta_func2:
-        shared.state.textinfo = "Loading B"
-        print(f"Loading {secondary_model_info.filename}...")
-        theta_1 = sd_models.read_state_dict(secondary_model_info.filename, map_location='cpu')
-    else:
-        theta_1 = None
-
-    if theta_func1:
-        shared.state.textinfo = "Loading C"
-        print(f"Loading {tertiary_model_info.filename}...")
-        theta_2 = sd_models.read_state_dict(tertiary_model_info.filename, map_location='cpu')
-
-        shared.state.textinfo = 'Merging B and C'
-        shared.state.sampling_steps = len(theta_1.keys())
-        for key in tqdm.tqdm(theta_1.keys()):
-            if key in checkpoint_dict_skip_on_merge:
-                continue
-
-            if 'model' in key:
-                if key in theta_2:
-                    t2 = theta_2.get(key, torch.zeros_like(theta_1[key]))
-                    theta_1[key] = theta_func1(theta_1[key], t2)
-                else:
-                    theta_1[key] = torch.zeros_like(theta_1[key])
-
-            shared.state.sampling_step += 1
-        del theta_2
-
-        shared.state.nextjob()
-
-    shared.state.textinfo = f"Loading {primary_model_info.filename}..."
-    print(f"Loading {primary_model_info.filename}...")
-    theta_0 = sd_models.read_state_dict(primary_model_info.filename, map_location='cpu')
-
-    print("Merging...")
-    shared.state.textinfo = 'Merging A and B'
-    shared.state.sampling_steps = len(theta_0.keys())
-    for key in tqdm.tqdm(theta_0.keys()):
-        if theta_1 and 'model' in key and key in theta_1:
-
-            if key in checkpoint_dict_skip_on_merge:
-                continue
-
-            a = theta_0[key]
-            b = theta_1[key]
-
-            # this enables merging an inpainting model (A) with another one (B);
-            # where normal model would have 4 channels, for latenst space, inpainting model would
-            # have another 4 channels for unmasked picture's latent space, plus one channel for mask, for a total of 9
-            if a.shape != b.shape and a.shape[0:1] + a.shape[2:] == b.shape[0:1] + b.shape[2:]:
-                if a.shape[1] == 4 and b.shape[1] == 9:
-                    raise RuntimeError("When merging inpainting model with a normal one, A must be the inpainting model.")
-                if a.shape[1] == 4 and b.shape[1] == 8:
-                    raise RuntimeError("When merging instruct-pix2pix model with a normal one, A must be the instruct-pix2pix model.")
-
-                if a.shape[1] == 8 and b.shape[1] == 4:#If we have an Instruct-Pix2Pix model...
-                    theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)#Merge only the vectors the models have in common.  Otherwise we get an error due to dimension mismatch.
-                    result_is_instruct_pix2pix_model = True
-                else:
-                    assert a.shape[1] == 9 and b.shape[1] == 4, f"Bad dimensions for merged layer {key}: A={a.shape}, B={b.shape}"
-                    theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)
-                    result_is_inpainting_model = True
-            else:
-                theta_0[key] = theta_func2(a, b, multiplier)
-
-            theta_0[key] = to_half(theta_0[key], save_as_half)
+    merger = sd_models_merge.CheckpointMerger(theta_func1, theta_func2, multiplier, save_as_half, discard_weights)
+    bake_in_vae_filename = sd_vae.vae_dict.get(bake_in_vae, None)
 
-        shared.state.sampling_step += 1
+    model_filenames = [info.filename for info in (primary_model_info, secondary_model_info, tertiary_model_info) if info is not None]
+    use_streaming = shared.opts.checkpoint_merger_streaming and checkpoint_format == "safetensors" and all(os.path.splitext(x)[1].lower() == ".safetensors" for x in model_filenames)
 
-    del theta_1
+    if use_streaming:
+        if bake_in_vae_filename is not None:
+            print(f"Baking in VAE from {bake_in_vae_filename}")
+            merger.vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu')
 
-    bake_in_vae_filename = sd_vae.vae_dict.get(bake_in_vae, None)
-    if bake_in_vae_filename is not None:
-        print(f"Baking in VAE from {bake_in_vae_filename}")
-        shared.state.textinfo = 'Baking in VAE'
-        vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu')
+        shared.state.job_count = 1
+        shared.state.textinfo = "Preparing to merge"
+        print(f"Merging {', '.join(model_filenames)} one tensor at a time...")
+        streaming_merge = sd_models_merge.StreamingMerge(merger, *model_filenames)
+        theta_0 = None
+    else:
+        streaming_merge = None
+
+        if theta_func2:
+            shared.state.textinfo = "Loading B"
+            print(f"Loading {secondary_model_info.filename}...")
+            theta_1 = sd_models.read_state_dict(secondary_model_info.filename, map_location='cpu')
+        else:
+            theta_1 = None
+
+        if theta_func1:
+            shared.state.textinfo = "Loading C"
+            print(f"Loading {tertiary_model_info.filename}...")
+            theta_2 = sd_models.read_state_dict(tertiary_model_info.filename, map_location='cpu')
+
+            shared.state.textinfo = 'Merging B and C'
+            shared.state.sampling_steps = len(theta_1.keys())
+            for key in tqdm.tqdm(theta_1.keys()):
+                theta_1[key] = merger.difference(key, theta_1[key], theta_2.get(key))
+                shared.state.sampling_step += 1
+            del theta_2
+
+            shared.state.nextjob()
+
+        shared.state.textinfo = f"Loading {primary_model_info.filename}..."
+        print(f"Loading {primary_model_info.filename}...")
+        theta_0 = sd_models.read_state_dict(primary_model_info.filename, map_location='cpu')
+
+        print("Merging...")
+        shared.state.textinfo = 'Merging A and B'
+        shared.state.sampling_steps = len(theta_0.keys())
+        for key in tqdm.tqdm(theta_0.keys()):
+            if theta_1 and merger.is_merged(key, theta_1):
+                theta_0[key] = merger.merge(key, theta_0[key], theta_1[key])
 
-        for key in vae_dict.keys():
-            theta_0_key = 'first_stage_model.' + key
-            if theta_0_key in theta_0:
-                theta_0[theta_0_key] = to_half(vae_dict[key], save_as_half)
+            shared.state.sampling_step += 1
 
-        del vae_dict
+        del theta_1
 
-    if save_as_half and not theta_func2:
-        for key in theta_0.keys():
-            theta_0[key] = to_half(theta_0[key], save_as_half)
+        if bake_in_vae_filename is not None:
+            print(f"Baking in VAE from {bake_in_vae_filename}")
+            shared.state.textinfo = 'Baking in VAE'
+            merger.vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu')
 
-    if discard_weights:
-        regex = re.compile(discard_weights)
         for key in list(theta_0):
-            if re.search(regex, key):
+            if merger.keep(key):
+                theta_0[key] = merger.finish(key, theta_0[key])
+            else:
                 theta_0.pop(key, None)
 
+        merger.vae_dict = None
+
+    result_is_inpainting_model = merger.is_inpainting
+    result_is_instruct_pix2pix_model = merger.is_instruct_pix2pix
+
     ckpt_dir = shared.cmd_opts.ckpt_dir or sd_models.model_path
 
     filename = filename_generator() if custom_name == '' else custom_name
@@ -311,7 +274,9 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
         metadata["sd_merge_models"] = json.dumps(sd_merge_models)
 
     _, extension = os.path.splitext(output_modelname)
-    if extension.lower() == ".safetensors":
+    if streaming_merge is not None:
+        streaming_merge.save(output_modelname, metadata=metadata if len(metadata)>0 else None, threads=shared.opts.checkpoint_merger_threads)
+    elif extension.lower() == ".safetensors":
         safetensors.torch.save_file(theta_0, output_modelname, metadata=metadata if len(metadata)>0 else None)
     else:
         torch.save(theta_0, output_modelname)
@@ -1,24 +1,60 @@
+import concurrent.futures
 import hashlib
+import io
+import mmap
 import os.path
+import threading
 
-from modules import shared
+from modules import shared, errors
 import modules.cache
 
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+mmap_chunk_size = 64 * 1024 * 1024
+
+hashing_lock = threading.Lock()
+hashing_in_progress = {}
+prefetch_executor = None
+
+
+def sha256_of_file(file, offset=0):
+    """Hashes the contents of an open binary file starting at offset; the file is memory-mapped and hashed in large chunks without copying."""
 
-def calculate_sha256(filename):
     hash_sha256 = hashlib.sha256()
+    size = os.fstat(file.fileno()).st_size
+
+    if size > offset:
+        try:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(offset, size, mmap_chunk_size):
+                    with memoryview(mapped)[start:start + mmap_chunk_size] as chunk:
+                        hash_sha256.update(chunk)
+
+            return hash_sha256.hexdigest()
+        except (OSError, ValueError):
+            # some filesystems can't be memory-mapped; read the file normally
+            hash_sha256 = hashlib.sha256()
+
     blksize = 1024 * 1024
 
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(blksize), b""):
-            hash_sha256.update(chunk)
+    file.seek(offset)
+    for chunk in iter(lambda: file.read(blksize), b""):
+        hash_sha256.update(chunk)
 
     return hash_sha256.hexdigest()
 
 
+def calculate_sha256(filename):
+    with open(filename, "rb") as f:
+        return sha256_of_file(f)
+
+
+def calculate_addnet_hash(filename):
+    with open(filename, "rb") as f:
+        return addnet_hash_safetensors(f)
+
+
 def sha256_from_cache(filename, title, use_addnet_hash=False):
     hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
     try:
@@ -39,8 +75,6 @@ def sha256_from_cache(filename, title, use_addnet_hash=False):
 
 
 def sha256(filename, title, use_addnet_hash=False):
-    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
-
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,16 +82,39 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
-    print(f"Calculating sha256 for {filename}: ", end='')
-    if use_addnet_hash:
-        with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
-    print(f"{sha256_value}")
+    # if another thread (such as the startup prefetch) is already hashing this file, wait for it instead of doing it twice
+    key = (title, use_addnet_hash)
+    with hashing_lock:
+        future = hashing_in_progress.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = hashing_in_progress[key] = concurrent.futures.Future()
+
+    if not is_owner:
+        return future.result()
+
+    try:
+        sha256_value = sha256_from_cache(filename, title, use_addnet_hash) or calculate_and_store_sha256(filename, title, use_addnet_hash)
+        future.set_result(sha256_value)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with hashing_lock:
+            hashing_in_progress.pop(key, None)
+
+    return sha256_value
+
+
+def calculate_and_store_sha256(filename, title, use_addnet_hash=False):
+    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
+
+    mtime = os.path.getmtime(filename)
+    sha256_value = calculate_addnet_hash(filename) if use_addnet_hash else calculate_sha256(filename)
+    print(f"Calculating sha256 for {filename}: {sha256_value}")
 
     hashes[title] = {
-        "mtime": os.path.getmtime(filename),
+        "mtime": mtime,
         "sha256": sha256_value,
     }
 
@@ -66,6 +123,49 @@ def sha256(filename, title, use_addnet_hash=False):
     return sha256_value
 
 
+def prefetch(items):
+    """
+    Calculates hashes of files that are not in the cache yet in background threads, so that sha256_from_cache finds them
+    later; items are (filename, title, use_addnet_hash) tuples, like arguments for sha256(). Returns a list of futures.
+    """
+
+    global prefetch_executor
+
+    if shared.cmd_opts.no_hashing:
+        return []
+
+    items = [x for x in items if sha256_from_cache(*x) is None]
+    if not items:
+        return []
+
+    with hashing_lock:
+        if prefetch_executor is None:
+            prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, shared.cmd_opts.hash_workers), thread_name_prefix="sha256")
+
+    return [prefetch_executor.submit(prefetch_file, *x) for x in items]
+
+
+def prefetch_models():
+    """Starts calculating hashes of all checkpoints and textual inversion embeddings in background; used with --hash-prefetch."""
+
+    from modules import sd_models
+
+    items = [(info.filename, f"checkpoint/{info.name}", False) for info in sd_models.checkpoints_list.values()]
+
+    for filename in shared.walk_files(shared.cmd_opts.embeddings_dir, allowed_extensions=[".pt", ".bin", ".safetensors"]):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        items.append((filename, f"textual_inversion/{name}", False))
+
+    return prefetch(items)
+
+
+def prefetch_file(filename, title, use_addnet_hash=False):
+    try:
+        return sha256(filename, title, use_addnet_hash)
+    except Exception:
+        errors.report(f"Error calculating sha256 for {filename}", exc_info=True)
+
+
 def addnet_hash_safetensors(b):
     """kohya-ss hash for safetensors from https://github.com/kohya-ss/sd-scripts/blob/main/library/train_util.py"""
     hash_sha256 = hashlib.sha256()
@@ -76,6 +176,12 @@ def addnet_hash_safetensors(b):
     n = int.from_bytes(header, "little")
 
     offset = n + 8
+
+    try:
+        return sha256_of_file(b, offset)
+    except io.UnsupportedOperation:
+        pass  # not a file on disk, such as BytesIO
+
     b.seek(offset)
     for chunk in iter(lambda: b.read(blksize), b""):
         hash_sha256.update(chunk)
@@ -0,0 +1,106 @@
+import concurrent.futures
+import copy
+import threading
+
+from modules import errors, images, shared
+
+
+class SaveJob:
+    """Images saved by one call to process_images; collects errors from background saving so they can be reported in Processed."""
+
+    def __init__(self):
+        self.futures = []
+        self.errors = []
+
+    def wait(self, timeout=None):
+        """Waits for all images of the job to be written; returns the list of errors."""
+
+        concurrent.futures.wait(self.futures, timeout)
+        return self.errors
+
+
+class BackgroundSaver:
+    """
+    Saves images in a pool of threads, so that encoding images and writing files happens while the GPU is already
+    working on the next batch or job.
+
+    Controlled by the background_saving_workers option; with 0 workers, images are saved immediately, like before. At most
+    background_saving_queue_size images wait to be saved at the same time; when that many are waiting, submit() blocks
+    until one is written, so generating faster than the disk can take does not use up all memory.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.executor = None
+        self.workers = 0
+        self.pending = set()
+
+    def get_executor(self, workers):
+        if self.executor is None or self.workers != workers:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image saver")
+            self.workers = workers
+
+        return self.executor
+
+    def submit(self, job, image, *args, p=None, **kwargs):
+        """Saves image like images.save_image(image, *args, p=p, **kwargs); in background, if enabled. Returns a Future, or the result of images.save_image."""
+
+        workers = shared.opts.background_saving_workers
+        if workers <= 0:
+            return images.save_image(image, *args, p=p, **kwargs)
+
+        # the processing object changes as generation goes on (batch_index, seeds, prompts), and options and the job change
+        # when it ends (override_settings are restored, the next job starts), so keep the values they have now
+        p = copy.copy(p)
+        if p is not None and not hasattr(p, 'job_timestamp'):
+            p.job_timestamp = shared.state.job_timestamp
+        opts_snapshot = shared.opts.snapshot()
+
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.pending) < max(1, shared.opts.background_saving_queue_size))
+
+            future = self.get_executor(workers).submit(self.save, job, opts_snapshot, image, args, p, kwargs)
+            self.pending.add(future)
+            future.add_done_callback(self.on_done)
+
+        image.pending_save = future
+        if job is not None:
+            job.futures.append(future)
+
+        return future
+
+    def save(self, job, opts_snapshot, image, args, p, kwargs):
+        try:
+            with shared.opts.using_snapshot(opts_snapshot):
+                return images.save_image(image, *args, p=p, **kwargs)
+        except Exception as e:
+            errors.report("Error saving image in background", exc_info=True)
+            if job is not None:
+                job.errors.append(f"Error saving image: {e}")
+
+    def on_done(self, future):
+        with self.condition:
+            self.pending.discard(future)
+            self.condition.notify_all()
+
+    def flush(self):
+        """Waits until all images submitted so far are written."""
+
+        with self.condition:
+            pending = list(self.pending)
+
+        concurrent.futures.wait(pending)
+
+
+saver = BackgroundSaver()
+
+
+def wait_for(image):
+    """Waits until the image, if it is being saved in background, is written."""
+
+    future = getattr(image, 'pending_save', None)
+    if future is not None:
+        concurrent.futures.wait([future])
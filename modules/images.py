@@ -18,6 +18,9 @@ import pillow_avif # noqa: F401
 import string
 import json
 import hashlib
+import threading
+
+import torch
 
 from modules import sd_samplers, shared, script_callbacks, errors
 from modules.paths_internal import roboto_ttf_file
@@ -75,8 +78,103 @@ class Grid(namedtuple("_Grid", ["tiles", "tile_w", "tile_h", "image_w", "image_h
         return sum(len(row[2]) for row in self.tiles)
 
 
+class GridTiles:
+    """
+    Operations on tiles of a Grid, which can be PIL images, NumPy arrays (HW or HWC) or torch tensors (..., H, W).
+    Arrays and tensors are cropped as views, and blended with the same linear ramps that combine_grid always used;
+    8-bit tiles are blended with the same integer rounding as Pillow, so the result is the same as pasting with a mask.
+    """
+
+    def __init__(self, example):
+        self.is_torch = torch.is_tensor(example)
+
+    def is_8bit(self, x):
+        return x.dtype == (torch.uint8 if self.is_torch else np.uint8)
+
+    def to_int32(self, x):
+        return x.to(torch.int32) if self.is_torch else x.astype(np.int32)
+
+    def size(self, x):
+        return (x.shape[-1], x.shape[-2]) if self.is_torch else (x.shape[1], x.shape[0])
+
+    def region(self, x, left, top, w, h):
+        return x[..., top:top + h, left:left + w] if self.is_torch else x[top:top + h, left:left + w]
+
+    def new(self, example, w, h):
+        if self.is_torch:
+            return torch.zeros((*example.shape[:-2], h, w), dtype=example.dtype, device=example.device)
+
+        return np.zeros((h, w, *example.shape[2:]), dtype=example.dtype)
+
+    def mask(self, example, w, h, ramp_along_width, overlap):
+        """Linear ramp from 0 to 1 over `overlap` pixels, shaped to broadcast against a region of w x h pixels of example."""
+
+        if self.is_8bit(example):
+            ramp = (np.arange(overlap, dtype=np.float32) * 255 / overlap).astype(np.uint8)
+        else:
+            ramp = np.arange(overlap, dtype=np.float32) / overlap
+
+        ramp = ramp.reshape((1, overlap) if ramp_along_width else (overlap, 1))
+        ramp = np.broadcast_to(ramp, (h, w))
+
+        if self.is_torch:
+            return torch.from_numpy(np.ascontiguousarray(ramp)).to(example.device)
+
+        return ramp.reshape(ramp.shape + (1,) * (example.ndim - 2))
+
+    def crop(self, image, left, top, w, h):
+        """Like PIL.Image.crop: a view if the area is inside the image, otherwise a copy with parts outside filled with zeros."""
+
+        image_w, image_h = self.size(image)
+        if left >= 0 and top >= 0 and left + w <= image_w and top + h <= image_h:
+            return self.region(image, left, top, w, h)
+
+        res = self.new(image, w, h)
+        self.paste(res, image, -left, -top)
+        return res
+
+    def paste(self, dst, src, left, top, mask=None):
+        """Like PIL.Image.paste, into dst in place; parts of src that don't fit are cut off."""
+
+        dst_w, dst_h = self.size(dst)
+        src_w, src_h = self.size(src)
+
+        x0, y0 = max(left, 0), max(top, 0)
+        x1, y1 = min(left + src_w, dst_w), min(top + src_h, dst_h)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        target = self.region(dst, x0, y0, x1 - x0, y1 - y0)
+        source = self.region(src, x0 - left, y0 - top, x1 - x0, y1 - y0)
+
+        if mask is None:
+            target[...] = source
+            return
+
+        mask = self.region(mask, x0 - left, y0 - top, x1 - x0, y1 - y0)
+
+        if self.is_8bit(dst):
+            # same rounding as BLEND and DIV255 macros in Pillow's Paste.c
+            mask = self.to_int32(mask)
+            value = self.to_int32(source) * mask + self.to_int32(target) * (255 - mask) + 128
+            target[...] = ((value >> 8) + value) >> 8
+        else:
+            target[...] = source * mask + target * (1 - mask)
+
+
 def split_grid(image: Image.Image, tile_w: int = 512, tile_h: int = 512, overlap: int = 64) -> Grid:
-    w, h = image.size
+    """
+    Splits image into overlapping tiles. The image can also be a NumPy array or a torch tensor (see GridTiles), in which
+    case tiles are views of it rather than copies.
+    """
+
+    if isinstance(image, Image.Image):
+        w, h = image.size
+        crop = lambda x, y: image.crop((x, y, x + tile_w, y + tile_h))  # noqa: E731
+    else:
+        ops = GridTiles(image)
+        w, h = ops.size(image)
+        crop = lambda x, y: ops.crop(image, x, y, tile_w, tile_h)  # noqa: E731
 
     non_overlap_width = tile_w - overlap
     non_overlap_height = tile_h - overlap
@@ -102,7 +200,7 @@ def split_grid(image: Image.Image, tile_w: int = 512, tile_h: int = 512, overlap
             if x + tile_w >= w:
                 x = w - tile_w
 
-            tile = image.crop((x, y, x + tile_w, y + tile_h))
+            tile = crop(x, y)
 
             row_images.append([x, tile_w, tile])
 
@@ -112,6 +210,47 @@ def split_grid(image: Image.Image, tile_w: int = 512, tile_h: int = 512, overlap
 
 
 def combine_grid(grid):
+    """
+    Puts tiles of the grid back together, blending them over the overlap. Returns a PIL image if tiles are PIL images;
+    otherwise, tiles must be NumPy arrays or torch tensors (see GridTiles), and an array or a tensor is returned.
+    """
+
+    example = grid.tiles[0][2][0][2]
+    if isinstance(example, Image.Image):
+        return combine_grid_pil(grid)
+
+    ops = GridTiles(example)
+    overlap = grid.overlap
+
+    combined_image = ops.new(example, grid.image_w, grid.image_h)
+    mask_h = ops.mask(example, grid.image_w, overlap, False, overlap) if overlap > 0 else None
+
+    for y, h, row in grid.tiles:
+        combined_row = ops.new(example, grid.image_w, h)
+        mask_w = ops.mask(example, overlap, h, True, overlap) if overlap > 0 else None
+
+        for x, w, tile in row:
+            if x == 0:
+                ops.paste(combined_row, tile, 0, 0)
+                continue
+
+            if overlap > 0:
+                ops.paste(combined_row, ops.region(tile, 0, 0, overlap, h), x, 0, mask=mask_w)
+            ops.paste(combined_row, ops.region(tile, overlap, 0, w - overlap, h), x + overlap, 0)
+
+        if y == 0:
+            ops.paste(combined_image, combined_row, 0, 0)
+            continue
+
+        if overlap > 0:
+            ops.paste(combined_image, ops.region(combined_row, 0, 0, grid.image_w, overlap), 0, y, mask=mask_h)
+        ops.paste(combined_image, ops.region(combined_row, 0, overlap, grid.image_w, h - overlap), 0, y + overlap)
+
+    return combined_image
+
+
+def combine_grid_pil(grid):
+    # for PIL tiles, Pillow's own pasting is faster than converting every tile into an array and the result back
     def make_mask_image(r):
         r = r * 255 / grid.overlap
         r = r.astype(np.uint8)
@@ -393,7 +532,7 @@ class FilenameGenerator:
         'sampler_scheduler': lambda self: self.p and get_sampler_scheduler(self.p, True),
         'scheduler': lambda self: self.p and get_sampler_scheduler(self.p, False),
         'model_hash': lambda self: getattr(self.p, "sd_model_hash", shared.sd_model.sd_model_hash),
-        'model_name': lambda self: sanitize_filename_part(shared.sd_model.sd_checkpoint_info.name_for_extra, replace_spaces=False),
+        'model_name': lambda self: sanitize_filename_part(getattr(self.p, "sd_model_name", None) or shared.sd_model.sd_checkpoint_info.name_for_extra, replace_spaces=False),
         'date': lambda self: datetime.datetime.now().strftime('%Y-%m-%d'),
         'datetime': lambda self, *args: self.datetime(*args),  # accepts formats: [datetime], [datetime<Format>], [datetime<Format><Time Zone>]
         'job_timestamp': lambda self: getattr(self.p, "job_timestamp", shared.state.job_timestamp),
@@ -408,7 +547,7 @@ class FilenameGenerator:
         'batch_size': lambda self: self.p.batch_size,
         'generation_number': lambda self: NOTHING_AND_SKIP_PREVIOUS_TEXT if (self.p.n_iter == 1 and self.p.batch_size == 1) or self.zip else self.p.iteration * self.p.batch_size + self.p.batch_index + 1,
         'hasprompt': lambda self, *args: self.hasprompt(*args),  # accepts formats:[hasprompt<prompt1|default><prompt2>..]
-        'clip_skip': lambda self: opts.data["CLIP_stop_at_last_layers"],
+        'clip_skip': lambda self: opts.CLIP_stop_at_last_layers,
         'denoising': lambda self: self.p.denoising_strength if self.p and self.p.denoising_strength else NOTHING_AND_SKIP_PREVIOUS_TEXT,
         'user': lambda self: self.p.user,
         'vae_filename': lambda self: self.get_vae_filename(),
@@ -430,10 +569,14 @@ class FilenameGenerator:
 
         import modules.sd_vae as sd_vae
 
-        if sd_vae.loaded_vae_file is None:
+        if getattr(self.p, "sd_model_name", None) is not None:
+            file_name = self.p.sd_vae_name  # the VAE that made the image; another one may be loaded by the time it's saved
+        else:
+            file_name = sd_vae.get_loaded_vae_name()
+
+        if file_name is None:
             return "NoneType"
 
-        file_name = os.path.basename(sd_vae.loaded_vae_file)
         split_file_name = file_name.split('.')
         if len(split_file_name) > 1 and split_file_name[0] == '':
             return split_file_name[1]  # if the first character of the filename is "." then [1] is obtained.
@@ -562,6 +705,100 @@ def get_next_sequence_number(path, basename):
     return result + 1
 
 
+class SequenceIndexEntry:
+    def __init__(self, next_number):
+        self.next_number = next_number
+        self.pending = set()
+
+
+class SequenceIndex:
+    """
+    Keeps the next free sequence number for each (directory, basename) pair in memory, so that saving an image does not
+    have to list the whole output directory.
+
+    A directory is listed once when it's first used; after that, numbers are reserved under a lock, so threads saving at
+    the same time never get the same number. If the directory's modification time changes and it wasn't this process's
+    own save that changed it (another program or webui instance wrote or deleted files), the directory is listed again.
+    The modification time after a save is only taken as this process's own if the one taken right before the save was
+    already known; otherwise someone else may have written in between, and the directory is listed again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.mtimes = {}
+        self.scans = 0
+
+    def reserve(self, path, basename):
+        """Returns the next sequence number for files with basename in path; the number won't be returned again until it's released."""
+
+        dirname = os.path.abspath(path)
+
+        with self.lock:
+            mtime = directory_mtime(dirname)
+            if self.mtimes.get(dirname) != mtime:
+                self.rescan(dirname, mtime)
+
+            entry = self.entries.get((dirname, basename))
+            if entry is None:
+                entry = self.entries[(dirname, basename)] = SequenceIndexEntry(get_next_sequence_number(dirname, basename))
+                self.scans += 1
+
+            number = entry.next_number
+            entry.next_number += 1
+            entry.pending.add(number)
+
+            return number
+
+    def release(self, path, basename, number=None, mtime_before_write=None):
+        """
+        Called after this process writes to the directory, or gives up on writing, with the reserved number if one was used.
+
+        mtime_before_write is the directory's modification time taken right before writing, or None if nothing was
+        written. If it's the one the index already knew, the directory's current modification time is remembered as
+        caused by this process; otherwise the directory is listed again the next time a number is reserved.
+        """
+
+        dirname = os.path.abspath(path)
+
+        with self.lock:
+            entry = self.entries.get((dirname, basename))
+            if entry is not None:
+                entry.pending.discard(number)
+
+            if mtime_before_write is not None:
+                if mtime_before_write == self.mtimes.get(dirname):
+                    self.mtimes[dirname] = directory_mtime(dirname)
+                else:
+                    self.mtimes.pop(dirname, None)
+
+    def rescan(self, dirname, mtime):
+        """Lists the directory again for all basenames used in it; numbers reserved but not yet written are not given out again."""
+
+        for (entry_dirname, basename), entry in self.entries.items():
+            if entry_dirname == dirname:
+                next_number = get_next_sequence_number(dirname, basename)
+                entry.next_number = max(next_number, max(entry.pending, default=-1) + 1)
+                self.scans += 1
+
+        self.mtimes[dirname] = mtime
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.mtimes.clear()
+
+
+def directory_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+sequence_index = SequenceIndex()
+
+
 def save_image_with_geninfo(image, geninfo, filename, extension=None, existing_pnginfo=None, pnginfo_section_name='parameters'):
     """
     Saves image to filename, including geninfo as text information for generation info.
@@ -655,6 +892,7 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             If a text file is saved for this image, this will be its full path. Otherwise None.
     """
     namegen = FilenameGenerator(p, seed, prompt, image, basename=basename)
+    sequence_number = None
 
     # WebP and JPG formats have maximum dimension limits of 16383 and 65535 respectively. switch to PNG which has a much higher limit
     if (image.height > 65535 or image.width > 65535) and extension.lower() in ("jpg", "jpeg") or (image.height > 16383 or image.width > 16383) and extension.lower() == "webp":
@@ -686,81 +924,88 @@ def save_image(image, path, basename, seed=None, prompt=None, extension='png', i
             file_decoration = f"-{file_decoration}"
 
         if add_number:
-            basecount = get_next_sequence_number(path, basename)
             fullfn = None
-            for i in range(500):
-                fn = f"{basecount + i:05}" if basename == '' else f"{basename}-{basecount + i:04}"
+            for _ in range(500):
+                sequence_number = sequence_index.reserve(path, basename)
+                fn = f"{sequence_number:05}" if basename == '' else f"{basename}-{sequence_number:04}"
                 fullfn = os.path.join(path, f"{fn}{file_decoration}.{extension}")
                 if not os.path.exists(fullfn):
                     break
+
+                sequence_index.release(path, basename, sequence_number)
         else:
             fullfn = os.path.join(path, f"{file_decoration}.{extension}")
     else:
         fullfn = os.path.join(path, f"{forced_filename}.{extension}")
 
-    pnginfo = existing_info or {}
-    if info is not None:
-        pnginfo[pnginfo_section_name] = info
-
-    params = script_callbacks.ImageSaveParams(image, p, fullfn, pnginfo)
-    script_callbacks.before_image_saved_callback(params)
+    mtime_before_write = None
+    try:
+        pnginfo = existing_info or {}
+        if info is not None:
+            pnginfo[pnginfo_section_name] = info
 
-    image = params.image
-    fullfn = params.filename
-    info = params.pnginfo.get(pnginfo_section_name, None)
+        params = script_callbacks.ImageSaveParams(image, p, fullfn, pnginfo)
+        script_callbacks.before_image_saved_callback(params)
 
-    def _atomically_save_image(image_to_save, filename_without_extension, extension):
-        """
-        save image with .tmp extension to avoid race condition when another process detects new image in the directory
-        """
-        temp_file_path = f"{filename_without_extension}.tmp"
-
-        save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
-
-        filename = filename_without_extension + extension
-        if shared.opts.save_images_replace_action != "Replace":
-            n = 0
-            while os.path.exists(filename):
-                n += 1
-                filename = f"{filename_without_extension}-{n}{extension}"
-        os.replace(temp_file_path, filename)
-
-    fullfn_without_extension, extension = os.path.splitext(params.filename)
-    if hasattr(os, 'statvfs'):
-        max_name_len = os.statvfs(path).f_namemax
-        fullfn_without_extension = fullfn_without_extension[:max_name_len - max(4, len(extension))]
-        params.filename = fullfn_without_extension + extension
+        image = params.image
         fullfn = params.filename
-    _atomically_save_image(image, fullfn_without_extension, extension)
-
-    image.already_saved_as = fullfn
-
-    oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
-    if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
-        ratio = image.width / image.height
-        resize_to = None
-        if oversize and ratio > 1:
-            resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
-        elif oversize:
-            resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
-
-        if resize_to is not None:
+        info = params.pnginfo.get(pnginfo_section_name, None)
+
+        def _atomically_save_image(image_to_save, filename_without_extension, extension):
+            """
+            save image with .tmp extension to avoid race condition when another process detects new image in the directory
+            """
+            temp_file_path = f"{filename_without_extension}.tmp"
+
+            save_image_with_geninfo(image_to_save, info, temp_file_path, extension, existing_pnginfo=params.pnginfo, pnginfo_section_name=pnginfo_section_name)
+
+            filename = filename_without_extension + extension
+            if shared.opts.save_images_replace_action != "Replace":
+                n = 0
+                while os.path.exists(filename):
+                    n += 1
+                    filename = f"{filename_without_extension}-{n}{extension}"
+            os.replace(temp_file_path, filename)
+
+        fullfn_without_extension, extension = os.path.splitext(params.filename)
+        if hasattr(os, 'statvfs'):
+            max_name_len = os.statvfs(path).f_namemax
+            fullfn_without_extension = fullfn_without_extension[:max_name_len - max(4, len(extension))]
+            params.filename = fullfn_without_extension + extension
+            fullfn = params.filename
+        mtime_before_write = directory_mtime(path)
+        _atomically_save_image(image, fullfn_without_extension, extension)
+
+        image.already_saved_as = fullfn
+
+        oversize = image.width > opts.target_side_length or image.height > opts.target_side_length
+        if opts.export_for_4chan and (oversize or os.stat(fullfn).st_size > opts.img_downscale_threshold * 1024 * 1024):
+            ratio = image.width / image.height
+            resize_to = None
+            if oversize and ratio > 1:
+                resize_to = round(opts.target_side_length), round(image.height * opts.target_side_length / image.width)
+            elif oversize:
+                resize_to = round(image.width * opts.target_side_length / image.height), round(opts.target_side_length)
+
+            if resize_to is not None:
+                try:
+                    # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
+                    image = image.resize(resize_to, LANCZOS)
+                except Exception:
+                    image = image.resize(resize_to)
             try:
-                # Resizing image with LANCZOS could throw an exception if e.g. image mode is I;16
-                image = image.resize(resize_to, LANCZOS)
-            except Exception:
-                image = image.resize(resize_to)
-        try:
-            _atomically_save_image(image, fullfn_without_extension, ".jpg")
-        except Exception as e:
-            errors.display(e, "saving image as downscaled JPG")
-
-    if opts.save_txt and info is not None:
-        txt_fullfn = f"{fullfn_without_extension}.txt"
-        with open(txt_fullfn, "w", encoding="utf8") as file:
-            file.write(f"{info}\n")
-    else:
-        txt_fullfn = None
+                _atomically_save_image(image, fullfn_without_extension, ".jpg")
+            except Exception as e:
+                errors.display(e, "saving image as downscaled JPG")
+
+        if opts.save_txt and info is not None:
+            txt_fullfn = f"{fullfn_without_extension}.txt"
+            with open(txt_fullfn, "w", encoding="utf8") as file:
+                file.write(f"{info}\n")
+        else:
+            txt_fullfn = None
+    finally:
+        sequence_index.release(path, basename, sequence_number, mtime_before_write)
 
     script_callbacks.image_saved_callback(params)
 
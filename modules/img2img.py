@@ -242,6 +242,7 @@ def img2img(id_task: str, request: gr.Request, mode: int, prompt: str, negative_
                 processed = process_images(p)
 
     shared.total_tqdm.clear()
+    processed.wait_for_saving()
 
     generation_info_js = processed.js()
     if opts.samples_log_stdout:
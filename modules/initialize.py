@@ -115,6 +115,11 @@ def initialize_rest(*, reload_script_modules=False):
             importlib.reload(module)
         startup_timer.record("reload script modules")
 
+    if cmd_opts.hash_prefetch:
+        from modules import hashes
+        hashes.prefetch_models()
+        startup_timer.record("start hash prefetch")
+
     from modules import modelloader
     modelloader.load_upscalers()
     startup_timer.record("load upscalers")
@@ -1,21 +1,26 @@
+import hashlib
 import os
 import sys
 from collections import namedtuple
 from pathlib import Path
 import re
 
+import numpy as np
 import torch
 import torch.hub
 
 from torchvision import transforms
 from torchvision.transforms.functional import InterpolationMode
 
-from modules import devices, paths, shared, lowvram, modelloader, errors, torch_utils
+from modules import devices, paths, shared, lowvram, modelloader, errors, torch_utils, cache, util
 
 blip_image_eval_size = 384
 clip_model_name = 'ViT-L/14'
 
-Category = namedtuple("Category", ["name", "topn", "items"])
+Category = namedtuple("Category", ["name", "topn", "items", "mtime"], defaults=[None])
+
+text_features_dir = os.path.join(cache.cache_dir, "interrogate")
+text_features_batch_size = 256
 
 re_topn = re.compile(r"\.top(\d+)$")
 
@@ -51,7 +56,9 @@ class InterrogateModels:
 
     def __init__(self, content_dir):
         self.loaded_categories = None
+        self.loaded_categories_mtimes = None
         self.skip_categories = []
+        self.text_features = {}
         self.content_dir = content_dir
         self.running_on_cpu = devices.device_interrogate == torch.device("cpu")
 
@@ -59,15 +66,20 @@ class InterrogateModels:
         if not os.path.exists(self.content_dir):
             download_default_clip_interrogate_categories(self.content_dir)
 
-        if self.loaded_categories is not None and self.skip_categories == shared.opts.interrogate_clip_skip_categories:
+        filenames = list(Path(self.content_dir).glob('*.txt')) if os.path.exists(self.content_dir) else []
+        mtimes = [(filename, os.path.getmtime(filename)) for filename in filenames]
+
+        if self.loaded_categories is not None and self.skip_categories == shared.opts.interrogate_clip_skip_categories and self.loaded_categories_mtimes == mtimes:
            return self.loaded_categories
 
         self.loaded_categories = []
+        self.loaded_categories_mtimes = mtimes
+        self.text_features.clear()
 
         if os.path.exists(self.content_dir):
             self.skip_categories = shared.opts.interrogate_clip_skip_categories
             category_types = []
-            for filename in Path(self.content_dir).glob('*.txt'):
+            for filename, mtime in mtimes:
                 category_types.append(filename.stem)
                 if filename.stem in self.skip_categories:
                     continue
@@ -76,7 +88,7 @@ class InterrogateModels:
                 with open(filename, "r", encoding="utf8") as file:
                     lines = [x.strip() for x in file.readlines()]
 
-                self.loaded_categories.append(Category(name=filename.stem, topn=topn, items=lines))
+                self.loaded_categories.append(Category(name=filename.stem, topn=topn, items=lines, mtime=mtime))
 
         return self.loaded_categories
 
@@ -147,20 +159,71 @@ class InterrogateModels:
         self.send_clip_to_ram()
         self.send_blip_to_ram()
 
+        if not shared.opts.interrogate_keep_models_in_memory:
+            self.text_features.clear()
+
         devices.torch_gc()
 
-    def rank(self, image_features, text_array, top_count=1):
+    def encode_texts(self, text_array):
         import clip
 
+        text_tokens = clip.tokenize(list(text_array), truncate=True).to(devices.device_interrogate)
+        text_features = self.clip_model.encode_text(text_tokens).type(self.dtype)
+        text_features /= text_features.norm(dim=-1, keepdim=True)
+
+        return text_features
+
+    def category_text_features(self, category):
+        """
+        Returns normalized CLIP text features for the items of the category, as used by rank().
+
+        The features are computed once per CLIP model, dtype and category file version, and saved to a file in
+        text_features_dir that is memory-mapped on later loads.
+        """
+
+        text_array = category.items
+        if shared.opts.interrogate_clip_dict_limit != 0:
+            text_array = text_array[0:int(shared.opts.interrogate_clip_dict_limit)]
+
+        key = f"{clip_model_name}/{self.dtype}/{category.name}/{category.mtime}/{len(text_array)}"
+        text_features = self.text_features.get(key)
+        if text_features is not None:
+            return text_features
+
+        filename = os.path.join(text_features_dir, f"{category.name}-{hashlib.sha256(key.encode('utf8')).hexdigest()[0:16]}.npy")
+
+        data = None
+        if os.path.exists(filename):
+            try:
+                data = np.load(filename, mmap_mode='c')
+            except Exception:
+                errors.report(f"Error loading cached CLIP text features from {filename}", exc_info=True)
+
+        if data is None or data.shape[0] != len(text_array):
+            with torch.no_grad(), devices.autocast():
+                text_features = torch.cat([self.encode_texts(text_array[i:i + text_features_batch_size]) for i in range(0, len(text_array), text_features_batch_size)])
+
+            data = text_features.cpu().float().numpy()
+
+            os.makedirs(text_features_dir, exist_ok=True)
+            with open(f"{filename}.tmp", "wb") as file:
+                np.save(file, data.astype(np.float16 if self.dtype == torch.float16 else np.float32))
+            os.replace(f"{filename}.tmp", filename)
+
+        text_features = torch.from_numpy(data).to(devices.device_interrogate, self.dtype)
+        self.text_features[key] = text_features
+
+        return text_features
+
+    def rank(self, image_features, text_array, top_count=1, text_features=None):
         devices.torch_gc()
 
         if shared.opts.interrogate_clip_dict_limit != 0:
             text_array = text_array[0:int(shared.opts.interrogate_clip_dict_limit)]
 
         top_count = min(top_count, len(text_array))
-        text_tokens = clip.tokenize(list(text_array), truncate=True).to(devices.device_interrogate)
-        text_features = self.clip_model.encode_text(text_tokens).type(self.dtype)
-        text_features /= text_features.norm(dim=-1, keepdim=True)
+        if text_features is None:
+            text_features = self.encode_texts(text_array)
 
         similarity = torch.zeros((1, len(text_array))).to(devices.device_interrogate)
         for i in range(image_features.shape[0]):
@@ -171,16 +234,30 @@ class InterrogateModels:
         return [(text_array[top_labels[0][i].numpy()], (top_probs[0][i].numpy()*100)) for i in range(top_count)]
 
     def generate_caption(self, pil_image):
-        gpu_image = transforms.Compose([
+        return self.generate_captions([pil_image])[0]
+
+    def generate_captions(self, pil_images):
+        transform = transforms.Compose([
             transforms.Resize((blip_image_eval_size, blip_image_eval_size), interpolation=InterpolationMode.BICUBIC),
             transforms.ToTensor(),
             transforms.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711))
-        ])(pil_image).unsqueeze(0).type(self.dtype).to(devices.device_interrogate)
+        ])
+        gpu_images = torch.stack([transform(x) for x in pil_images]).type(self.dtype).to(devices.device_interrogate)
 
         with torch.no_grad():
-            caption = self.blip_model.generate(gpu_image, sample=False, num_beams=shared.opts.interrogate_clip_num_beams, min_length=shared.opts.interrogate_clip_min_length, max_length=shared.opts.interrogate_clip_max_length)
+            captions = self.blip_model.generate(gpu_images, sample=False, num_beams=shared.opts.interrogate_clip_num_beams, min_length=shared.opts.interrogate_clip_min_length, max_length=shared.opts.interrogate_clip_max_length)
+
+        return captions
 
-        return caption[0]
+    def format_matches(self, matches):
+        res = ""
+        for match, score in matches:
+            if shared.opts.interrogate_return_ranks:
+                res += f", ({match}:{score/100:.3f})"
+            else:
+                res += f", {match}"
+
+        return res
 
     def interrogate(self, pil_image):
         res = ""
@@ -205,12 +282,8 @@ class InterrogateModels:
                 image_features /= image_features.norm(dim=-1, keepdim=True)
 
                 for cat in self.categories():
-                    matches = self.rank(image_features, cat.items, top_count=cat.topn)
-                    for match, score in matches:
-                        if shared.opts.interrogate_return_ranks:
-                            res += f", ({match}:{score/100:.3f})"
-                        else:
-                            res += f", {match}"
+                    matches = self.rank(image_features, cat.items, top_count=cat.topn, text_features=self.category_text_features(cat))
+                    res += self.format_matches(matches)
 
         except Exception:
             errors.report("Error interrogating", exc_info=True)
@@ -220,3 +293,58 @@ class InterrogateModels:
         shared.state.end()
 
         return res
+
+    def interrogate_batch(self, pil_images, batch_size=8):
+        """
+        Same as interrogate(), for many images; yields one result per image, in order.
+
+        BLIP and CLIP stay loaded until all images are processed, and captioning, image encoding and ranking are done
+        for batch_size images at a time.
+        """
+
+        shared.state.begin(job="interrogate")
+        try:
+            lowvram.send_everything_to_cpu()
+            devices.torch_gc()
+
+            self.load()
+
+            for batch in util.batched(pil_images, batch_size):
+                try:
+                    yield from self.interrogate_images(batch)
+                except Exception:
+                    errors.report("Error interrogating", exc_info=True)
+                    yield from ["<error>"] * len(batch)
+
+                shared.state.job_no += len(batch)
+
+        finally:
+            self.unload()
+            shared.state.end()
+
+    def interrogate_images(self, pil_images):
+        captions = self.generate_captions(pil_images)
+
+        clip_images = torch.stack([self.clip_preprocess(x) for x in pil_images]).type(self.dtype).to(devices.device_interrogate)
+
+        with torch.no_grad(), devices.autocast():
+            image_features = self.clip_model.encode_image(clip_images).type(self.dtype)
+            image_features /= image_features.norm(dim=-1, keepdim=True)
+
+            results = list(captions)
+            for cat in self.categories():
+                text_array = cat.items
+                if shared.opts.interrogate_clip_dict_limit != 0:
+                    text_array = text_array[0:int(shared.opts.interrogate_clip_dict_limit)]
+
+                text_features = self.category_text_features(cat)
+                top_count = min(cat.topn, len(text_array))
+
+                similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
+                top_probs, top_labels = similarity.cpu().topk(top_count, dim=-1)
+
+                for i in range(len(results)):
+                    matches = [(text_array[top_labels[i][j].numpy()], (top_probs[i][j].numpy()*100)) for j in range(top_count)]
+                    results[i] += self.format_matches(matches)
+
+        return results
@@ -0,0 +1,196 @@
+import itertools
+import threading
+import time
+from enum import IntEnum
+
+
+class Resource:
+    """Names of the shared resources a job can lock."""
+
+    sd_model = "sd_model"
+    """The loaded Stable Diffusion checkpoint, its VAE, and anything that can move it between devices."""
+
+    upscaler = "upscaler"
+    """Upscaler and face restoration models."""
+
+    interrogator = "interrogator"
+    """CLIP/BLIP and DeepDanbooru interrogation models."""
+
+    progress = "progress"
+    """The global progress/interrupt state in shared.state; jobs that call shared.state.begin() need it."""
+
+    cpu = "cpu"
+    """CPU-only work such as encoding and saving images that still has to be serialized."""
+
+    checkpoint_cache = "checkpoint_cache"
+    """Reading checkpoints into the checkpoint cache ahead of time; this does not touch the loaded model, so generation can go on."""
+
+
+all_resources = (Resource.sd_model, Resource.upscaler, Resource.interrogator, Resource.progress, Resource.cpu, Resource.checkpoint_cache)
+
+
+class Priority(IntEnum):
+    high = 0
+    normal = 1
+    low = 2
+
+
+class JobRequest:
+    def __init__(self, seq, resources, priority, name):
+        self.seq = seq
+        self.resources = resources
+        self.priority = priority
+        self.name = name
+        self.time_queued = time.time()
+        self.time_started = None
+
+    def sort_key(self):
+        return self.priority, self.seq
+
+
+class JobScheduler:
+    """
+    A lock manager for the jobs that use shared models.
+
+    Each job asks for a set of resources. Jobs with disjoint resources run at the same time; jobs that need the same resource
+    run one after another, higher priority first, and in arrival order within the same priority. A job is never started
+    ahead of an earlier (or higher priority) queued job that needs any of the same resources, so big jobs are not starved
+    by a stream of small ones.
+    """
+
+    def __init__(self, resources=all_resources):
+        self.resources = tuple(resources)
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.waiting = []
+        self.running = {}
+        self.held = {}
+
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def lock(self, *resources, priority=Priority.normal, name=None):
+        """Returns a lock object that acquires the resources (all resources if none are listed); can be used with `with`."""
+
+        return JobLock(self, resources or self.resources, priority, name)
+
+    def acquire(self, resources, priority=Priority.normal, name=None, blocking=True):
+        """Waits until all resources are free and the job's turn has come; returns the request to pass to release(), or None if blocking is False and the resources are busy."""
+
+        unknown = [x for x in resources if x not in self.resources]
+        assert not unknown, f"unknown resources: {unknown}"
+
+        with self.condition:
+            req = JobRequest(next(self.counter), frozenset(resources), Priority(priority), name)
+            self.waiting.append(req)
+            self.waiting.sort(key=JobRequest.sort_key)
+
+            if not blocking and not self.can_start(req):
+                self.waiting.remove(req)
+                return None
+
+            self.condition.wait_for(lambda: self.can_start(req))
+
+            self.waiting.remove(req)
+            for resource in req.resources:
+                self.held[resource] = req
+
+            req.time_started = time.time()
+            self.running[req.seq] = req
+
+            wait = req.time_started - req.time_queued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            # a job that was waiting behind this one may be able to start now that this one left the queue
+            self.condition.notify_all()
+
+        return req
+
+    def release(self, req):
+        with self.condition:
+            for resource in req.resources:
+                if self.held.get(resource) is req:
+                    del self.held[resource]
+
+            self.running.pop(req.seq, None)
+            self.completed += 1
+            self.condition.notify_all()
+
+    def find_running(self, resources):
+        resources = frozenset(resources)
+
+        with self.condition:
+            return next((x for x in self.running.values() if x.resources == resources), None)
+
+    def can_start(self, req):
+        if any(resource in self.held for resource in req.resources):
+            return False
+
+        for other in self.waiting:
+            if other is req:
+                return True
+
+            if other.resources & req.resources:
+                return False
+
+        return True
+
+    def stats(self):
+        """Returns queue depth and timing information, for the API and for logging."""
+
+        now = time.time()
+
+        with self.condition:
+            return {
+                "queued": {priority.name: sum(1 for x in self.waiting if x.priority == priority) for priority in Priority},
+                "queue_depth": len(self.waiting),
+                "waiting": [{"name": x.name, "priority": x.priority.name, "resources": sorted(x.resources), "waited": now - x.time_queued} for x in self.waiting],
+                "running": [{"name": x.name, "priority": x.priority.name, "resources": sorted(x.resources), "elapsed": now - x.time_started} for x in self.running.values()],
+                "busy_resources": sorted(self.held),
+                "completed": self.completed,
+                "average_wait": self.total_wait / self.completed if self.completed else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+class JobLock:
+    """A lock for a fixed set of resources; several threads can share one JobLock object, like they did with the old global queue lock."""
+
+    def __init__(self, scheduler, resources, priority=Priority.normal, name=None):
+        self.scheduler = scheduler
+        self.resources = tuple(resources)
+        self.priority = priority
+        self.name = name
+        self.local = threading.local()
+
+    def acquire(self, blocking=True):
+        req = self.scheduler.acquire(self.resources, priority=self.priority, name=self.name, blocking=blocking)
+        if req is None:
+            return False
+
+        stack = getattr(self.local, "requests", None)
+        if stack is None:
+            stack = self.local.requests = []
+
+        stack.append(req)
+        return True
+
+    def release(self):
+        stack = getattr(self.local, "requests", None)
+        if stack:
+            self.scheduler.release(stack.pop())
+            return
+
+        # released by a different thread than the one that acquired it; threading.Lock allows this, so allow it here too
+        req = self.scheduler.find_running(self.resources)
+        assert req is not None, "release of an unacquired lock"
+        self.scheduler.release(req)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, t, v, tb):
+        self.release()
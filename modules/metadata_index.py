@@ -0,0 +1,166 @@
+import collections
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+
+from modules import cache
+
+summary_max_length = 256
+read_threads = 8
+
+IndexEntry = collections.namedtuple("IndexEntry", ["mtime", "size", "summary", "complete"])
+
+
+def read_metadata(filename):
+    from modules import sd_models
+
+    return sd_models.read_metadata_from_safetensors(filename)
+
+
+class MetadataIndex:
+    """
+    Metadata from headers of .safetensors files, kept in one SQLite database for all model directories.
+
+    A file's entry is valid while the file's mtime and size stay the same. Short values of all entries (the summary) are
+    loaded into memory with one query when the index is first used, so that listing thousands of models only needs a stat
+    per file; whole metadata, which for LoRAs can include large tag frequency tables, is read from the database when
+    asked for. Entries for deleted files are removed by update() when the mtime of their directory changes.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.db = None
+        self.entries = {}
+        self.directories = {}
+
+    def connect(self):
+        with self.lock:
+            if self.db is not None:
+                return self.db
+
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+            db = sqlite3.connect(self.filename, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, summary TEXT, complete INTEGER, metadata TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime REAL)")
+
+            self.entries = {
+                path: IndexEntry(mtime, size, json.loads(summary), bool(complete))
+                for path, mtime, size, summary, complete in db.execute("SELECT path, mtime, size, summary, complete FROM files")
+            }
+            self.directories = dict(db.execute("SELECT path, mtime FROM directories"))
+            self.db = db
+
+            return db
+
+    def lookup(self, path, stat):
+        entry = self.entries.get(path)
+        if entry is None or entry.mtime != stat.st_mtime or entry.size != stat.st_size:
+            return None
+
+        return entry
+
+    def store(self, path, stat, metadata):
+        """Saves metadata for the file; must be called with the lock held, inside a transaction."""
+
+        summary = {k: v for k, v in metadata.items() if len(json.dumps(v)) <= summary_max_length}
+        entry = IndexEntry(stat.st_mtime, stat.st_size, summary, len(summary) == len(metadata))
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, mtime, size, summary, complete, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, entry.mtime, entry.size, json.dumps(summary), int(entry.complete), None if entry.complete else json.dumps(metadata)),
+        )
+        self.entries[path] = entry
+
+        return entry
+
+    def forget_removed(self, directory):
+        """Removes entries for files from the directory that no longer exist; must be called with the lock held, inside a transaction."""
+
+        for path in [x for x in self.entries if os.path.dirname(x) == directory]:
+            if not os.path.exists(path):
+                self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+                del self.entries[path]
+
+    def update(self, filenames):
+        """Reads headers of files that are new or changed since they were indexed, in several threads, and saves them in one transaction."""
+
+        stats = {}
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            try:
+                stats[path] = os.stat(path)
+            except OSError:
+                continue
+
+        directories = {}
+        for path in stats:
+            directory = os.path.dirname(path)
+            if directory not in directories:
+                directories[directory] = os.path.getmtime(directory)
+
+        self.connect()
+        with self.lock:
+            changed = [path for path, stat in stats.items() if self.lookup(path, stat) is None]
+
+        results = []
+        if changed:
+            def read(path):
+                try:
+                    return read_metadata(path)
+                except Exception:
+                    return None  # reported by summary() or metadata() when the file is used
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(read_threads, len(changed)), thread_name_prefix="metadata index") as executor:
+                results = [(path, metadata) for path, metadata in zip(changed, executor.map(read, changed)) if metadata is not None]
+
+        with self.lock, self.db:
+            for path, metadata in results:
+                self.store(path, stats[path], metadata)
+
+            for directory, mtime in directories.items():
+                if self.directories.get(directory) == mtime:
+                    continue
+
+                self.forget_removed(directory)
+                self.db.execute("INSERT OR REPLACE INTO directories (path, mtime) VALUES (?, ?)", (directory, mtime))
+                self.directories[directory] = mtime
+
+    def entry(self, filename):
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+
+        self.connect()
+        with self.lock:
+            entry = self.lookup(path, stat)
+            if entry is not None:
+                return path, entry
+
+        metadata = read_metadata(path)
+
+        with self.lock, self.db:
+            return path, self.store(path, stat, metadata)
+
+    def summary(self, filename):
+        """Returns items of the file's metadata that have short values; the returned dict must not be modified."""
+
+        return self.entry(filename)[1].summary
+
+    def metadata(self, filename):
+        """Returns all of the file's metadata as a new dict."""
+
+        path, entry = self.entry(filename)
+        if entry.complete:
+            return dict(entry.summary)
+
+        with self.lock:
+            row = self.db.execute("SELECT metadata FROM files WHERE path = ?", (path,)).fetchone()
+
+        return json.loads(row[0])
+
+
+index = MetadataIndex(os.path.join(cache.cache_dir, "metadata-index.sqlite"))
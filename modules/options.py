@@ -1,6 +1,8 @@
 import os
 import json
 import sys
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
 
 import gradio as gr
@@ -76,7 +78,7 @@ def options_section(section_identifier, options_dict):
     return options_dict
 
 
-options_builtin_fields = {"data_labels", "data", "restricted_opts", "typemap"}
+options_builtin_fields = {"data_labels", "data", "restricted_opts", "typemap", "thread_data"}
 
 
 class Options:
@@ -86,6 +88,7 @@ class Options:
         self.data_labels = data_labels
         self.data = {k: v.default for k, v in self.data_labels.items() if not v.do_not_save}
         self.restricted_opts = restricted_opts
+        self.thread_data = threading.local()
 
     def __setattr__(self, key, value):
         if key in options_builtin_fields:
@@ -133,14 +136,38 @@ class Options:
             return super(Options, self).__getattribute__(item)
 
         if self.data is not None:
-            if item in self.data:
-                return self.data[item]
+            data = getattr(self.thread_data, "snapshot", None)
+            if data is None:
+                data = self.data
+
+            if item in data:
+                return data[item]
 
         if item in self.data_labels:
             return self.data_labels[item].default
 
         return super(Options, self).__getattribute__(item)
 
+    def snapshot(self):
+        """Returns a copy of current values of all options, for use with using_snapshot()."""
+
+        return dict(self.data)
+
+    @contextmanager
+    def using_snapshot(self, snapshot):
+        """
+        Makes options read in the current thread return values from snapshot until the block ends.
+
+        This is for work that runs in background, like saving images, and has to see options as they were when it was
+        submitted, even if they were changed since, for example when override_settings of a generation were restored.
+        """
+
+        self.thread_data.snapshot = snapshot
+        try:
+            yield
+        finally:
+            self.thread_data.snapshot = None
+
     def set(self, key, value, is_api=False, run_callbacks=True):
         """sets an option and calls its onchange callback, returning True if the option changed and False otherwise"""
 
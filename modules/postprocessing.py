@@ -1,3 +1,5 @@
+import collections
+import concurrent.futures
 import os
 
 from PIL import Image
@@ -6,6 +8,65 @@ from modules import shared, images, devices, scripts, scripts_postprocessing, ui
 from modules.shared import opts
 
 
+def prepare_image(image_data):
+    image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
+
+    parameters, existing_pnginfo = images.read_info_from_image(image_data)
+    if parameters:
+        existing_pnginfo["parameters"] = parameters
+
+    return image_data, existing_pnginfo
+
+
+def read_image(filename):
+    image_data = images.read(filename)
+    image_data.load()
+
+    return prepare_image(image_data)
+
+
+def prefetch(executor, func, data, ahead):
+    """Yields (future, name) for (placeholder, name) pairs of data, with func(placeholder) running in the executor for up to `ahead` items in advance."""
+
+    pending = collections.deque()
+    for placeholder, name in data:
+        pending.append((executor.submit(func, placeholder), name))
+
+        if len(pending) > ahead:
+            yield pending.popleft()
+
+    while pending:
+        yield pending.popleft()
+
+
+def save_postprocessed_image(pp, outpath, basename, forced_filename, suffix, infotext, existing_pnginfo):
+    fullfn, _ = images.save_image(pp.image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix)
+
+    if pp.caption:
+        caption_filename = os.path.splitext(fullfn)[0] + ".txt"
+        existing_caption = ""
+        try:
+            with open(caption_filename, encoding="utf8") as file:
+                existing_caption = file.read().strip()
+        except FileNotFoundError:
+            pass
+
+        action = shared.opts.postprocessing_existing_caption_action
+        if action == 'Prepend' and existing_caption:
+            caption = f"{existing_caption} {pp.caption}"
+        elif action == 'Append' and existing_caption:
+            caption = f"{pp.caption} {existing_caption}"
+        elif action == 'Keep' and existing_caption:
+            caption = existing_caption
+        else:
+            caption = pp.caption
+
+        caption = caption.strip()
+        if caption:
+            with open(caption_filename, "w", encoding="utf8") as file:
+                file.write(caption)
+
+
 def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir, show_extras_results, *args, save_output: bool = True):
     devices.torch_gc()
 
@@ -44,6 +105,16 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
     data_to_process = list(get_images(extras_mode, image, image_folder, input_dir))
     shared.state.job_count = len(data_to_process)
 
+    # for batch from directory, files are read and decoded in a pool of threads ahead of processing, and results are
+    # encoded and saved in another pool, while the models run here
+    workers = opts.postprocessing_batch_workers if extras_mode == 2 else 0
+    loader = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extras loader") if workers > 0 else None
+    saver = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extras saver") if workers > 0 and save_output else None
+    pending_saves = collections.deque()
+
+    if loader is not None:
+        data_to_process = prefetch(loader, read_image, data_to_process, ahead=workers * 2)
+
     for image_placeholder, name in data_to_process:
         image_data: Image.Image
 
@@ -54,19 +125,18 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
         if shared.state.interrupted or shared.state.stopping_generation:
             break
 
-        if isinstance(image_placeholder, str):
+        if isinstance(image_placeholder, concurrent.futures.Future):
+            try:
+                image_data, existing_pnginfo = image_placeholder.result()
+            except Exception:
+                continue
+        elif isinstance(image_placeholder, str):
             try:
-                image_data = images.read(image_placeholder)
+                image_data, existing_pnginfo = read_image(image_placeholder)
             except Exception:
                 continue
         else:
-            image_data = image_placeholder
-
-        image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
-
-        parameters, existing_pnginfo = images.read_info_from_image(image_data)
-        if parameters:
-            existing_pnginfo["parameters"] = parameters
+            image_data, existing_pnginfo = prepare_image(image_placeholder)
 
         initial_pp = scripts_postprocessing.PostprocessedImage(image_data)
 
@@ -88,42 +158,35 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
 
             infotext = ", ".join([k if k == v else f'{k}: {infotext_utils.quote(v)}' for k, v in pp.info.items() if v is not None])
 
+            pnginfo = existing_pnginfo
             if opts.enable_pnginfo:
-                pp.image.info = existing_pnginfo
-                pp.image.info["postprocessing"] = infotext
+                # a copy for every image, since they can be waiting to be saved at the same time
+                pnginfo = {**existing_pnginfo, "postprocessing": infotext}
+                pp.image.info = pnginfo
 
             shared.state.assign_current_image(pp.image)
 
-            if save_output:
-                fullfn, _ = images.save_image(pp.image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix)
-
-                if pp.caption:
-                    caption_filename = os.path.splitext(fullfn)[0] + ".txt"
-                    existing_caption = ""
-                    try:
-                        with open(caption_filename, encoding="utf8") as file:
-                            existing_caption = file.read().strip()
-                    except FileNotFoundError:
-                        pass
-
-                    action = shared.opts.postprocessing_existing_caption_action
-                    if action == 'Prepend' and existing_caption:
-                        caption = f"{existing_caption} {pp.caption}"
-                    elif action == 'Append' and existing_caption:
-                        caption = f"{pp.caption} {existing_caption}"
-                    elif action == 'Keep' and existing_caption:
-                        caption = existing_caption
-                    else:
-                        caption = pp.caption
-
-                    caption = caption.strip()
-                    if caption:
-                        with open(caption_filename, "w", encoding="utf8") as file:
-                            file.write(caption)
+            if save_output and saver is not None:
+                while len(pending_saves) >= workers * 2:
+                    pending_saves.popleft().result()
+
+                pending_saves.append(saver.submit(save_postprocessed_image, pp, outpath, basename, forced_filename, suffix, infotext, pnginfo))
+            elif save_output:
+                save_postprocessed_image(pp, outpath, basename, forced_filename, suffix, infotext, pnginfo)
 
             if extras_mode != 2 or show_extras_results:
                 outputs.append(pp.image)
 
+    if loader is not None:
+        loader.shutdown(wait=True, cancel_futures=True)
+
+    if saver is not None:
+        shared.state.textinfo = "Saving"
+        saver.shutdown(wait=True)
+
+    for future in pending_saves:
+        future.result()
+
     devices.torch_gc()
     shared.state.end()
     return outputs, ui_common.plaintext_to_html(infotext), ''
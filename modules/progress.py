@@ -1,8 +1,13 @@
+import asyncio
 import base64
 import io
+import json
+import threading
 import time
 
 import gradio as gr
+from fastapi import Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from modules.shared import opts
@@ -14,22 +19,31 @@ import random
 from typing import List
 
 current_task = None
+current_tasks = set()
 pending_tasks = OrderedDict()
 finished_tasks = []
 recorded_results = []
 recorded_results_limit = 2
 
+live_preview_lock = threading.Lock()
+live_preview_encoded = (None, None, None)
 
-def start_task(id_task):
-    global current_task
+
+def start_task(id_task, *batched_tasks):
+    """Marks the task as running; batched_tasks are other tasks whose images are made in the same batch with it."""
+
+    global current_task, current_tasks
 
     current_task = id_task
-    pending_tasks.pop(id_task, None)
+    current_tasks = {id_task, *batched_tasks}
+    for x in current_tasks:
+        pending_tasks.pop(x, None)
 
 
 def finish_task(id_task):
     global current_task
 
+    current_tasks.discard(id_task)
     if current_task == id_task:
         current_task = None
 
@@ -50,7 +64,12 @@ def record_results(id_task, res):
 
 
 def add_task_to_queue(id_job):
-    pending_tasks[id_job] = time.time()
+    # a job submitted to the API is queued when submitted, and again when it starts running; keep its place in the queue
+    pending_tasks.setdefault(id_job, time.time())
+
+
+def remove_task_from_queue(id_job):
+    pending_tasks.pop(id_job, None)
 
 class PendingTasksResponse(BaseModel):
     size: int = Field(title="Pending task size")
@@ -75,6 +94,7 @@ class ProgressResponse(BaseModel):
 
 def setup_progress_api(app):
     app.add_api_route("/internal/pending-tasks", get_pending_tasks, methods=["GET"])
+    app.add_api_route("/internal/progress-stream", progress_stream_api, methods=["GET"])
     return app.add_api_route("/internal/progress", progressapi, methods=["POST"], response_model=ProgressResponse)
 
 
@@ -85,15 +105,33 @@ def get_pending_tasks():
 
 
 def progressapi(req: ProgressRequest):
-    active = req.id_task == current_task
-    queued = req.id_task in pending_tasks
-    completed = req.id_task in finished_tasks
+    res = get_progress(req.id_task)
+    if not res.active:
+        return res
+
+    res.id_live_preview = req.id_live_preview
+
+    if opts.live_previews_enable and req.live_preview:
+        id_live_preview, live_preview = get_live_preview()
+        if id_live_preview != req.id_live_preview and live_preview is not None:
+            res.id_live_preview = id_live_preview
+            res.live_preview = live_preview
+
+    return res
+
+
+def get_progress(id_task):
+    """Returns ProgressResponse for the task, without the live preview."""
+
+    active = id_task in current_tasks
+    queued = id_task in pending_tasks
+    completed = id_task in finished_tasks
 
     if not active:
         textinfo = "Waiting..."
         if queued:
             sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
-            queue_index = sorted_queued.index(req.id_task)
+            queue_index = sorted_queued.index(id_task)
             textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
         return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
 
@@ -113,36 +151,95 @@ def progressapi(req: ProgressRequest):
     predicted_duration = elapsed_since_start / progress if progress > 0 else None
     eta = predicted_duration - elapsed_since_start if predicted_duration is not None else None
 
-    live_preview = None
-    id_live_preview = req.id_live_preview
+    return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, textinfo=shared.state.textinfo)
 
-    if opts.live_previews_enable and req.live_preview:
+
+def get_live_preview():
+    """
+    Updates the live preview if enough steps were made and returns (id_live_preview, data: uri of the preview).
+
+    The image is encoded once and the result is shared by all clients asking for progress. The cache is keyed by the image
+    object itself rather than by id_live_preview, which starts over from 0 with every job.
+    """
+
+    global live_preview_encoded
+
+    with live_preview_lock:
         shared.state.set_current_image()
-        if shared.state.id_live_preview != req.id_live_preview:
-            image = shared.state.current_image
-            if image is not None:
-                buffered = io.BytesIO()
-
-                if opts.live_previews_image_format == "png":
-                    # using optimize for large images takes an enormous amount of time
-                    if max(*image.size) <= 256:
-                        save_kwargs = {"optimize": True}
-                    else:
-                        save_kwargs = {"optimize": False, "compress_level": 1}
 
+        id_live_preview = shared.state.id_live_preview
+        image_format = opts.live_previews_image_format
+        image = shared.state.current_image
+
+        if image is None:
+            return id_live_preview, None
+
+        if live_preview_encoded[0] is not image or live_preview_encoded[1] != image_format:
+            buffered = io.BytesIO()
+
+            if image_format == "png":
+                # using optimize for large images takes an enormous amount of time
+                if max(*image.size) <= 256:
+                    save_kwargs = {"optimize": True}
                 else:
-                    save_kwargs = {}
+                    save_kwargs = {"optimize": False, "compress_level": 1}
+
+            else:
+                save_kwargs = {}
+
+            image.save(buffered, format=image_format, **save_kwargs)
+            base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+            live_preview_encoded = (image, image_format, f"data:image/{image_format};base64,{base64_image}")
+
+        return id_live_preview, live_preview_encoded[2]
+
+
+def progress_stream_api(request: Request, id_task: str, id_live_preview: int = -1, live_preview: bool = True, inactivity_timeout: float = 40):
+    """
+    Server-sent events with progress of a task, as an alternative to polling /internal/progress.
+
+    A "progress" event (a ProgressResponse without the preview) is sent whenever progress, ETA or textinfo change, and a
+    "preview" event whenever there's a new live preview. The stream ends with a "done" event once the task has finished,
+    or with an "unknown" event if the task is neither running, queued nor finished for inactivity_timeout seconds, like
+    the progress bar in the UI gives up.
+    """
+
+    async def events():
+        last_progress = None
+        last_id_live_preview = id_live_preview
+        last_seen = time.time()
+
+        while not await request.is_disconnected():
+            res = get_progress(id_task)
+
+            progress_data = res.json(exclude={"live_preview", "id_live_preview"})
+            if progress_data != last_progress:
+                last_progress = progress_data
+                yield f"event: progress\ndata: {progress_data}\n\n"
+
+            if res.active and live_preview and opts.live_previews_enable:
+                new_id_live_preview, data_uri = await asyncio.to_thread(get_live_preview)
+                if new_id_live_preview != last_id_live_preview and data_uri is not None:
+                    last_id_live_preview = new_id_live_preview
+                    yield f"event: preview\ndata: {json.dumps({'id_live_preview': new_id_live_preview, 'live_preview': data_uri})}\n\n"
+
+            if res.completed and not res.active:
+                yield "event: done\ndata: {}\n\n"
+                break
+
+            if res.active or res.queued:
+                last_seen = time.time()
+            elif time.time() - last_seen > inactivity_timeout:
+                yield "event: unknown\ndata: {}\n\n"
+                break
 
-                image.save(buffered, format=opts.live_previews_image_format, **save_kwargs)
-                base64_image = base64.b64encode(buffered.getvalue()).decode('ascii')
-                live_preview = f"data:image/{opts.live_previews_image_format};base64,{base64_image}"
-                id_live_preview = shared.state.id_live_preview
+            await asyncio.sleep(max(opts.live_preview_refresh_period, 100) / 1000)
 
-    return ProgressResponse(active=active, queued=queued, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 def restore_progress(id_task):
-    while id_task == current_task or id_task in pending_tasks:
+    while id_task in current_tasks or id_task in pending_tasks:
         time.sleep(0.1)
 
     res = next(iter([x[1] for x in recorded_results if id_task == x[0]]), None)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 import re
 from collections import namedtuple
 import lark
@@ -25,6 +26,88 @@ plain: /([^\\\[\]():|]|\\.)+/
 %import common.SIGNED_NUMBER -> NUMBER
 """)
 
+
+class CollectSteps(lark.Visitor):
+    """Finds steps at which the prompt changes; replaces the number in each scheduled node of the tree with its step."""
+
+    def __init__(self, steps, int_offset, flt_offset, use_old_scheduling):
+        super().__init__()
+        self.steps = steps
+        self.int_offset = int_offset
+        self.flt_offset = flt_offset
+        self.use_old_scheduling = use_old_scheduling
+        self.res = [steps]
+
+    def scheduled(self, tree):
+        s = tree.children[-2]
+        v = float(s)
+        if self.use_old_scheduling:
+            v = v*self.steps if v<1 else v
+        else:
+            if "." in s:
+                v = (v - self.flt_offset) * self.steps
+            else:
+                v = (v - self.int_offset)
+        tree.children[-2] = min(self.steps, int(v))
+        if tree.children[-2] >= 1:
+            self.res.append(tree.children[-2])
+
+    def alternate(self, tree):
+        self.res.extend(range(1, self.steps+1))
+
+
+class AtStep(lark.Transformer):
+    """Makes the text of the prompt at a step from a tree that has been through CollectSteps."""
+
+    def __init__(self, step):
+        super().__init__()
+        self.step = step
+
+    def scheduled(self, args):
+        before, after, _, when, _ = args
+        yield before or () if self.step <= when else after
+    def alternate(self, args):
+        args = ["" if not arg else arg for arg in args]
+        yield args[(self.step - 1) % len(args)]
+    def start(self, args):
+        def flatten(x):
+            if isinstance(x, str):
+                yield x
+            else:
+                for gen in x:
+                    yield from flatten(gen)
+        return ''.join(flatten(args))
+    def plain(self, args):
+        yield args[0].value
+    def __default__(self, data, children, meta):
+        for child in children:
+            yield child
+
+
+@functools.lru_cache(maxsize=4096)
+def get_prompt_schedule(prompt, base_steps, hires_steps=None, use_old_scheduling=False):
+    """Returns the schedule for one prompt as a tuple of (step, text) tuples; results are memoized, since the same prompts are parsed over and over in grids and batches."""
+
+    if hires_steps is None or use_old_scheduling:
+        int_offset = 0
+        flt_offset = 0
+        steps = base_steps
+    else:
+        int_offset = base_steps
+        flt_offset = 1.0
+        steps = hires_steps
+
+    try:
+        tree = schedule_parser.parse(prompt)
+    except lark.exceptions.LarkError:
+        return ((steps, prompt), )
+
+    collect_steps = CollectSteps(steps, int_offset, flt_offset, use_old_scheduling)
+    collect_steps.visit(tree)
+
+    return tuple((t, AtStep(t).transform(tree)) for t in sorted(set(collect_steps.res)))
+
+
 def get_learned_conditioning_prompt_schedules(prompts, base_steps, hires_steps=None, use_old_scheduling=False):
     """
     >>> g = lambda p: get_learned_conditioning_prompt_schedules([p], 10)[0]
@@ -63,74 +146,8 @@ def get_learned_conditioning_prompt_schedules(prompts, base_steps, hires_steps=N
     [[5, 'a  c'], [10, 'a b c']]
     """
 
-    if hires_steps is None or use_old_scheduling:
-        int_offset = 0
-        flt_offset = 0
-        steps = base_steps
-    else:
-        int_offset = base_steps
-        flt_offset = 1.0
-        steps = hires_steps
-
-    def collect_steps(steps, tree):
-        res = [steps]
-
-        class CollectSteps(lark.Visitor):
-            def scheduled(self, tree):
-                s = tree.children[-2]
-                v = float(s)
-                if use_old_scheduling:
-                    v = v*steps if v<1 else v
-                else:
-                    if "." in s:
-                        v = (v - flt_offset) * steps
-                    else:
-                        v = (v - int_offset)
-                tree.children[-2] = min(steps, int(v))
-                if tree.children[-2] >= 1:
-                    res.append(tree.children[-2])
-
-            def alternate(self, tree):
-                res.extend(range(1, steps+1))
-
-        CollectSteps().visit(tree)
-        return sorted(set(res))
-
-    def at_step(step, tree):
-        class AtStep(lark.Transformer):
-            def scheduled(self, args):
-                before, after, _, when, _ = args
-                yield before or () if step <= when else after
-            def alternate(self, args):
-                args = ["" if not arg else arg for arg in args]
-                yield args[(step - 1) % len(args)]
-            def start(self, args):
-                def flatten(x):
-                    if isinstance(x, str):
-                        yield x
-                    else:
-                        for gen in x:
-                            yield from flatten(gen)
-                return ''.join(flatten(args))
-            def plain(self, args):
-                yield args[0].value
-            def __default__(self, data, children, meta):
-                for child in children:
-                    yield child
-        return AtStep().transform(tree)
-
-    def get_schedule(prompt):
-        try:
-            tree = schedule_parser.parse(prompt)
-        except lark.exceptions.LarkError:
-            if 0:
-                import traceback
-                traceback.print_exc()
-            return [[steps, prompt]]
-        return [[t, at_step(t, tree)] for t in collect_steps(steps, tree)]
-
-    promptdict = {prompt: get_schedule(prompt) for prompt in set(prompts)}
-    return [promptdict[prompt] for prompt in prompts]
+    promptdict = {prompt: get_prompt_schedule(prompt, base_steps, hires_steps, use_old_scheduling) for prompt in set(prompts)}
+    return [[[t, text] for t, text in promptdict[prompt]] for prompt in prompts]
 
 
 ScheduledPromptConditioning = namedtuple("ScheduledPromptConditioning", ["end_at_step", "cond"])
@@ -154,7 +171,7 @@ class SdConditioning(list):
 
 
 
-def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps, hires_steps=None, use_old_scheduling=False):
+def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps, hires_steps=None, use_old_scheduling=False, cond_cache=None):
     """converts a list of prompts into a list of prompt schedules - each schedule is a list of ScheduledPromptConditioning, specifying the comdition (cond),
     and the sampling step at which this condition is to be replaced by the next one.
 
@@ -171,6 +188,8 @@ def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps,
             ScheduledPromptConditioning(end_at_step=20, cond=tensor([[-0.3886,  0.0229, -0.0522,  ..., -0.4901, -0.3067,  0.0673], ..., [-0.7352, -0.4356, -0.7888,  ...,  0.6994, -0.4312, -1.2593]], device='cuda:0'))
         ]
     ]
+
+    If cond_cache (a cond_cache.BoundCondCache) is given, text encoder results for each prompt's schedule are looked up in it first.
     """
     res = []
 
@@ -185,7 +204,10 @@ def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps,
             continue
 
         texts = SdConditioning([x[1] for x in prompt_schedule], copy_from=prompts)
-        conds = model.get_learned_conditioning(texts)
+        if cond_cache is not None:
+            conds = cond_cache.get_learned_conditioning(model, texts)
+        else:
+            conds = model.get_learned_conditioning(texts)
 
         cond_schedule = []
         for i, (end_at_step, _) in enumerate(prompt_schedule):
@@ -249,7 +271,7 @@ class MulticondLearnedConditioning:
         self.batch: list[list[ComposableScheduledPromptConditioning]] = batch
 
 
-def get_multicond_learned_conditioning(model, prompts, steps, hires_steps=None, use_old_scheduling=False) -> MulticondLearnedConditioning:
+def get_multicond_learned_conditioning(model, prompts, steps, hires_steps=None, use_old_scheduling=False, cond_cache=None) -> MulticondLearnedConditioning:
     """same as get_learned_conditioning, but returns a list of ScheduledPromptConditioning along with the weight objects for each prompt.
     For each prompt, the list is obtained by splitting the prompt using the AND separator.
 
@@ -258,7 +280,7 @@ def get_multicond_learned_conditioning(model, prompts, steps, hires_steps=None,
 
     res_indexes, prompt_flat_list, prompt_indexes = get_multicond_prompt_list(prompts)
 
-    learned_conditioning = get_learned_conditioning(model, prompt_flat_list, steps, hires_steps, use_old_scheduling)
+    learned_conditioning = get_learned_conditioning(model, prompt_flat_list, steps, hires_steps, use_old_scheduling, cond_cache=cond_cache)
 
     res = []
     for indexes in res_indexes:
@@ -403,6 +425,13 @@ def parse_prompt_attention(text):
      ['.', 1.1]]
     """
 
+    return [[t, weight] for t, weight in parse_prompt_attention_cached(text)]
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_prompt_attention_cached(text):
+    """parse_prompt_attention that returns a tuple of (text, weight) tuples, memoized since the same prompts are parsed for every batch."""
+
     res = []
     round_brackets = []
     square_brackets = []
@@ -455,7 +484,7 @@ def parse_prompt_attention(text):
         else:
             i += 1
 
-    return res
+    return tuple((t, weight) for t, weight in res)
 
 if __name__ == "__main__":
     import doctest
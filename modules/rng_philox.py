@@ -15,6 +15,10 @@ Expected output:
 ```
 """
 
+import concurrent.futures
+import os
+import threading
+
 import numpy as np
 
 philox_m = [0xD2511F53, 0xCD9E8D57]
@@ -74,6 +78,108 @@ def box_muller(x, y):
     return r1.astype(np.float32)
 
 
+chunk_size = 65536
+"""How many numbers are generated at once by Generator.randn; buffers for a chunk are allocated once per thread and reused."""
+
+max_threads = min(8, os.cpu_count() or 1)
+"""How many threads Generator.randn uses for tensors with more than one chunk; NumPy releases the GIL, so chunks are made in parallel."""
+
+mask32 = np.uint64(0xFFFFFFFF)
+shift32 = np.uint64(32)
+two_pow32_inv_64 = two_pow32_inv.astype(np.float64)[0]
+two_pow32_inv_64_half = (two_pow32_inv / 2).astype(np.float64)[0]
+two_pow32_inv_2pi_64 = two_pow32_inv_2pi.astype(np.float64)[0]
+two_pow32_inv_2pi_64_half = (two_pow32_inv_2pi / 2).astype(np.float64)[0]
+
+
+class ChunkBuffers:
+    """Arrays for generating one chunk of numbers. Counters are kept in 64 bits, so that 32x32 bit products fit without conversions."""
+
+    def __init__(self, size):
+        self.counter = np.empty((4, size), dtype=np.uint64)
+        self.product = np.empty((2, size), dtype=np.uint64)
+        self.u = np.empty(size, dtype=np.float64)
+        self.v = np.empty(size, dtype=np.float64)
+
+
+chunk_buffers = threading.local()
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the thread pool for generating chunks; it's created once and kept, so that its threads keep their buffers."""
+
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="philox")
+
+    return executor
+
+
+def get_chunk_buffers():
+    buffers = getattr(chunk_buffers, "buffers", None)
+    if buffers is None or buffers.u.shape[0] != chunk_size:
+        buffers = chunk_buffers.buffers = ChunkBuffers(chunk_size)
+
+    return buffers
+
+
+def randn_chunk(out, start, offset, key):
+    """
+    Fills out with normal random numbers number start to start + len(out) for the given offset and key (a pair of 32-bit
+    ints). Does the same calculations as philox4_32 and box_muller, with scalar keys and without allocating memory.
+    """
+
+    n = out.shape[0]
+    buffers = get_chunk_buffers()
+    c0, c1, c2, c3 = (x[:n] for x in buffers.counter)
+    p0, p1 = (x[:n] for x in buffers.product)
+    u, v = buffers.u[:n], buffers.v[:n]
+
+    # the index of the number goes into counter[2], with the part that does not fit into 32 bits spilling into counter[3]
+    index = np.arange(start, start + n, dtype=np.uint64)
+    c0.fill(offset)
+    c1.fill(0)
+    np.bitwise_and(index, mask32, out=c2)
+    np.right_shift(index, shift32, out=c3)
+
+    k0, k1 = key
+    for _ in range(10):
+        np.multiply(c0, np.uint64(philox_m[0]), out=p0)
+        np.multiply(c2, np.uint64(philox_m[1]), out=p1)
+
+        np.right_shift(p1, shift32, out=c0)
+        np.bitwise_xor(c0, c1, out=c0)
+        np.bitwise_xor(c0, np.uint64(k0), out=c0)
+        np.bitwise_and(p1, mask32, out=c1)
+
+        np.right_shift(p0, shift32, out=c2)
+        np.bitwise_xor(c2, c3, out=c2)
+        np.bitwise_xor(c2, np.uint64(k1), out=c2)
+        np.bitwise_and(p0, mask32, out=c3)
+
+        k0 = (k0 + philox_w[0]) & 0xFFFFFFFF
+        k1 = (k1 + philox_w[1]) & 0xFFFFFFFF
+
+    # box_muller(c0, c1), computed in float64 like it is there
+    np.multiply(c0, two_pow32_inv_64, out=u)
+    np.add(u, two_pow32_inv_64_half, out=u)
+    np.multiply(c1, two_pow32_inv_2pi_64, out=v)
+    np.add(v, two_pow32_inv_2pi_64_half, out=v)
+
+    np.log(u, out=u)
+    np.multiply(u, -2.0, out=u)
+    np.sqrt(u, out=u)
+    np.sin(v, out=v)
+    np.multiply(u, v, out=u)
+
+    out[...] = u
+
+
 class Generator:
     """RNG that produces same outputs as torch.randn(..., device='cuda') on CPU"""
 
@@ -88,15 +194,21 @@ class Generator:
         for x in shape:
             n *= x
 
-        counter = np.zeros((4, n), dtype=np.uint32)
-        counter[0] = self.offset
-        counter[2] = np.arange(n, dtype=np.uint32)  # up to 2^32 numbers can be generated - if you want more you'd need to spill into counter[3]
+        key = np.empty(1, dtype=np.uint64)
+        key.fill(self.seed)
+        key = tuple(int(x) for x in key.view(np.uint32))
+
+        offset = self.offset & 0xFFFFFFFF
         self.offset += 1
 
-        key = np.empty(n, dtype=np.uint64)
-        key.fill(self.seed)
-        key = uint32(key)
+        res = np.empty(n, dtype=np.float32)
+        starts = range(0, n, chunk_size)
 
-        g = philox4_32(counter, key)
+        if len(starts) <= 1 or max_threads <= 1:
+            for start in starts:
+                randn_chunk(res[start:start + chunk_size], start, offset, key)
+        else:
+            for future in [get_executor().submit(randn_chunk, res[start:start + chunk_size], start, offset, key) for start in starts]:
+                future.result()
 
-        return box_muller(g[0], g[1]).reshape(shape)  # discard g[2] and g[3]
+        return res.reshape(shape)
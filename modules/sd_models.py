@@ -1,4 +1,3 @@
-import collections
 import importlib
 import os
 import sys
@@ -12,7 +11,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, sd_models_cache, metadata_index, extra_networks, processing, lowvram, sd_hijack, patches
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -24,7 +23,7 @@ model_path = os.path.abspath(os.path.join(paths.models_path, model_dir))
 checkpoints_list = {}
 checkpoint_aliases = {}
 checkpoint_alisases = checkpoint_aliases  # for compatibility with old name
-checkpoints_loaded = collections.OrderedDict()
+checkpoints_loaded = sd_models_cache.CheckpointCache()
 
 
 class ModelType(enum.Enum):
@@ -71,18 +70,8 @@ class CheckpointInfo:
         if name.startswith("\\") or name.startswith("/"):
             name = name[1:]
 
-        def read_metadata():
-            metadata = read_metadata_from_safetensors(filename)
-            self.modelspec_thumbnail = metadata.pop('modelspec.thumbnail', None)
-
-            return metadata
-
-        self.metadata = {}
-        if self.is_safetensors:
-            try:
-                self.metadata = cache.cached_data_for_file('safetensors-metadata', "checkpoint/" + name, filename, read_metadata)
-            except Exception as e:
-                errors.display(e, f"reading metadata for {filename}")
+        self._metadata = None
+        self.modelspec_thumbnail = None
 
         self.name = name
         self.name_for_extra = os.path.splitext(os.path.basename(filename))[0]
@@ -99,6 +88,26 @@ class CheckpointInfo:
         if self.shorthash:
             self.ids += [self.shorthash, self.sha256, f'{self.name} [{self.shorthash}]', f'{self.name_for_extra} [{self.shorthash}]']
 
+    @property
+    def metadata(self):
+        """Metadata from the header of a .safetensors file, read from the metadata index when first used."""
+
+        if self._metadata is None:
+            self._metadata = {}
+            if self.is_safetensors:
+                try:
+                    metadata = metadata_index.index.metadata(self.filename)
+                    self.modelspec_thumbnail = metadata.pop('modelspec.thumbnail', None)
+                    self._metadata = metadata
+                except Exception as e:
+                    errors.display(e, f"reading metadata for {self.filename}")
+
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
     def register(self):
         checkpoints_list[self.title] = self
         for id in self.ids:
@@ -172,6 +181,8 @@ def list_models():
     elif cmd_ckpt is not None and cmd_ckpt != shared.default_sd_model_file:
         print(f"Checkpoint in --ckpt argument not found (Possible it was moved to {model_path}: {cmd_ckpt}", file=sys.stderr)
 
+    metadata_index.index.update([x for x in model_list if os.path.splitext(x)[1].lower() == ".safetensors"])
+
     for filename in model_list:
         checkpoint_info = CheckpointInfo(filename)
         checkpoint_info.register()
@@ -333,12 +344,10 @@ def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
     sd_model_hash = checkpoint_info.calculate_shorthash()
     timer.record("calculate hash")
 
-    if checkpoint_info in checkpoints_loaded:
-        # use checkpoint cache
+    cached_state_dict = checkpoints_loaded.get(checkpoint_info)
+    if cached_state_dict is not None:
         print(f"Loading weights [{sd_model_hash}] from cache")
-        # move to end as latest
-        checkpoints_loaded.move_to_end(checkpoint_info)
-        return checkpoints_loaded[checkpoint_info]
+        return dict(cached_state_dict)
 
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
     res = read_state_dict(checkpoint_info.filename)
@@ -347,6 +356,21 @@ def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
     return res
 
 
+def warm_up_checkpoint_cache(checkpoint_infos):
+    """Reads checkpoints that are not in the checkpoint cache yet into it, without loading them into a model; returns the number of checkpoints read."""
+
+    count = 0
+    for checkpoint_info in checkpoint_infos:
+        if checkpoint_info in checkpoints_loaded:
+            continue
+
+        print(f"Loading weights [{checkpoint_info.calculate_shorthash()}] from {checkpoint_info.filename} into cache")
+        checkpoints_loaded.put(checkpoint_info, read_state_dict(checkpoint_info.filename, map_location="cpu"))
+        count += 1
+
+    return count
+
+
 class SkipWritingToConfig:
     """This context manager prevents load_model_weights from writing checkpoint name to the config when it loads weight."""
 
@@ -430,9 +454,9 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     if model.is_ssd:
         sd_hijack.model_hijack.convert_sdxl_to_ssd(model)
 
-    if shared.opts.sd_checkpoint_cache > 0:
+    if checkpoint_info not in checkpoints_loaded:
         # cache newly loaded model
-        checkpoints_loaded[checkpoint_info] = state_dict.copy()
+        checkpoints_loaded.put(checkpoint_info, state_dict)
 
     if hasattr(model, "before_load_weights"):
         model.before_load_weights(state_dict)
@@ -521,8 +545,7 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     timer.record("apply dtype to VAE")
 
     # clean up cache if limit is reached
-    while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache:
-        checkpoints_loaded.popitem(last=False)
+    checkpoints_loaded.shrink(keep=checkpoint_info)
 
     model.sd_model_hash = sd_model_hash
     model.sd_model_checkpoint = checkpoint_info.filename
@@ -0,0 +1,149 @@
+import collections
+import threading
+import time
+
+import torch
+
+from modules import devices, shared
+
+
+class CheckpointCacheEntry:
+    def __init__(self, state_dict, nbytes):
+        self.state_dict = state_dict
+        self.nbytes = nbytes
+        self.hits = 0
+        self.time_added = time.time()
+        self.time_used = self.time_added
+
+
+class CheckpointCache:
+    """
+    LRU cache of checkpoint state dicts in RAM, used to switch between checkpoints without reading them from disk.
+
+    The size of the cache is limited by the sd_checkpoint_cache option (number of checkpoints) and by the
+    sd_checkpoint_cache_ram option (total size of tensors in MB); a limit set to 0 is not used, and nothing is cached if
+    both are 0. Tensors are kept on CPU, in memory chosen by the sd_checkpoint_cache_storage option.
+    """
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.size = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def enabled(self):
+        return shared.opts.sd_checkpoint_cache > 0 or shared.opts.sd_checkpoint_cache_ram > 0
+
+    def __contains__(self, checkpoint_info):
+        with self.lock:
+            return checkpoint_info in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get(self, checkpoint_info):
+        """Returns the cached state dict for the checkpoint, or None."""
+
+        with self.lock:
+            entry = self.entries.get(checkpoint_info)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(checkpoint_info)
+            entry.hits += 1
+            entry.time_used = time.time()
+
+            return entry.state_dict
+
+    def put(self, checkpoint_info, state_dict):
+        """Stores a shallow copy of the state dict, with tensors moved to cache storage; keys of the state dict can be changed or deleted afterwards."""
+
+        if not self.enabled():
+            return
+
+        state_dict = {k: to_cache_storage(v) for k, v in state_dict.items()}
+        nbytes = sum(v.nelement() * v.element_size() for v in state_dict.values() if isinstance(v, torch.Tensor))
+
+        with self.lock:
+            self.pop(checkpoint_info)
+            self.entries[checkpoint_info] = CheckpointCacheEntry(state_dict, nbytes)
+            self.size += nbytes
+
+        self.shrink(keep=checkpoint_info)
+
+    def pop(self, checkpoint_info):
+        with self.lock:
+            entry = self.entries.pop(checkpoint_info, None)
+            if entry is not None:
+                self.size -= entry.nbytes
+
+            return entry
+
+    def shrink(self, keep=None):
+        """Removes least recently used checkpoints until the cache fits into limits; the checkpoint keep is removed last."""
+
+        count_limit = shared.opts.sd_checkpoint_cache
+        size_limit = shared.opts.sd_checkpoint_cache_ram * 1024 * 1024
+
+        with self.lock:
+            while self.entries:
+                over_count = count_limit > 0 and len(self.entries) > count_limit
+                over_size = size_limit > 0 and self.size > size_limit
+                if not self.enabled():
+                    over_count = True
+                if not over_count and not over_size:
+                    break
+
+                oldest = next(iter(self.entries))
+                if oldest == keep and len(self.entries) > 1:
+                    self.entries.move_to_end(oldest)
+                    continue
+
+                self.pop(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": self.size,
+                "max_size": shared.opts.sd_checkpoint_cache_ram * 1024 * 1024,
+                "max_count": shared.opts.sd_checkpoint_cache,
+                "storage": shared.opts.sd_checkpoint_cache_storage,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": [
+                    {
+                        "title": checkpoint_info.title,
+                        "size": entry.nbytes,
+                        "hits": entry.hits,
+                        "time_added": entry.time_added,
+                        "time_used": entry.time_used,
+                    }
+                    for checkpoint_info, entry in self.entries.items()
+                ],
+            }
+
+
+def to_cache_storage(x):
+    if not isinstance(x, torch.Tensor):
+        return x
+
+    storage = shared.opts.sd_checkpoint_cache_storage
+
+    # tensors may have been loaded straight to GPU; the model copies them into its own parameters, so CPU ones can be shared
+    x = x.to(devices.cpu)
+
+    if storage == "Pinned RAM" and torch.cuda.is_available():
+        x = x.pin_memory()
+    elif storage == "Shared memory":
+        x.share_memory_()
+
+    return x
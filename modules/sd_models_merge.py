@@ -0,0 +1,227 @@
+import collections
+import concurrent.futures
+import json
+import os
+import re
+
+import safetensors
+import torch
+
+from modules import sd_models, shared
+
+checkpoint_dict_skip_on_merge = ["cond_stage_model.transformer.text_model.embeddings.position_ids"]
+
+safetensors_dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+    "F8_E4M3": torch.float8_e4m3fn,
+    "F8_E5M2": torch.float8_e5m2,
+}
+
+safetensors_dtype_names = {v: k for k, v in safetensors_dtypes.items()}
+
+
+def to_half(tensor, enable):
+    if enable and tensor.dtype == torch.float:
+        return tensor.half()
+
+    return tensor
+
+
+class CheckpointMerger:
+    """
+    Merges weights of checkpoints A, B and C one tensor at a time. theta_func1 combines B and C (add difference), theta_func2
+    combines A with the result; either can be None.
+
+    Used both when whole checkpoints are loaded into RAM and by StreamingMerge, so both produce the same weights.
+    """
+
+    def __init__(self, theta_func1, theta_func2, multiplier, save_as_half, discard_weights=None):
+        self.theta_func1 = theta_func1
+        self.theta_func2 = theta_func2
+        self.multiplier = multiplier
+        self.save_as_half = save_as_half
+        self.discard_weights = re.compile(discard_weights) if discard_weights else None
+        self.vae_dict = None
+
+        self.is_inpainting = False
+        self.is_instruct_pix2pix = False
+
+    def is_merged(self, key, theta_1):
+        """Tells whether the tensor with this key in A is merged with the one from B; theta_1 is anything that supports `in`."""
+
+        return bool(self.theta_func2) and 'model' in key and key in theta_1 and key not in checkpoint_dict_skip_on_merge
+
+    def difference(self, key, b, c):
+        """Combines tensors from B and C; c is None if C does not have the key."""
+
+        if key in checkpoint_dict_skip_on_merge or 'model' not in key:
+            return b
+
+        if c is None:
+            return torch.zeros_like(b)
+
+        return self.theta_func1(b, c)
+
+    def merge(self, key, a, b):
+        # this enables merging an inpainting model (A) with another one (B);
+        # where normal model would have 4 channels, for latenst space, inpainting model would
+        # have another 4 channels for unmasked picture's latent space, plus one channel for mask, for a total of 9
+        if a.shape != b.shape and a.shape[0:1] + a.shape[2:] == b.shape[0:1] + b.shape[2:]:
+            if a.shape[1] == 4 and b.shape[1] == 9:
+                raise RuntimeError("When merging inpainting model with a normal one, A must be the inpainting model.")
+            if a.shape[1] == 4 and b.shape[1] == 8:
+                raise RuntimeError("When merging instruct-pix2pix model with a normal one, A must be the instruct-pix2pix model.")
+
+            if a.shape[1] == 8 and b.shape[1] == 4:#If we have an Instruct-Pix2Pix model...
+                a[:, 0:4, :, :] = self.theta_func2(a[:, 0:4, :, :], b, self.multiplier)#Merge only the vectors the models have in common.  Otherwise we get an error due to dimension mismatch.
+                self.is_instruct_pix2pix = True
+            else:
+                assert a.shape[1] == 9 and b.shape[1] == 4, f"Bad dimensions for merged layer {key}: A={a.shape}, B={b.shape}"
+                a[:, 0:4, :, :] = self.theta_func2(a[:, 0:4, :, :], b, self.multiplier)
+                self.is_inpainting = True
+        else:
+            a = self.theta_func2(a, b, self.multiplier)
+
+        return to_half(a, self.save_as_half)
+
+    def finish(self, key, tensor):
+        """Bakes in VAE and converts to half precision for a tensor of the result."""
+
+        if self.vae_dict is not None and key.startswith('first_stage_model.'):
+            vae_tensor = self.vae_dict.get(key[len('first_stage_model.'):])
+            if vae_tensor is not None:
+                tensor = to_half(vae_tensor, self.save_as_half)
+
+        if self.save_as_half and not self.theta_func2:
+            tensor = to_half(tensor, self.save_as_half)
+
+        return tensor
+
+    def keep(self, key):
+        """Tells whether the tensor with this key is saved in the result, as opposed to being discarded by user's request."""
+
+        return self.discard_weights is None or not re.search(self.discard_weights, key)
+
+
+class SafetensorsSource:
+    """A .safetensors checkpoint, read one tensor at a time, with keys renamed like in sd_models.get_state_dict_from_checkpoint."""
+
+    def __init__(self, filename):
+        self.file = safetensors.safe_open(filename, framework="pt", device="cpu")
+
+        keys = self.file.keys()
+        turbo_key = 'conditioner.embedders.0.model.ln_final.weight'
+        is_sd2_turbo = turbo_key in keys and self.file.get_slice(turbo_key).get_shape()[0] == 1024
+        replacements = sd_models.checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else sd_models.checkpoint_dict_replacements_sd1
+
+        self.keys = {sd_models.transform_checkpoint_dict_key(k, replacements): k for k in keys}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def get(self, key, meta=False):
+        """Returns the tensor; with meta=True, returns a tensor on meta device that only has the shape and dtype."""
+
+        if not meta:
+            return self.file.get_tensor(self.keys[key])
+
+        tensor_slice = self.file.get_slice(self.keys[key])
+        return torch.empty(tensor_slice.get_shape(), dtype=safetensors_dtypes[tensor_slice.get_dtype()], device="meta")
+
+
+class StreamingMerge:
+    """
+    Merges .safetensors checkpoints into a .safetensors file without loading them into RAM: tensors are read, merged and
+    written one by one, so the memory used is about the size of the largest tensor times the number of threads.
+
+    Creating the object goes through all tensors on meta device to find shapes and dtypes of the result (which are
+    needed for the file's header) and to report errors before anything is written.
+    """
+
+    def __init__(self, merger, primary_filename, secondary_filename=None, tertiary_filename=None):
+        self.merger = merger
+        self.theta_0 = SafetensorsSource(primary_filename)
+        self.theta_1 = SafetensorsSource(secondary_filename) if merger.theta_func2 else None
+        self.theta_2 = SafetensorsSource(tertiary_filename) if merger.theta_func1 else None
+
+        self.layout = {key: self.merge_tensor(key, meta=True) for key in self.theta_0 if merger.keep(key)}
+
+    def merge_tensor(self, key, meta=False):
+        a = self.theta_0.get(key, meta)
+
+        if self.merger.is_merged(key, self.theta_1):
+            b = self.theta_1.get(key, meta)
+
+            if self.theta_2 is not None:
+                b = self.merger.difference(key, b, self.theta_2.get(key, meta) if key in self.theta_2 else None)
+
+            a = self.merger.merge(key, a, b)
+
+        return self.merger.finish(key, a)
+
+    def tensors(self, keys, threads):
+        if threads <= 1:
+            for key in keys:
+                yield key, self.merge_tensor(key)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="checkpoint merger") as executor:
+            pending = collections.deque()
+            for key in keys:
+                pending.append((key, executor.submit(self.merge_tensor, key)))
+
+                if len(pending) >= threads:
+                    key, future = pending.popleft()
+                    yield key, future.result()
+
+            for key, future in pending:
+                yield key, future.result()
+
+    def save(self, filename, metadata=None, threads=1):
+        """Writes the result in safetensors format; the file only appears under its name once it is complete."""
+
+        # largest elements first, like safetensors does, so that every tensor is aligned to its element size
+        keys = sorted(self.layout, key=lambda k: (-self.layout[k].element_size(), k))
+
+        header = {"__metadata__": metadata} if metadata else {}
+        offset = 0
+        for key in keys:
+            tensor = self.layout[key]
+            size = tensor.nelement() * tensor.element_size()
+            header[key] = {"dtype": safetensors_dtype_names[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + size]}
+            offset += size
+
+        header = json.dumps(header, separators=(',', ':')).encode("utf8")
+        header += b' ' * (-len(header) % 8)
+
+        shared.state.sampling_steps = len(keys)
+
+        temp_filename = filename + ".tmp"
+        try:
+            with open(temp_filename, "wb") as file:
+                file.write(len(header).to_bytes(8, "little"))
+                file.write(header)
+
+                for key, tensor in self.tensors(keys, threads):
+                    expected = self.layout[key]
+                    assert tensor.dtype == expected.dtype and tensor.shape == expected.shape, f"Unexpected tensor {key}: {tensor.dtype} {tensor.shape}"
+
+                    file.write(memoryview(tensor.contiguous().reshape(-1).view(torch.uint8).numpy()))
+                    shared.state.sampling_step += 1
+
+            os.replace(temp_filename, filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
@@ -1,6 +1,12 @@
+import collections
+import concurrent.futures
+import hashlib
 import os
+import time
 import numpy as np
 import PIL
+import safetensors
+import safetensors.torch
 import torch
 from torch.utils.data import Dataset, DataLoader, Sampler
 from torchvision import transforms
@@ -9,7 +15,7 @@ from random import shuffle, choices
 
 import random
 import tqdm
-from modules import devices, shared, images
+from modules import devices, shared, images, hashes, cache, errors, sd_vae
 import re
 
 from ldm.modules.distributions.distributions import DiagonalGaussianDistribution
@@ -29,6 +35,124 @@ class DatasetEntry:
         self.pixel_values = pixel_values
 
 
+class LatentCache:
+    """
+    VAE outputs for training images, kept on disk as .safetensors shards in a directory for one VAE; shards are read
+    through memory mapping, and images that were not in the cache are added as new shards.
+
+    An image's entry is named by the hash of the image file's contents and the size it is resized to. Outputs of the
+    VAE are stored before sampling, so the same entry works for all latent sampling methods.
+    """
+
+    shard_size = 256
+
+    def __init__(self, path):
+        self.path = path
+        self.tensors = {}
+        self.new = {}
+        self.new_count = 0
+
+        if not os.path.isdir(path):
+            return
+
+        for filename in sorted(os.listdir(path)):
+            if not filename.endswith(".safetensors"):
+                continue
+
+            try:
+                file = safetensors.safe_open(os.path.join(path, filename), framework="pt", device="cpu")
+            except Exception:
+                errors.report(f"Error reading training latent cache {filename}", exc_info=True)
+                continue
+
+            for name in file.keys():
+                self.tensors[name] = file
+
+    def __contains__(self, key):
+        return f"{key}.size" in self.tensors
+
+    def get(self, key):
+        """Returns (image size, VAE output, whether VAE output is DiagonalGaussianDistribution's parameters, weight from alpha channel or None)."""
+
+        def tensor(name):
+            file = self.tensors.get(f"{key}.{name}")
+            return file.get_tensor(f"{key}.{name}") if file is not None else None
+
+        parameters = tensor("parameters")
+        encoded = parameters if parameters is not None else tensor("latent")
+
+        return tuple(tensor("size").tolist()), encoded, parameters is not None, tensor("weight")
+
+    def add(self, key, size, encoded, is_distribution, weight):
+        self.new[f"{key}.size"] = torch.tensor(size)
+        self.new[f"{key}.{'parameters' if is_distribution else 'latent'}"] = encoded.contiguous()
+        if weight is not None:
+            self.new[f"{key}.weight"] = weight.contiguous()
+
+        self.new_count += 1
+        if self.new_count >= self.shard_size:
+            self.save()
+
+    def save(self):
+        if not self.new:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = os.path.join(self.path, f"{time.time_ns()}-{os.getpid()}.safetensors")
+        safetensors.torch.save_file(self.new, filename + ".tmp")
+        os.replace(filename + ".tmp", filename)
+
+        self.new = {}
+        self.new_count = 0
+
+
+def latent_cache_path(model):
+    """Directory for LatentCache of the VAE that is currently used by the model."""
+
+    def file_identity(filename):
+        stat = os.stat(filename)
+        return f"{os.path.abspath(filename)}:{stat.st_mtime}:{stat.st_size}"
+
+    if sd_vae.loaded_vae_file is not None:
+        vae = "vae:" + file_identity(sd_vae.loaded_vae_file)
+    else:
+        checkpoint_info = model.sd_checkpoint_info
+        vae = "checkpoint:" + (checkpoint_info.sha256 or file_identity(checkpoint_info.filename))
+
+    digest = hashlib.sha256(f"{vae}:{devices.dtype_vae}".encode("utf8")).hexdigest()[:16]
+
+    return os.path.join(cache.cache_dir, "training-latents", digest)
+
+
+def read_image(path, width, height, varsize):
+    """Returns (image size, tensor for the VAE, alpha channel or None) for an image file."""
+
+    image = images.read(path)
+    #Currently does not work for single color transparency
+    #We would need to read image.info['transparency'] for that
+    alpha_channel = image.getchannel('A') if 'A' in image.getbands() else None
+    image = image.convert('RGB')
+    if not varsize:
+        image = image.resize((width, height), PIL.Image.BICUBIC)
+
+    npimage = np.array(image).astype(np.uint8)
+    npimage = (npimage / 127.5 - 1.0).astype(np.float32)
+
+    return image.size, torch.from_numpy(npimage).permute(2, 0, 1), alpha_channel
+
+
+def weight_from_alpha(alpha_channel, latent_shape):
+    channels, *latent_size = latent_shape
+    weight_img = alpha_channel.resize(latent_size)
+    npweight = np.array(weight_img).astype(np.float32)
+    #Repeat for every channel in the latent sample
+    weight = torch.tensor(np.array([npweight] * channels)).reshape([channels] + latent_size)
+    #Normalize the weight to a minimum of 0 and a mean of 1, that way the loss will be comparable to default.
+    weight -= weight.min()
+    weight /= weight.mean()
+    return weight
+
+
 class PersonalizedBase(Dataset):
     def __init__(self, data_root, width, height, repeats, flip_p=0.5, placeholder_token="*", model=None, cond_model=None, device=None, template_file=None, include_cond=False, batch_size=1, gradient_step=1, shuffle_tags=False, tag_drop_out=0, latent_sampling_method='once', varsize=False, use_weight=False):
         re_word = re.compile(shared.opts.dataset_filename_word_regex) if shared.opts.dataset_filename_word_regex else None
@@ -55,22 +179,84 @@ class PersonalizedBase(Dataset):
         groups = defaultdict(list)
 
         print("Preparing dataset...")
-        for path in tqdm.tqdm(self.image_paths):
-            alpha_channel = None
-            if shared.state.interrupted:
-                raise Exception("interrupted")
+        latent_cache = LatentCache(latent_cache_path(model)) if shared.opts.training_latent_cache else None
+        size_key = "varsize" if varsize else f"{width}x{height}"
+        encode_batch_size = max(1, batch_size)
+        conds = {}
+
+        def read(path):
+            """Runs in a thread: returns cache key, and image data unless the image is in cache; None if the file is not an image."""
+
             try:
-                image = images.read(path)
-                #Currently does not work for single color transparency
-                #We would need to read image.info['transparency'] for that
-                if use_weight and 'A' in image.getbands():
-                    alpha_channel = image.getchannel('A')
-                image = image.convert('RGB')
-                if not varsize:
-                    image = image.resize((width, height), PIL.Image.BICUBIC)
+                key = f"{hashes.calculate_sha256(path)}-{size_key}" if latent_cache is not None else None
+                if key is not None and key in latent_cache:
+                    return key, None
+
+                return key, read_image(path, width, height, varsize)
             except Exception:
-                continue
+                return None
+
+        def read_all(executor):
+            pending = collections.deque()
+            for path in self.image_paths:
+                pending.append((path, executor.submit(read, path)))
+
+                if len(pending) > encode_batch_size * 2:
+                    path, future = pending.popleft()
+                    yield path, future.result()
+
+            for path, future in pending:
+                yield path, future.result()
+
+        def encode(batch):
+            """VAE-encodes images of the same size together, and yields the same as LatentCache.get for each."""
+
+            torchdata = torch.stack([data for _, _, (_, data, _) in batch]).to(device=device, dtype=torch.float32)
+            with devices.autocast():
+                latent_dist = model.encode_first_stage(torchdata)
+
+            is_distribution = isinstance(latent_dist, DiagonalGaussianDistribution)
+            encoded = (latent_dist.parameters if is_distribution else latent_dist).to(devices.cpu)
+            del torchdata, latent_dist
+
+            for i, (path, key, (size, _, alpha_channel)) in enumerate(batch):
+                item_encoded = encoded[i:i + 1].clone()
+                channels = item_encoded.shape[1] // 2 if is_distribution else item_encoded.shape[1]
+                weight = weight_from_alpha(alpha_channel, [channels, *item_encoded.shape[2:]]) if alpha_channel is not None else None
+
+                if latent_cache is not None:
+                    latent_cache.add(key, size, item_encoded, is_distribution, weight)
+
+                yield path, (size, item_encoded, is_distribution, weight)
+
+        def prepared_images():
+            """Yields (path, data like from LatentCache.get) for all images, reading them in threads and encoding uncached ones in batches."""
+
+            batches = defaultdict(list)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="dataset") as executor:
+                for path, result in tqdm.tqdm(read_all(executor), total=len(self.image_paths)):
+                    if shared.state.interrupted:
+                        raise Exception("interrupted")
+
+                    if result is None:
+                        continue
 
+                    key, image_data = result
+                    if image_data is None:
+                        yield path, latent_cache.get(key)
+                        continue
+
+                    batch = batches[image_data[0]]
+                    batch.append((path, key, image_data))
+                    if len(batch) >= encode_batch_size:
+                        yield from encode(batch)
+                        batch.clear()
+
+            for batch in batches.values():
+                if batch:
+                    yield from encode(batch)
+
+        for path, (image_size, encoded, is_distribution, alpha_weight) in prepared_images():
             text_filename = f"{os.path.splitext(path)[0]}.txt"
             filename = os.path.basename(path)
 
@@ -84,14 +270,7 @@ class PersonalizedBase(Dataset):
                     tokens = re_word.findall(filename_text)
                     filename_text = (shared.opts.dataset_filename_join_string or "").join(tokens)
 
-            npimage = np.array(image).astype(np.uint8)
-            npimage = (npimage / 127.5 - 1.0).astype(np.float32)
-
-            torchdata = torch.from_numpy(npimage).permute(2, 0, 1).to(device=device, dtype=torch.float32)
-            latent_sample = None
-
-            with devices.autocast():
-                latent_dist = model.encode_first_stage(torchdata.unsqueeze(dim=0))
+            latent_dist = DiagonalGaussianDistribution(encoded.to(device)) if is_distribution else encoded.to(device)
 
             #Perform latent sampling, even for random sampling.
             #We need the sample dimensions for the weights
@@ -103,15 +282,8 @@ class PersonalizedBase(Dataset):
                     latent_sampling_method = "once"
             latent_sample = model.get_first_stage_encoding(latent_dist).squeeze().to(devices.cpu)
 
-            if use_weight and alpha_channel is not None:
-                channels, *latent_size = latent_sample.shape
-                weight_img = alpha_channel.resize(latent_size)
-                npweight = np.array(weight_img).astype(np.float32)
-                #Repeat for every channel in the latent sample
-                weight = torch.tensor([npweight] * channels).reshape([channels] + latent_size)
-                #Normalize the weight to a minimum of 0 and a mean of 1, that way the loss will be comparable to default.
-                weight -= weight.min()
-                weight /= weight.mean()
+            if use_weight and alpha_weight is not None:
+                weight = alpha_weight
             elif use_weight:
                 #If an image does not have a alpha channel, add a ones weight map anyway so we can stack it later
                 weight = torch.ones(latent_sample.shape)
@@ -127,15 +299,19 @@ class PersonalizedBase(Dataset):
                 entry.cond_text = self.create_text(filename_text)
 
             if include_cond and not (self.tag_drop_out != 0 or self.shuffle_tags):
-                with devices.autocast():
-                    entry.cond = cond_model([entry.cond_text]).to(devices.cpu).squeeze(0)
-            groups[image.size].append(len(self.dataset))
+                entry.cond = conds.get(entry.cond_text)
+                if entry.cond is None:
+                    with devices.autocast():
+                        entry.cond = conds[entry.cond_text] = cond_model([entry.cond_text]).to(devices.cpu).squeeze(0)
+            groups[image_size].append(len(self.dataset))
             self.dataset.append(entry)
-            del torchdata
             del latent_dist
             del latent_sample
             del weight
 
+        if latent_cache is not None:
+            latent_cache.save()
+
         self.length = len(self.dataset)
         self.groups = list(groups.values())
         assert self.length > 0, "No images have been found in the dataset."
@@ -83,6 +83,7 @@ def txt2img_upscale(id_task: str, request: gr.Request, gallery, gallery_index, g
             processed = processing.process_images(p)
 
     shared.total_tqdm.clear()
+    processed.wait_for_saving()
 
     new_gallery = []
     for i, image in enumerate(gallery):
@@ -109,6 +110,7 @@ def txt2img(id_task: str, request: gr.Request, *args):
             processed = processing.process_images(p)
 
     shared.total_tqdm.clear()
+    processed.wait_for_saving()
 
     generation_info_js = processed.js()
     if opts.samples_log_stdout:
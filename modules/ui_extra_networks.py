@@ -165,16 +165,34 @@ def get_single_card(page: str = "", tabname: str = "", name: str = ""):
         item = page.items.get(name)
 
     page.read_user_metadata(item, use_cache=False)
+    page.card_index = None
     item_html = page.create_item_html(tabname, item, shared.html("extra-networks-card.html"))
 
     return JSONResponse({"html": item_html})
 
 
+def get_cards(page: str = "", tabname: str = "", search: str = "", sort: str = "default", sort_dir: str = "Ascending", offset: int = 0):
+    """Returns HTML for the next extra_networks_cards_per_request cards of the page that match the search, in requested order."""
+
+    from starlette.responses import JSONResponse
+
+    page = next(iter([x for x in extra_pages if x.extra_networks_tabname == page]), None)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Page not found")
+
+    items = page.find_items(search, sort, reverse=sort_dir == "Descending")
+    count = shared.opts.extra_networks_cards_per_request or len(items)
+    cards = [page.create_item_html(tabname, item, page.card_tpl) for item in items[offset:offset + count]]
+
+    return JSONResponse({"html": "".join(cards), "offset": offset + len(cards), "total": len(items)})
+
+
 def add_pages_to_demo(app):
     app.add_api_route("/sd_extra_networks/thumb", fetch_file, methods=["GET"])
     app.add_api_route("/sd_extra_networks/cover-images", fetch_cover_images, methods=["GET"])
     app.add_api_route("/sd_extra_networks/metadata", get_metadata, methods=["GET"])
     app.add_api_route("/sd_extra_networks/get-single-card", get_single_card, methods=["GET"])
+    app.add_api_route("/sd_extra_networks/cards", get_cards, methods=["GET"])
 
 
 def quote_js(s):
@@ -193,6 +211,7 @@ class ExtraNetworksPage:
         self.allow_negative_prompt = False
         self.metadata = {}
         self.items = {}
+        self.card_index = None
         self.lister = util.MassFileLister()
         # HTML Templates
         self.pane_tpl = shared.html("extra-networks-pane.html")
@@ -286,21 +305,7 @@ class ExtraNetworksPage:
             }
         )
 
-        local_path = ""
-        filename = item.get("filename", "")
-        for reldir in self.allowed_directories_for_previews():
-            absdir = os.path.abspath(reldir)
-
-            if filename.startswith(absdir):
-                local_path = filename[len(absdir):]
-
-        # if this is true, the item must not be shown in the default view, and must instead only be
-        # shown when searching for it
-        if shared.opts.extra_networks_hidden_models == "Always":
-            search_only = False
-        else:
-            search_only = "/." in local_path or "\\." in local_path
-
+        search_only = self.is_search_only(item)
         if search_only and shared.opts.extra_networks_hidden_models == "Never":
             return ""
 
@@ -350,6 +355,66 @@ class ExtraNetworksPage:
         else:
             return args
 
+    def is_search_only(self, item: dict) -> bool:
+        """Tells whether the item must not be shown in the default view, and must instead only be shown when searching for it."""
+
+        local_path = ""
+        filename = item.get("filename", "")
+        for reldir in self.allowed_directories_for_previews():
+            absdir = os.path.abspath(reldir)
+
+            if filename.startswith(absdir):
+                local_path = filename[len(absdir):]
+
+        if shared.opts.extra_networks_hidden_models == "Always":
+            return False
+
+        return "/." in local_path or "\\." in local_path
+
+    def get_card_index(self) -> list:
+        """Returns a list of (item, lowercase text to search in, search_only) tuples, made from self.items when first needed."""
+
+        if self.card_index is None:
+            card_index = []
+            for item in self.items.values():
+                texts = list(item.get("search_terms", []))
+                if shared.opts.extra_networks_card_show_desc:
+                    texts.append(item.get("description", "") or "")
+
+                card_index.append((item, " ".join(texts).lower(), self.is_search_only(item)))
+
+            self.card_index = card_index
+
+        return self.card_index
+
+    def find_items(self, search: str = "", sort: str = "default", reverse: bool = False) -> list:
+        """Returns items whose cards match the search, ordered the same way as cards are sorted in the browser.
+
+        Args:
+            search: Text to look for in search terms and description, case-insensitive.
+            sort: Name of a sort key of items, such as "default", "name" or "date_modified".
+            reverse: Sort in descending order.
+
+        Returns:
+            A list of item dictionaries.
+        """
+        search = search.lower()
+        show_hidden = len(search) >= 4 and shared.opts.extra_networks_hidden_models != "Never"
+        items = [item for item, text, search_only in self.get_card_index() if search in text and (show_hidden or not search_only)]
+
+        def sort_key(item):
+            value = str(item.get("sort_keys", {}).get(sort, ""))
+            if value.lstrip("-").isdigit():
+                return 0, int(value), ""
+
+            return 1, 0, value
+
+        items.sort(key=sort_key)
+        if reverse:
+            items.reverse()
+
+        return items
+
     def create_tree_dir_item_html(
         self,
         tabname: str,
@@ -562,6 +627,10 @@ class ExtraNetworksPage:
         Returns:
             HTML formatted string.
         """
+        if shared.opts.extra_networks_cards_per_request > 0 and self.items:
+            # cards are requested from get_cards by javascript as the user scrolls
+            return "<div class='extra-network-more-cards'></div>"
+
         res = []
         for item in self.items.values():
             res.append(self.create_item_html(tabname, item, self.card_tpl))
@@ -589,6 +658,7 @@ class ExtraNetworksPage:
 
         items_list = [] if empty else self.list_items()
         self.items = {x["name"]: x for x in items_list}
+        self.card_index = None
 
         # Populate the instance metadata for each item.
         for item in self.items.values():
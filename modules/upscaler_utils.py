@@ -1,4 +1,5 @@
 import logging
+import math
 from typing import Callable
 
 import numpy as np
@@ -6,7 +7,7 @@ import torch
 import tqdm
 from PIL import Image
 
-from modules import devices, images, shared, torch_utils
+from modules import devices, shared, torch_utils
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +49,128 @@ def upscale_pil_patch(model, img: Image.Image) -> Image.Image:
             return torch_bgr_to_pil_image(model(tensor))
 
 
+def is_out_of_memory(e: Exception) -> bool:
+    message = str(e)
+    return isinstance(e, torch.cuda.OutOfMemoryError) or "out of memory" in message or "not enough memory" in message
+
+
+def tile_batch_size(device: torch.device) -> int:
+    """Tiles per model call from upscaler_tile_batch_size option; 0 means 4 on GPU and 1 on CPU, where batching does not make it faster."""
+
+    if shared.opts.upscaler_tile_batch_size > 0:
+        return shared.opts.upscaler_tile_batch_size
+
+    return 1 if device.type == "cpu" else 4
+
+
+def upscale_tile_batches(
+    model,
+    img: torch.Tensor,
+    positions: list[tuple[int, int]],
+    tile_h: int,
+    tile_w: int,
+    *,
+    device: torch.device,
+    dtype: torch.dtype,
+    desc: str,
+):
+    """
+    Runs the model on tiles of BCHW img with top-left corners at given (y, x) positions, stacking several tiles into one
+    call; yields lists of positions along with model output for them, concatenated along the batch dimension.
+
+    The number of tiles per call is set by tile_batch_size(); it is halved for the rest of the image every
+    time the model runs out of memory. Stops early if the job is interrupted or skipped.
+    """
+    batch_size = tile_batch_size(torch.device(device))
+
+    with tqdm.tqdm(total=len(positions), desc=desc, disable=not shared.opts.enable_upscale_progressbar) as pbar:
+        i = 0
+        while i < len(positions):
+            if shared.state.interrupted or shared.state.skipped:
+                return
+
+            batch = positions[i:i + batch_size]
+            tiles = torch.cat([img[..., y:y + tile_h, x:x + tile_w] for y, x in batch]).to(device=device, dtype=dtype)
+
+            try:
+                output = model(tiles)
+            except RuntimeError as e:
+                if batch_size == 1 or not is_out_of_memory(e):
+                    raise
+
+                output = None
+
+            if output is None:
+                del tiles
+                devices.torch_gc()
+                batch_size = max(1, len(batch) // 2)
+                logger.debug("Out of memory while upscaling %d tiles at once, trying %d", len(batch), batch_size)
+                continue
+
+            yield batch, output
+
+            pbar.update(len(batch))
+            i += len(batch)
+
+
+def grid_tile_positions(size: int, tile_size: int, overlap: int) -> list[int]:
+    """Start coordinates of tiles along one side of an image, in the same places as images.split_grid puts them."""
+
+    count = math.ceil((size - overlap) / (tile_size - overlap))
+    step = (size - tile_size) / (count - 1) if count > 1 else 0
+    return [min(int(i * step), size - tile_size) for i in range(count)]
+
+
+def feather_weights(length: int, ramp: int, start: bool, end: bool) -> torch.Tensor:
+    """Weights for blending a tile along one side: rising over ramp pixels at the start and falling at the end, if there are neighbouring tiles there."""
+
+    weights = torch.ones(length)
+    if ramp > 0:
+        rising = (torch.arange(ramp) + 0.5) / ramp
+        if start:
+            weights[:ramp] = rising
+        if end:
+            weights[-ramp:] = torch.minimum(weights[-ramp:], rising.flip(0))
+
+    return weights
+
+
+class TileCanvas:
+    """
+    Blends upscaled BGR tiles, which must come in top-to-bottom order, into an 8-bit RGB image. Only a band of rows as high
+    as one tile is kept in float; rows above the latest tile are final and are converted right away.
+    """
+
+    def __init__(self, channels: int, height: int, width: int, tile_h: int):
+        self.output = torch.empty((height, width, channels), dtype=torch.uint8)
+        self.band = torch.zeros((channels, tile_h, width))
+        self.weights = torch.zeros((1, tile_h, width))
+        self.top = 0
+
+    def add(self, y: int, x: int, tile: torch.Tensor, weights: torch.Tensor):
+        """Adds a tile that is already multiplied by its weights."""
+
+        if y > self.top:
+            self.flush(y)
+
+        h, w = tile.shape[-2:]
+        self.band[:, y - self.top:y - self.top + h, x:x + w].add_(tile)
+        self.weights[:, y - self.top:y - self.top + h, x:x + w].add_(weights)
+
+    def flush(self, y: int):
+        n = y - self.top
+        rows = self.band[:, :n] / self.weights[:, :n]
+        self.output[self.top:y] = rows.clamp_(0, 1).mul_(255).round_().flip(0).permute(1, 2, 0).to(torch.uint8)
+
+        self.band = torch.cat([self.band[:, n:], torch.zeros_like(self.band[:, :n])], dim=1)
+        self.weights = torch.cat([self.weights[:, n:], torch.zeros_like(self.weights[:, :n])], dim=1)
+        self.top = y
+
+    def finish(self) -> Image.Image:
+        self.flush(self.output.shape[0])
+        return Image.fromarray(self.output.numpy(), "RGB")
+
+
 def upscale_with_model(
     model: Callable[[torch.Tensor], torch.Tensor],
     img: Image.Image,
@@ -62,30 +185,41 @@ def upscale_with_model(
         logger.debug("=> %s", output)
         return output
 
-    grid = images.split_grid(img, tile_size, tile_size, tile_overlap)
-    newtiles = []
-
-    with tqdm.tqdm(total=grid.tile_count, desc=desc, disable=not shared.opts.enable_upscale_progressbar) as p:
-        for y, h, row in grid.tiles:
-            newrow = []
-            for x, w, tile in row:
-                if shared.state.interrupted:
-                    return img
-                output = upscale_pil_patch(model, tile)
-                scale_factor = output.width // tile.width
-                newrow.append([x * scale_factor, w * scale_factor, output])
-                p.update(1)
-            newtiles.append([y * scale_factor, h * scale_factor, newrow])
-
-    newgrid = images.Grid(
-        newtiles,
-        tile_w=grid.tile_w * scale_factor,
-        tile_h=grid.tile_h * scale_factor,
-        image_w=grid.image_w * scale_factor,
-        image_h=grid.image_h * scale_factor,
-        overlap=grid.overlap * scale_factor,
-    )
-    return images.combine_grid(newgrid)
+    param = torch_utils.get_param(model)
+    tensor = pil_image_to_torch_bgr(img).to(dtype=param.dtype).unsqueeze(0)  # add batch dimension
+
+    # tiles are placed like images.split_grid does it, and feathered over the overlap like images.combine_grid does it,
+    # but tiles stay tensors, several of them go through the model at once, and blending is done in float
+    h, w = tensor.shape[-2:]
+    tile_h, tile_w = min(tile_size, h), min(tile_size, w)
+    overlap = min(tile_overlap, tile_h - 1, tile_w - 1)
+    ys = grid_tile_positions(h, tile_h, overlap)
+    xs = grid_tile_positions(w, tile_w, overlap)
+    positions = [(y, x) for y in ys for x in xs]
+
+    canvas = None
+    with torch.inference_mode(), devices.without_autocast():
+        for batch, output in upscale_tile_batches(model, tensor, positions, tile_h, tile_w, device=param.device, dtype=param.dtype, desc=desc):
+            scale = output.shape[-1] // tile_w
+            if canvas is None:
+                canvas = TileCanvas(output.shape[1], h * scale, w * scale, tile_h * scale)
+
+            ramp = overlap * scale
+            weights = torch.stack([
+                feather_weights(tile_h * scale, ramp, y > 0, y + tile_h < h)[:, None] * feather_weights(tile_w * scale, ramp, x > 0, x + tile_w < w)[None, :]
+                for y, x in batch
+            ])[:, None].to(output.device)
+
+            output = (output.float() * weights).cpu()
+            weights = weights.cpu()
+
+            for i, (y, x) in enumerate(batch):
+                canvas.add(y * scale, x * scale, output[i], weights[i])
+
+        if canvas is None or shared.state.interrupted or shared.state.skipped:
+            return img
+
+        return canvas.finish()
 
 
 def tiled_upscale_2(
@@ -99,9 +233,9 @@ def tiled_upscale_2(
     desc="Tiled upscale",
 ):
     # Alternative implementation of `upscale_with_model` originally used by
-    # SwinIR and ScuNET.  It differs from `upscale_with_model` in that tiling and
-    # weighting is done in PyTorch space, as opposed to `images.Grid` doing it in
-    # Pillow space without weighting.
+    # SwinIR and ScuNET.  It differs from `upscale_with_model` in that tiles are
+    # placed at a fixed stride and overlapping parts are averaged without feathering,
+    # and that the whole result is kept on the device.
 
     b, c, h, w = img.size()
     tile_size = min(tile_size, h, w)
@@ -123,39 +257,23 @@ def tiled_upscale_2(
     )
     weights = torch.zeros_like(result)
     logger.debug("Upscaling %s to %s with tiles", img.shape, result.shape)
-    with tqdm.tqdm(total=len(h_idx_list) * len(w_idx_list), desc=desc, disable=not shared.opts.enable_upscale_progressbar) as pbar:
-        for h_idx in h_idx_list:
-            if shared.state.interrupted or shared.state.skipped:
-                break
-
-            for w_idx in w_idx_list:
-                if shared.state.interrupted or shared.state.skipped:
-                    break
-
-                # Only move this patch to the device if it's not already there.
-                in_patch = img[
-                    ...,
-                    h_idx : h_idx + tile_size,
-                    w_idx : w_idx + tile_size,
-                ].to(device=device)
-
-                out_patch = model(in_patch)
-
-                result[
-                    ...,
-                    h_idx * scale : (h_idx + tile_size) * scale,
-                    w_idx * scale : (w_idx + tile_size) * scale,
-                ].add_(out_patch)
-
-                out_patch_mask = torch.ones_like(out_patch)
-
-                weights[
-                    ...,
-                    h_idx * scale : (h_idx + tile_size) * scale,
-                    w_idx * scale : (w_idx + tile_size) * scale,
-                ].add_(out_patch_mask)
 
-                pbar.update(1)
+    positions = [(h_idx, w_idx) for h_idx in h_idx_list for w_idx in w_idx_list]
+    for batch, out_patches in upscale_tile_batches(model, img, positions, tile_size, tile_size, device=device, dtype=img.dtype, desc=desc):
+        for i, (h_idx, w_idx) in enumerate(batch):
+            out_patch = out_patches[i * b:(i + 1) * b]
+
+            result[
+                ...,
+                h_idx * scale : (h_idx + tile_size) * scale,
+                w_idx * scale : (w_idx + tile_size) * scale,
+            ].add_(out_patch)
+
+            weights[
+                ...,
+                h_idx * scale : (h_idx + tile_size) * scale,
+                w_idx * scale : (w_idx + tile_size) * scale,
+            ].add_(1)
 
     output = result.div_(weights)
 
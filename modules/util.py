@@ -178,6 +178,20 @@ def topological_sort(dependencies):
     return result
 
 
+def batched(iterable, n):
+    """Splits an iterable into lists of at most n items; like itertools.batched from python 3.12."""
+
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
 def open_folder(path):
     """Open a folder in the file manager of the respect OS."""
     # import at function level to avoid potential issues
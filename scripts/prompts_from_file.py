@@ -5,8 +5,8 @@ import shlex
 import modules.scripts as scripts
 import gradio as gr
 
-from modules import sd_samplers, errors, sd_models
-from modules.processing import Processed, process_images
+from modules import sd_samplers, errors, sd_models, extra_networks
+from modules.processing import Processed, process_images, get_fixed_seed
 from modules.shared import state
 
 
@@ -99,6 +99,53 @@ def cmdargs(line):
     return res
 
 
+batched_tags = {"prompt", "negative_prompt", "seed", "subseed"}
+
+
+def batch_key(args):
+    """Returns a value that is the same for lines that only differ in prompts and seeds, or None for lines that set their own batch size or batch count.
+
+    Lines with different extra networks get different keys: process_images uses extra networks of the first prompt for the whole batch."""
+
+    if "batch_size" in args or "n_iter" in args:
+        return None
+
+    key = tuple(sorted((k, v) for k, v in args.items() if k not in batched_tags))
+
+    return key, extra_networks.extra_networks_key(args.get("prompt", "")), extra_networks.extra_networks_key(args.get("negative_prompt", ""))
+
+
+def group_lines(jobs, batch_size):
+    """Splits parsed lines into groups of up to batch_size consecutive lines that can be generated in one batch."""
+
+    groups = []
+    for args in jobs:
+        key = batch_key(args)
+        if key is not None and groups and len(groups[-1]) < batch_size and batch_key(groups[-1][0]) == key:
+            groups[-1].append(args)
+        else:
+            groups.append([args])
+
+    return groups
+
+
+def combine_jobs(jobs):
+    """Makes one processing object that generates one picture for each of jobs in every iteration; jobs must only differ in prompts and seeds."""
+
+    p = copy.copy(jobs[0])
+
+    seeds = [get_fixed_seed(job.seed) for job in jobs]
+    subseeds = [get_fixed_seed(job.subseed) for job in jobs]
+
+    p.prompt = [job.prompt for job in jobs] * p.n_iter
+    p.negative_prompt = [job.negative_prompt for job in jobs] * p.n_iter
+    p.seed = [seed + (i if p.subseed_strength == 0 else 0) for i in range(p.n_iter) for seed in seeds]
+    p.subseed = [subseed + i for i in range(p.n_iter) for subseed in subseeds]
+    p.batch_size = len(jobs)
+
+    return p
+
+
 def load_prompt_file(file):
     if file is None:
         return None, gr.update(), gr.update(lines=7)
@@ -115,6 +162,7 @@ class Script(scripts.Script):
         checkbox_iterate = gr.Checkbox(label="Iterate seed every line", value=False, elem_id=self.elem_id("checkbox_iterate"))
         checkbox_iterate_batch = gr.Checkbox(label="Use same random seed for all lines", value=False, elem_id=self.elem_id("checkbox_iterate_batch"))
         prompt_position = gr.Radio(["start", "end"], label="Insert prompts at the", elem_id=self.elem_id("prompt_position"), value="start")
+        checkbox_batch_lines = gr.Checkbox(label="Batch lines", value=False, elem_id=self.elem_id("checkbox_batch_lines"), tooltip="Make one picture per line, and generate up to batch size consecutive lines that only differ in prompt or seed together.")
 
         prompt_txt = gr.Textbox(label="List of prompt inputs", lines=1, elem_id=self.elem_id("prompt_txt"))
         file = gr.File(label="Upload prompt inputs", type='binary', elem_id=self.elem_id("file"))
@@ -125,9 +173,9 @@ class Script(scripts.Script):
         # We don't shrink back to 1, because that causes the control to ignore [enter], and it may
         # be unclear to the user that shift-enter is needed.
         prompt_txt.change(lambda tb: gr.update(lines=7) if ("\n" in tb) else gr.update(lines=2), inputs=[prompt_txt], outputs=[prompt_txt], show_progress=False)
-        return [checkbox_iterate, checkbox_iterate_batch, prompt_position, prompt_txt]
+        return [checkbox_iterate, checkbox_iterate_batch, prompt_position, prompt_txt, checkbox_batch_lines]
 
-    def run(self, p, checkbox_iterate, checkbox_iterate_batch, prompt_position, prompt_txt: str):
+    def run(self, p, checkbox_iterate, checkbox_iterate_batch, prompt_position, prompt_txt: str, checkbox_batch_lines=False):
         lines = [x for x in (x.strip() for x in prompt_txt.splitlines()) if x]
 
         p.do_not_save_grid = True
@@ -145,22 +193,23 @@ class Script(scripts.Script):
             else:
                 args = {"prompt": line}
 
-            job_count += args.get("n_iter", p.n_iter)
-
             jobs.append(args)
 
+        if checkbox_batch_lines:
+            groups = group_lines(jobs, p.batch_size)
+        else:
+            groups = [[args] for args in jobs]
+
+        for group in groups:
+            job_count += group[0].get("n_iter", p.n_iter)
+
         print(f"Will process {len(lines)} lines in {job_count} jobs.")
         if (checkbox_iterate or checkbox_iterate_batch) and p.seed == -1:
             p.seed = int(random.randrange(4294967294))
 
         state.job_count = job_count
 
-        images = []
-        all_prompts = []
-        infotexts = []
-        for args in jobs:
-            state.job = f"{state.job_no + 1} out of {state.job_count}"
-
+        def make_job(args):
             copy_p = copy.copy(p)
             for k, v in args.items():
                 if k == "sd_model":
@@ -180,11 +229,27 @@ class Script(scripts.Script):
                 else:
                     copy_p.negative_prompt = p.negative_prompt + " " + args.get("negative_prompt")
 
-            proc = process_images(copy_p)
+            return copy_p
+
+        images = []
+        all_prompts = []
+        infotexts = []
+        for group in groups:
+            state.job = f"{state.job_no + 1} out of {state.job_count}"
+
+            batched = checkbox_batch_lines and batch_key(group[0]) is not None
+
+            group_p = []
+            for args in group:
+                group_p.append(make_job(args))
+
+                if checkbox_iterate:
+                    p.seed = p.seed + (p.n_iter if batched else p.batch_size * p.n_iter)
+
+            # saving of pictures happens in process_images, so results of each batch are written while the next one is generated
+            proc = process_images(combine_jobs(group_p) if batched else group_p[0])
             images += proc.images
 
-            if checkbox_iterate:
-                p.seed = p.seed + (p.batch_size * p.n_iter)
             all_prompts += proc.all_prompts
             infotexts += proc.infotexts
 
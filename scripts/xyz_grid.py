@@ -1,17 +1,19 @@
 from collections import namedtuple
 from copy import copy
 from itertools import permutations, chain
+import hashlib
+import json
 import random
 import csv
 import os.path
 from io import StringIO
-from PIL import Image
+from PIL import Image, PngImagePlugin
 import numpy as np
 
 import modules.scripts as scripts
 import gradio as gr
 
-from modules import images, sd_samplers, processing, sd_models, sd_vae, sd_schedulers, errors
+from modules import images, sd_samplers, processing, sd_models, sd_vae, sd_schedulers, errors, cache, infotext_utils, extra_networks
 from modules.processing import process_images, Processed, StableDiffusionProcessingTxt2Img
 from modules.shared import opts, state
 import modules.shared as shared
@@ -284,7 +286,164 @@ axis_options = [
 ]
 
 
-def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, include_lone_images, include_sub_grids, first_axes_processed, second_axes_processed, margin_size):
+def plan_cells(xs, ys, zs, first_axes_processed, second_axes_processed):
+    """
+    Returns (ix, iy, iz) for every cell of the grid, in the order they should be processed.
+
+    The first axis changes least often and the remaining one most often, like in nested loops, except that the inner axes
+    go back and forth instead of starting over: when an outer axis moves to its next value, the inner ones keep the values
+    they ended with. For a checkpoint by VAE grid this means that the VAE is switched one time fewer for every checkpoint.
+    """
+
+    third_axes_processed = next(axis for axis in 'xyz' if axis not in (first_axes_processed, second_axes_processed))
+    sizes = {'x': len(xs), 'y': len(ys), 'z': len(zs)}
+    n1, n2, n3 = (sizes[axis] for axis in (first_axes_processed, second_axes_processed, third_axes_processed))
+
+    res = []
+    for i1 in range(n1):
+        for j2 in range(n2):
+            i2 = j2 if i1 % 2 == 0 else n2 - 1 - j2
+            for j3 in range(n3):
+                i3 = j3 if (i1 * n2 + j2) % 2 == 0 else n3 - 1 - j3
+
+                indices = {first_axes_processed: i1, second_axes_processed: i2, third_axes_processed: i3}
+                res.append((indices['x'], indices['y'], indices['z']))
+
+    return res
+
+
+def group_cells(cells, batch_key, batch_size):
+    """
+    Splits cells into batches of up to batch_size cells for which batch_key returns the same value; cells with batch_key of None
+    are processed alone. Batches are ordered by their first cell, so the order made by plan_cells is kept.
+    """
+
+    batches = []
+    open_batches = {}
+    for c in cells:
+        key = batch_key(c)
+        if key is None:
+            batches.append([c])
+            continue
+
+        batch = open_batches.get(key)
+        if batch is None or len(batch) >= batch_size:
+            batch = open_batches[key] = []
+            batches.append(batch)
+
+        batch.append(c)
+
+    return batches
+
+
+def describe_value(value):
+    """Returns a JSON-compatible description of a parameter value; images and arrays are described by a hash of their contents."""
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [describe_value(x) for x in value]
+    if isinstance(value, dict):
+        return {str(k): describe_value(v) for k, v in value.items()}
+    if isinstance(value, Image.Image):
+        return [value.mode, value.size, hashlib.sha256(value.tobytes()).hexdigest()]
+    if isinstance(value, np.ndarray):
+        return [str(value.dtype), value.shape, hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()]
+
+    raise TypeError(f"can't describe {type(value).__name__}")
+
+
+cell_ignored_fields = {"scripts", "script_args", "outpath_samples", "outpath_grids", "do_not_save_samples", "do_not_save_grid", "user", "comments"}
+
+
+def cell_parameters_hash(p, script_args, exclude=()):
+    """
+    Returns a hash of everything that goes into the picture made from p: its fields, settings that are recorded in infotext,
+    and arguments of scripts. Returns None for random seeds, and for arguments of scripts that can't be described.
+    Fields of p that are not parameters, like the loaded model, are left out.
+    """
+
+    if p.seed == -1 or (p.subseed == -1 and p.subseed_strength != 0):
+        return None
+
+    fields = {}
+    for name, value in vars(p).items():
+        if name in cell_ignored_fields or name in exclude or name.startswith('_'):
+            continue
+
+        try:
+            fields[name] = describe_value(value)
+        except TypeError:
+            pass
+
+    settings = {k: p.override_settings.get(k, opts.data.get(k, info.default)) for k, info in opts.data_labels.items() if info.infotext}
+
+    try:
+        parameters = json.dumps([type(p).__name__, fields, describe_value(settings), describe_value(script_args)], sort_keys=True)
+    except TypeError:
+        return None
+
+    return hashlib.sha256(parameters.encode("utf8")).hexdigest()
+
+
+def cell_batch_key(p, script_args):
+    """
+    Returns a value that is equal for cells that can be made in one batch, or None if the cell has to be made alone.
+
+    Cells in a batch may differ in prompts and seeds, but not in extra networks used by prompts: process_images uses extra
+    networks of the first prompt for the whole batch.
+    """
+
+    key = cell_parameters_hash(p, script_args, exclude=("prompt", "negative_prompt", "seed"))
+    if key is None:
+        return None
+
+    return key, extra_networks.extra_networks_key(p.prompt), extra_networks.extra_networks_key(p.negative_prompt)
+
+
+class CellCache:
+    """
+    Pictures of finished cells, saved as PNG files named by cell_parameters_hash, so that a grid that was interrupted or that
+    has more values added to an axis can be made again without generating cells that it already has.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.png")
+
+    def load(self, key):
+        """Returns the picture and its infotext, or None if the cell is not in cache."""
+
+        filename = self.filename(key)
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            with Image.open(filename) as image:
+                image.load()
+        except Exception:
+            errors.report(f"Could not load cached X/Y/Z plot cell {filename}", exc_info=True)
+            return None
+
+        return image, image.info.get("parameters", "")
+
+    def save(self, key, image, infotext):
+        filename = self.filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text("parameters", infotext or "")
+
+        image.save(f"{filename}.tmp", format="PNG", pnginfo=pnginfo)
+        os.replace(f"{filename}.tmp", filename)
+
+
+cell_cache = CellCache(os.path.join(cache.cache_dir, "xyz-grid-cells"))
+
+
+def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, include_lone_images, include_sub_grids, first_axes_processed, second_axes_processed, margin_size, batch_key=None, batch_size=1, cell_batch=None):
     hor_texts = [[images.GridAnnotation(x)] for x in x_labels]
     ver_texts = [[images.GridAnnotation(y)] for y in y_labels]
     title_texts = [[images.GridAnnotation(z)] for z in z_labels]
@@ -293,17 +452,28 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
 
     processed_result = None
 
-    state.job_count = list_size * p.n_iter
+    cells = plan_cells(xs, ys, zs, first_axes_processed, second_axes_processed)
+    if cell_batch is not None and batch_key is not None and batch_size > 1:
+        batches = group_cells(cells, lambda c: batch_key(xs[c[0]], ys[c[1]], zs[c[2]], *c), batch_size)
+    else:
+        batches = [[c] for c in cells]
 
-    def process_cell(x, y, z, ix, iy, iz):
-        nonlocal processed_result
+    state.job_count = len(batches) * p.n_iter
+
+    def index(ix, iy, iz):
+        return ix + iy * len(xs) + iz * len(xs) * len(ys)
 
-        def index(ix, iy, iz):
-            return ix + iy * len(xs) + iz * len(xs) * len(ys)
+    def process_batch(batch):
+        state.job = f"{index(*batch[0]) + 1} out of {list_size}"
 
-        state.job = f"{index(ix, iy, iz) + 1} out of {list_size}"
+        args = [(xs[ix], ys[iy], zs[iz], ix, iy, iz) for ix, iy, iz in batch]
+        results = [cell(*args[0])] if len(batch) == 1 else cell_batch(args)
 
-        processed: Processed = cell(x, y, z, ix, iy, iz)
+        for (ix, iy, iz), processed in zip(batch, results):
+            process_cell(processed, ix, iy, iz)
+
+    def process_cell(processed: Processed, ix, iy, iz):
+        nonlocal processed_result
 
         if processed_result is None:
             # Use our first processed result object as a template container to hold our full results
@@ -330,36 +500,8 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
                 cell_size = processed_result.images[0].size
             processed_result.images[idx] = Image.new(cell_mode, cell_size)
 
-    if first_axes_processed == 'x':
-        for ix, x in enumerate(xs):
-            if second_axes_processed == 'y':
-                for iy, y in enumerate(ys):
-                    for iz, z in enumerate(zs):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iz, z in enumerate(zs):
-                    for iy, y in enumerate(ys):
-                        process_cell(x, y, z, ix, iy, iz)
-    elif first_axes_processed == 'y':
-        for iy, y in enumerate(ys):
-            if second_axes_processed == 'x':
-                for ix, x in enumerate(xs):
-                    for iz, z in enumerate(zs):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iz, z in enumerate(zs):
-                    for ix, x in enumerate(xs):
-                        process_cell(x, y, z, ix, iy, iz)
-    elif first_axes_processed == 'z':
-        for iz, z in enumerate(zs):
-            if second_axes_processed == 'x':
-                for ix, x in enumerate(xs):
-                    for iy, y in enumerate(ys):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iy, y in enumerate(ys):
-                    for ix, x in enumerate(xs):
-                        process_cell(x, y, z, ix, iy, iz)
+    for batch in batches:
+        process_batch(batch)
 
     if not processed_result:
         # Should never happen, I've only seen it on one of four open tabs and it needed to refresh.
@@ -453,6 +595,8 @@ class Script(scripts.Script):
                 csv_mode = gr.Checkbox(label='Use text inputs instead of dropdowns', value=False, elem_id=self.elem_id("csv_mode"))
             with gr.Column():
                 margin_size = gr.Slider(label="Grid margins (px)", minimum=0, maximum=500, value=0, step=2, elem_id=self.elem_id("margin_size"))
+                cell_batch_size = gr.Slider(label="Cell batch size", minimum=1, maximum=8, value=1, step=1, elem_id=self.elem_id("cell_batch_size"), tooltip="Generate up to this many cells that only differ in seed or prompt as one batch.")
+                reuse_cells = gr.Checkbox(label='Reuse finished cells', value=False, elem_id=self.elem_id("reuse_cells"), tooltip="Keep pictures of cells in cache, and use them instead of generating cells with the same parameters again.")
 
         with gr.Row(variant="compact", elem_id="swap_axes"):
             swap_xy_axes_button = gr.Button(value="Swap X/Y axes", elem_id="xy_grid_swap_axes_button")
@@ -533,9 +677,9 @@ class Script(scripts.Script):
             (z_values_dropdown, lambda params: get_dropdown_update_from_params("Z", params)),
         )
 
-        return [x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, draw_legend, include_lone_images, include_sub_grids, no_fixed_seeds, vary_seeds_x, vary_seeds_y, vary_seeds_z, margin_size, csv_mode]
+        return [x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, draw_legend, include_lone_images, include_sub_grids, no_fixed_seeds, vary_seeds_x, vary_seeds_y, vary_seeds_z, margin_size, csv_mode, cell_batch_size, reuse_cells]
 
-    def run(self, p, x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, draw_legend, include_lone_images, include_sub_grids, no_fixed_seeds, vary_seeds_x, vary_seeds_y, vary_seeds_z, margin_size, csv_mode):
+    def run(self, p, x_type, x_values, x_values_dropdown, y_type, y_values, y_values_dropdown, z_type, z_values, z_values_dropdown, draw_legend, include_lone_images, include_sub_grids, no_fixed_seeds, vary_seeds_x, vary_seeds_y, vary_seeds_z, margin_size, csv_mode, cell_batch_size=1, reuse_cells=False):
         x_type, y_type, z_type = x_type or 0, y_type or 0, z_type or 0  # if axle type is None set to 0
 
         if not no_fixed_seeds:
@@ -704,12 +848,45 @@ class Script(scripts.Script):
 
         grid_infotext = [None] * (1 + len(zs))
 
-        def cell(x, y, z, ix, iy, iz):
-            if shared.state.interrupted or state.stopping_generation:
-                return Processed(p, [], p.seed, "")
+        def grid_infotext_params(with_z):
+            params = {'Script': self.title()}
+
+            for label, opt, vals, values in [("X", x_opt, xs, x_values), ("Y", y_opt, ys, y_values), ("Z", z_opt, zs, z_values)][:3 if with_z else 2]:
+                if opt.label != 'Nothing':
+                    params[f"{label} Type"] = opt.label
+                    params[f"{label} Values"] = values
+                    if opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
+                        params[f"Fixed {label} Values"] = ", ".join([str(v) for v in vals])
+
+            return params
+
+        def set_grid_infotexts(pc, ix, iy, iz, index=0, infotext=None):
+            """Sets infotexts of the subgrid and of the main grid from the first cell of each; infotext is given for cells loaded from cache"""
+
+            if ix != 0 or iy != 0:
+                return
+
+            for grid_index, with_z in [(1 + iz, False), (0, True)]:
+                if grid_infotext[grid_index] is not None or (with_z and iz != 0):
+                    continue
+
+                params = grid_infotext_params(with_z)
+                if infotext is None:
+                    pc.extra_generation_params = {**pc.extra_generation_params, **params}
+                    grid_infotext[grid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds, index=index)
+                else:
+                    grid_infotext[grid_index] = infotext + "".join(f", {k}: {infotext_utils.quote(v)}" for k, v in params.items())
+
+        prepared_cells = {}
+
+        def prepare_cell(x, y, z, ix, iy, iz):
+            pc = prepared_cells.get((ix, iy, iz))
+            if pc is not None:
+                return pc
 
             pc = copy(p)
             pc.styles = pc.styles[:]
+            pc.override_settings = dict(pc.override_settings)
             x_opt.apply(pc, x, xs)
             y_opt.apply(pc, y, ys)
             z_opt.apply(pc, z, zs)
@@ -724,6 +901,45 @@ class Script(scripts.Script):
             if vary_seeds_z:
                 pc.seed += iz * xdim * ydim
 
+            prepared_cells[(ix, iy, iz)] = pc
+            return pc
+
+        script_args = list(p.script_args or [])
+        del script_args[self.args_from:self.args_to]
+
+        def batch_key(x, y, z, ix, iy, iz):
+            return cell_batch_key(prepare_cell(x, y, z, ix, iy, iz), script_args)
+
+        def cell_batch(batch):
+            if shared.state.interrupted or state.stopping_generation:
+                return [Processed(p, [], p.seed, "") for _ in batch]
+
+            pcs = [prepare_cell(*args) for args in batch]
+            keys = [cell_parameters_hash(pc, script_args) if reuse_cells else None for pc in pcs]
+            results = [None] * len(batch)
+
+            for i, (pc, key) in enumerate(zip(pcs, keys)):
+                cached = cell_cache.load(key) if key is not None else None
+                if cached is not None:
+                    image, infotext = cached
+                    results[i] = Processed(pc, [image], pc.seed, infotext, subseed=pc.subseed, infotexts=[infotext])
+                    set_grid_infotexts(pc, *batch[i][3:], infotext=infotext)
+
+            todo = [i for i in range(len(batch)) if results[i] is None]
+            if not todo:
+                return results
+
+            pc = pcs[todo[0]]
+            if len(todo) > 1:
+                # cells of a batch only differ in prompts and seeds, which are given to process_images as lists
+                pc = copy(pc)
+                pc.prompt = [pcs[i].prompt for i in todo]
+                pc.negative_prompt = [pcs[i].negative_prompt for i in todo]
+                pc.seed = [pcs[i].seed for i in todo]
+                pc.subseed = [pcs[i].subseed for i in todo]
+                pc.batch_size = len(todo)
+                pc.do_not_save_grid = True
+
             try:
                 res = process_images(pc)
             except Exception as e:
@@ -731,39 +947,36 @@ class Script(scripts.Script):
 
                 res = Processed(p, [], p.seed, "")
 
-            # Sets subgrid infotexts
-            subgrid_index = 1 + iz
-            if grid_infotext[subgrid_index] is None and ix == 0 and iy == 0:
-                pc.extra_generation_params = copy(pc.extra_generation_params)
-                pc.extra_generation_params['Script'] = self.title()
-
-                if x_opt.label != 'Nothing':
-                    pc.extra_generation_params["X Type"] = x_opt.label
-                    pc.extra_generation_params["X Values"] = x_values
-                    if x_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
-                        pc.extra_generation_params["Fixed X Values"] = ", ".join([str(x) for x in xs])
+            images_list = res.images[res.index_of_first_image:]
+            for n, i in enumerate(todo):
+                if len(todo) == 1:
+                    results[i] = res
+                elif images_list:
+                    # output of process_images can have more than one image per prompt, like masks for inpainting
+                    results[i] = copy(res)
+                    results[i].images = [images_list[n * (len(images_list) // len(todo))]]
+                    results[i].prompt = pcs[i].prompt
+                    results[i].negative_prompt = pcs[i].negative_prompt
+                    results[i].seed = res.all_seeds[n]
+                    results[i].info = res.infotexts[res.index_of_first_image + n]
+                    results[i].infotexts = [results[i].info]
+                else:
+                    results[i] = Processed(p, [], p.seed, "")
 
-                if y_opt.label != 'Nothing':
-                    pc.extra_generation_params["Y Type"] = y_opt.label
-                    pc.extra_generation_params["Y Values"] = y_values
-                    if y_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
-                        pc.extra_generation_params["Fixed Y Values"] = ", ".join([str(y) for y in ys])
+                set_grid_infotexts(pc, *batch[i][3:], index=n)
 
-                grid_infotext[subgrid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
+                if keys[i] is not None and results[i].images and not (state.interrupted or state.skipped):
+                    cell_cache.save(keys[i], results[i].images[0], results[i].infotexts[0])
 
-            # Sets main grid infotext
-            if grid_infotext[0] is None and ix == 0 and iy == 0 and iz == 0:
-                pc.extra_generation_params = copy(pc.extra_generation_params)
+            for args in batch:
+                prepared_cells.pop(tuple(args[3:]), None)
 
-                if z_opt.label != 'Nothing':
-                    pc.extra_generation_params["Z Type"] = z_opt.label
-                    pc.extra_generation_params["Z Values"] = z_values
-                    if z_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
-                        pc.extra_generation_params["Fixed Z Values"] = ", ".join([str(z) for z in zs])
+            return results
 
-                grid_infotext[0] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
+        def cell(x, y, z, ix, iy, iz):
+            return cell_batch([(x, y, z, ix, iy, iz)])[0]
 
-            return res
+        batches_allowed = cell_batch_size > 1 and p.n_iter == 1 and p.batch_size == 1
 
         with SharedSettingsStackHelper():
             processed = draw_xyz_grid(
@@ -780,7 +993,10 @@ class Script(scripts.Script):
                 include_sub_grids=include_sub_grids,
                 first_axes_processed=first_axes_processed,
                 second_axes_processed=second_axes_processed,
-                margin_size=margin_size
+                margin_size=margin_size,
+                batch_key=batch_key if batches_allowed else None,
+                batch_size=int(cell_batch_size),
+                cell_batch=cell_batch,
             )
 
         if not processed.images:
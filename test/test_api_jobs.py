@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.api.jobs import JobStore
+
+
+def test_job_lifecycle():
+    store = JobStore(ThreadPoolExecutor(max_workers=1))
+    gate = threading.Event()
+
+    def fail():
+        raise ValueError("bad prompt")
+
+    running = store.submit("txt2img", "task(1)", lambda: gate.wait(5) and "result")
+    failing = store.submit("txt2img", "task(2)", fail)
+    cancelled = store.submit("img2img", "task(3)", lambda: "never")
+
+    assert store.get(running.id) is running
+    assert failing.status == "pending"
+
+    assert store.remove(cancelled.id) is cancelled
+    assert cancelled.status == "cancelled"
+    assert store.get(cancelled.id) is None
+
+    gate.set()
+    assert running.future.result() == "result"
+    failing.future.exception()
+
+    assert running.status == "done" and running.error is None
+    assert running.started_at <= running.finished_at
+    assert failing.status == "failed" and failing.error == "bad prompt"
+
+
+def test_finished_jobs_leave_the_queue():
+    queue = {}
+    store = JobStore(ThreadPoolExecutor(max_workers=1), on_finish=lambda job: queue.pop(job.task_id))
+    gate = threading.Event()
+
+    def fail():
+        raise ValueError("unknown sampler")
+
+    queue.update({"task(1)": 1, "task(2)": 2, "task(3)": 3})
+    running = store.submit("txt2img", "task(1)", gate.wait, 5)
+    failing = store.submit("txt2img", "task(2)", fail)
+    cancelled = store.submit("img2img", "task(3)", lambda: "never")
+
+    store.remove(cancelled.id)
+    assert list(queue) == ["task(1)", "task(2)"]
+
+    gate.set()
+    running.future.result()
+    failing.future.exception()
+
+    assert queue == {}
+
+
+def test_finished_jobs_are_pruned():
+    store = JobStore(ThreadPoolExecutor(max_workers=1), max_finished=2)
+
+    finished = [store.submit("txt2img", f"task({i})", lambda: None) for i in range(3)]
+    for job in finished:
+        job.future.result()
+
+    assert store.get(finished[0].id) is None
+    assert store.get(finished[1].id) is finished[1]
+
+    store.keep_seconds = -1
+    assert store.get(finished[2].id) is None
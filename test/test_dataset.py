@@ -0,0 +1,82 @@
+import contextlib
+import types
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from ldm.modules.distributions.distributions import DiagonalGaussianDistribution
+from modules import cache, devices, sd_vae, shared
+from modules.textual_inversion import dataset
+
+
+class FakeModel:
+    def __init__(self):
+        self.sd_checkpoint_info = types.SimpleNamespace(sha256="0" * 64, filename="model.safetensors")
+        self.batch_sizes = []
+
+    def encode_first_stage(self, x):
+        self.batch_sizes.append(x.shape[0])
+        mean = torch.nn.functional.avg_pool2d(x, 8)
+        mean = torch.cat([mean, mean[:, :1]], dim=1)
+        return DiagonalGaussianDistribution(torch.cat([mean, torch.full_like(mean, -2.0)], dim=1))
+
+    def get_first_stage_encoding(self, latent_dist):
+        return latent_dist.sample() * 0.18215
+
+
+@pytest.fixture
+def data_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(training_latent_cache=True, dataset_filename_word_regex="", dataset_filename_join_string=" "))
+    monkeypatch.setattr(shared, "state", types.SimpleNamespace(interrupted=False))
+    monkeypatch.setattr(cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(sd_vae, "loaded_vae_file", None)
+    monkeypatch.setattr(devices, "autocast", lambda disable=False: contextlib.nullcontext())
+
+    root = tmp_path / "images"
+    root.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(5):
+        Image.fromarray(rng.integers(0, 256, (40 + i * 8, 48, 3), dtype=np.uint8)).save(root / f"{i}-image {i}.png")
+    Image.fromarray(rng.integers(0, 256, (32, 32, 4), dtype=np.uint8)).save(root / "transparent.png")
+    (root / "0-image 0.txt").write_text("a caption", encoding="utf8")
+
+    (tmp_path / "template.txt").write_text("[name] [filewords]", encoding="utf8")
+
+    return root
+
+
+def make_dataset(data_root, model, **kwargs):
+    return dataset.PersonalizedBase(data_root=str(data_root), width=32, height=32, repeats=1, model=model, cond_model=None, device=devices.cpu, template_file=str(data_root.parent / "template.txt"), batch_size=4, latent_sampling_method="deterministic", **kwargs)
+
+
+def test_dataset_latents_are_encoded_in_batches_and_cached(data_root):
+    model = FakeModel()
+    first = make_dataset(data_root, model, use_weight=True)
+
+    assert model.batch_sizes == [4, 2]
+    assert sorted(entry.cond_text for entry in first.dataset) == ["* a caption", "* image 1", "* image 2", "* image 3", "* image 4", "* transparent"]
+
+    model = FakeModel()
+    second = make_dataset(data_root, model, use_weight=True)
+
+    assert model.batch_sizes == []
+    assert len(second.dataset) == 6
+    for a, b in zip(sorted(first.dataset, key=lambda x: x.filename), sorted(second.dataset, key=lambda x: x.filename)):
+        assert a.latent_sample.shape == (4, 4, 4)
+        assert torch.equal(a.latent_sample, b.latent_sample)
+        assert torch.equal(a.weight, b.weight)
+
+    transparent = next(x for x in second.dataset if x.filename.endswith("transparent.png"))
+    assert transparent.weight.min() == 0 and torch.isclose(transparent.weight.mean(), torch.tensor(1.0))
+
+
+def test_dataset_cache_is_keyed_by_size(data_root):
+    make_dataset(data_root, FakeModel())
+
+    model = FakeModel()
+    varsize = dataset.PersonalizedBase(data_root=str(data_root), width=32, height=32, repeats=1, model=model, device=devices.cpu, template_file=str(data_root.parent / "template.txt"), batch_size=4, varsize=True)
+
+    assert sorted(model.batch_sizes) == [1, 1, 1, 1, 1, 1]
+    assert len(varsize.groups) == 6
@@ -0,0 +1,29 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from modules import hashes
+
+
+@pytest.mark.parametrize("size", [0, 1, 999, 1000, 1001, 4321])
+def test_sha256_matches_hashlib(tmp_path, monkeypatch, size):
+    monkeypatch.setattr(hashes, "mmap_chunk_size", 1000)
+    data = os.urandom(size)
+    filename = tmp_path / "model.bin"
+    filename.write_bytes(data)
+
+    assert hashes.calculate_sha256(filename) == hashlib.sha256(data).hexdigest()
+
+
+def test_addnet_hash_matches_in_memory_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(hashes, "mmap_chunk_size", 1000)
+    header = b'{"__metadata__":{}}'
+    data = len(header).to_bytes(8, "little") + header + os.urandom(2500)
+    filename = tmp_path / "lora.safetensors"
+    filename.write_bytes(data)
+
+    expected = hashlib.sha256(data[8 + len(header):]).hexdigest()
+    assert hashes.calculate_addnet_hash(filename) == expected
+    assert hashes.addnet_hash_safetensors(io.BytesIO(data)) == expected
@@ -0,0 +1,99 @@
+import threading
+import types
+
+import pytest
+
+from modules import image_saver, images, options, shared
+
+
+class FakeImage:
+    pass
+
+
+@pytest.fixture
+def opts(monkeypatch):
+    opts = options.Options({
+        "background_saving_workers": options.OptionInfo(2),
+        "background_saving_queue_size": options.OptionInfo(2),
+        "samples_filename_pattern": options.OptionInfo(""),
+    }, restricted_opts=set())
+    monkeypatch.setattr(shared, "opts", opts)
+    monkeypatch.setattr(shared, "state", types.SimpleNamespace(job_timestamp="20260101000000"))
+    return opts
+
+
+def test_saves_in_background_and_reports_errors(opts, monkeypatch):
+    saved = []
+
+    def save_image(image, path, basename, p=None):
+        if basename == "broken":
+            raise OSError("disk full")
+
+        saved.append((image, path, basename, p.batch_index))
+
+    monkeypatch.setattr(images, "save_image", save_image)
+
+    saver = image_saver.BackgroundSaver()
+    job = image_saver.SaveJob()
+    p = types.SimpleNamespace(batch_index=0)
+
+    first = FakeImage()
+    saver.submit(job, first, "outputs", "", p=p)
+    p.batch_index = 1
+    saver.submit(job, FakeImage(), "outputs", "broken", p=p)
+
+    assert job.wait() == ["Error saving image: disk full"]
+    assert saved == [(first, "outputs", "", 0)]
+
+
+def test_saves_with_options_and_job_as_they_were_when_submitted(opts, monkeypatch):
+    release = threading.Event()
+    saved = []
+
+    def save_image(image, path, basename, p=None):
+        release.wait()
+        saved.append((shared.opts.samples_filename_pattern, p.job_timestamp))
+
+    monkeypatch.setattr(images, "save_image", save_image)
+
+    saver = image_saver.BackgroundSaver()
+    job = image_saver.SaveJob()
+
+    opts.data["samples_filename_pattern"] = "[seed]-override"
+    saver.submit(job, FakeImage(), "outputs", "", p=types.SimpleNamespace())
+    opts.data["samples_filename_pattern"] = ""
+    shared.state.job_timestamp = "20260101000001"
+    release.set()
+
+    assert job.wait() == []
+    assert saved == [("[seed]-override", "20260101000000")]
+    assert shared.opts.samples_filename_pattern == ""
+
+
+def test_queue_size_limits_pending_images(opts, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(images, "save_image", lambda *args, **kwargs: release.wait())
+
+    saver = image_saver.BackgroundSaver()
+    job = image_saver.SaveJob()
+    saver.submit(job, FakeImage(), "outputs", "")
+    saver.submit(job, FakeImage(), "outputs", "")
+
+    third = threading.Thread(target=lambda: saver.submit(job, FakeImage(), "outputs", ""))
+    third.start()
+    third.join(0.2)
+    assert third.is_alive()
+    assert len(job.futures) == 2
+
+    release.set()
+    third.join()
+    saver.flush()
+    assert len(job.futures) == 3
+    assert job.wait() == []
+
+
+def test_saves_immediately_without_workers(opts, monkeypatch):
+    opts.data["background_saving_workers"] = 0
+    monkeypatch.setattr(images, "save_image", lambda image, path, basename, p=None: (path, None))
+
+    assert image_saver.BackgroundSaver().submit(None, FakeImage(), "outputs", "") == ("outputs", None)
@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from modules import images
+
+
+def random_image(width, height, seed=0):
+    return Image.fromarray(np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def replace_tiles(grid, func):
+    return grid._replace(tiles=[[y, h, [[x, w, func(tile)] for x, w, tile in row]] for y, h, row in grid.tiles])
+
+
+def noisy_tiles(grid, seed=1):
+    """Tiles that differ where they overlap, like tiles processed by img2img do."""
+
+    rng = np.random.default_rng(seed)
+    return replace_tiles(grid, lambda tile: Image.fromarray(rng.integers(0, 256, (tile.height, tile.width, 3), dtype=np.uint8)))
+
+
+@pytest.mark.parametrize("size, tile, overlap", [((700, 500), 256, 64), ((512, 512), 512, 64), ((300, 200), 256, 32)])
+def test_combine_grid_matches_pillow(size, tile, overlap):
+    grid = noisy_tiles(images.split_grid(random_image(*size), tile, tile, overlap))
+
+    expected = np.array(images.combine_grid(grid))
+
+    assert np.array_equal(images.combine_grid(replace_tiles(grid, np.asarray)), expected)
+
+    chw = images.combine_grid(replace_tiles(grid, lambda t: torch.from_numpy(np.array(t)).permute(2, 0, 1)))
+    assert np.array_equal(chw.permute(1, 2, 0).numpy(), expected)
+
+
+def test_split_grid_of_arrays_makes_views():
+    img = random_image(700, 500)
+    array = np.asarray(img)
+    tensor = torch.from_numpy(array.copy()).permute(2, 0, 1)
+
+    pil_grid = images.split_grid(img, 256, 256, 64)
+    array_grid = images.split_grid(array, 256, 256, 64)
+    tensor_grid = images.split_grid(tensor, 256, 256, 64)
+
+    for (_, _, pil_row), (_, _, array_row), (_, _, tensor_row) in zip(pil_grid.tiles, array_grid.tiles, tensor_grid.tiles):
+        for (_, _, pil_tile), (_, _, array_tile), (_, _, tensor_tile) in zip(pil_row, array_row, tensor_row):
+            assert np.shares_memory(array_tile, array)
+            assert tensor_tile.untyped_storage().data_ptr() == tensor.untyped_storage().data_ptr()
+            assert np.array_equal(array_tile, np.array(pil_tile))
+            assert np.array_equal(tensor_tile.permute(1, 2, 0).numpy(), np.array(pil_tile))
+
+    assert np.array_equal(images.combine_grid(array_grid), array)
+
+
+def test_combine_grid_blends_float_tensors():
+    tensor = torch.rand(1, 3, 300, 400)
+    grid = images.split_grid(tensor, 128, 128, 32)
+
+    assert torch.allclose(images.combine_grid(grid), tensor)
+
+
+def benchmark(sizes=((2048, 2048), (4096, 4096), (8192, 8192)), tile=512, overlap=64):
+    """Prints time to split and combine images with Pillow, NumPy arrays and torch tensors; run with `python -m test.test_images_grid`."""
+
+    print(f"{'size':>10} {'pillow':>10} {'numpy':>10} {'torch':>10} {'float32':>10}")
+    for width, height in sizes:
+        img = random_image(width, height)
+        inputs = [img, np.asarray(img), torch.from_numpy(np.array(img)).permute(2, 0, 1)]
+        inputs.append(inputs[-1].float() / 255)
+
+        times = []
+        for x in inputs:
+            t0 = time.perf_counter()
+            images.combine_grid(images.split_grid(x, tile, tile, overlap))
+            times.append(time.perf_counter() - t0)
+
+        print(f"{f'{width}x{height}':>10} " + " ".join(f"{t:>9.3f}s" for t in times))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from modules import images
+
+
+def touch(path, *filenames):
+    for filename in filenames:
+        with open(os.path.join(path, filename), "w"):
+            pass
+
+
+def test_sequence_index_continues_existing_numbering(tmp_path):
+    touch(tmp_path, "00003-1234.png", "00007-5678.png", "grid-0010.png", "notes.txt")
+    index = images.SequenceIndex()
+
+    assert index.reserve(tmp_path, "") == images.get_next_sequence_number(tmp_path, "") == 8
+    assert index.reserve(tmp_path, "") == 9
+    assert index.reserve(tmp_path, "grid") == 11
+
+
+def test_sequence_index_notices_other_writers(tmp_path):
+    index = images.SequenceIndex()
+
+    number = index.reserve(tmp_path, "")
+    mtime = images.directory_mtime(tmp_path)
+    touch(tmp_path, f"{number:05}-1.png")
+    index.release(tmp_path, "", number, mtime)
+    scans = index.scans
+
+    assert index.reserve(tmp_path, "") == 1
+    assert index.scans == scans
+
+    touch(tmp_path, "00050-2.png")
+    os.utime(tmp_path, ns=(0, 0))  # in case the filesystem's timestamps are too coarse to see the change
+
+    assert index.reserve(tmp_path, "") == 51
+    assert index.scans == scans + 1
+
+
+def test_sequence_index_notices_writes_next_to_its_own(tmp_path):
+    index = images.SequenceIndex()
+
+    number = index.reserve(tmp_path, "")
+    touch(tmp_path, "00050-2.png")
+    os.utime(tmp_path, ns=(0, 0))
+    mtime = images.directory_mtime(tmp_path)
+    touch(tmp_path, f"{number:05}-1.png")
+    index.release(tmp_path, "", number, mtime)
+
+    assert index.reserve(tmp_path, "") == 51
+
+
+def test_sequence_index_reservations_are_unique(tmp_path):
+    index = images.SequenceIndex()
+    numbers = []
+
+    def reserve():
+        for _ in range(100):
+            number = index.reserve(tmp_path, "")
+            numbers.append(number)
+            index.release(tmp_path, "", number)
+
+    threads = [threading.Thread(target=reserve) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(numbers) == list(range(400))
+
+
+
+class ListdirSequence:
+    """Finds sequence numbers by listing the directory for every image, like save_image did before SequenceIndex."""
+
+    def reserve(self, path, basename):
+        return images.get_next_sequence_number(path, basename)
+
+    def release(self, path, basename, number=None, mtime_before_write=None):
+        pass
+
+
+def benchmark(sizes=(1000, 10000, 100000), saves=200):
+    """Prints how many images per second save_image writes into directories with different numbers of files, with and without the sequence index; run with `python -m test.test_images_sequence`."""
+
+    from modules import options, shared, shared_options
+
+    shared.opts = images.opts = options.Options(shared_options.options_templates, shared_options.restricted_opts)
+    image = Image.new("RGB", (64, 64))
+    sequence_index = images.sequence_index
+
+    print(f"{'files':>8} {'listdir':>12} {'index':>12}")
+    try:
+        for size in sizes:
+            rates = []
+            for index in (ListdirSequence(), images.SequenceIndex()):
+                images.sequence_index = index
+                with tempfile.TemporaryDirectory() as path:
+                    touch(path, *[f"{i:05}-{i}.png" for i in range(size)])
+
+                    t0 = time.perf_counter()
+                    for _ in range(saves):
+                        images.save_image(image, path, "", short_filename=True, save_to_dirs=False)
+                    rates.append(saves / (time.perf_counter() - t0))
+
+            print(f"{size:>8} {rates[0]:>10.0f}/s {rates[1]:>10.0f}/s")
+    finally:
+        images.sequence_index = sequence_index
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,7 +1,11 @@
+import json
+import os
 
 import pytest
 import requests
 
+from test.conftest import test_files_path
+
 
 @pytest.fixture()
 def url_img2img(base_url):
@@ -66,3 +70,12 @@ def test_img2img_sd_upscale_performed(url_img2img, simple_img2img_request):
     simple_img2img_request["script_name"] = "sd upscale"
     simple_img2img_request["script_args"] = ["", 8, "Lanczos", 2.0]
     assert requests.post(url_img2img, json=simple_img2img_request).status_code == 200
+
+
+def test_img2img_multipart_request_performed(base_url, simple_img2img_request):
+    simple_img2img_request.pop("init_images")
+    with open(os.path.join(test_files_path, "img2img_basic.png"), "rb") as file:
+        files = {"init_images": ("img2img_basic.png", file, "image/png")}
+        response = requests.post(f"{base_url}/sdapi/v1/img2img-multipart", data={"request": json.dumps(simple_img2img_request)}, files=files)
+    assert response.status_code == 200
+    assert len(response.json()["images"]) == 1
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from modules.job_queue import JobScheduler, Priority, Resource
+
+
+def run_in_thread(func):
+    thread = threading.Thread(target=func)
+    thread.start()
+    return thread
+
+
+def wait_for_queue_depth(scheduler, depth):
+    for _ in range(500):
+        if scheduler.stats()["queue_depth"] == depth:
+            return
+        time.sleep(0.01)
+
+    raise TimeoutError(f"queue depth did not reach {depth}")
+
+
+def test_disjoint_resources_run_concurrently():
+    scheduler = JobScheduler()
+    generation = scheduler.lock(Resource.sd_model, Resource.progress)
+    deepbooru = scheduler.lock(Resource.interrogator)
+
+    with generation:
+        assert deepbooru.acquire(blocking=False)
+        deepbooru.release()
+
+
+def test_shared_resource_is_exclusive():
+    scheduler = JobScheduler()
+    everything = scheduler.lock()
+    extras = scheduler.lock(Resource.upscaler)
+
+    with everything:
+        assert not extras.acquire(blocking=False)
+
+    assert extras.acquire(blocking=False)
+    extras.release()
+
+
+def test_priority_order():
+    scheduler = JobScheduler()
+    blocker = scheduler.lock(Resource.sd_model)
+    order = []
+
+    def job(priority, name):
+        with scheduler.lock(Resource.sd_model, priority=priority):
+            order.append(name)
+
+    blocker.acquire()
+    threads = [run_in_thread(lambda: job(Priority.low, "low"))]
+    wait_for_queue_depth(scheduler, 1)
+    threads.append(run_in_thread(lambda: job(Priority.normal, "normal")))
+    wait_for_queue_depth(scheduler, 2)
+    threads.append(run_in_thread(lambda: job(Priority.high, "high")))
+    wait_for_queue_depth(scheduler, 3)
+
+    stats = scheduler.stats()
+    assert stats["queued"] == {"high": 1, "normal": 1, "low": 1}
+    assert stats["busy_resources"] == [Resource.sd_model]
+
+    blocker.release()
+    for thread in threads:
+        thread.join()
+
+    assert order == ["high", "normal", "low"]
+    assert scheduler.stats()["completed"] == 4
+
+
+def test_queued_job_is_not_starved():
+    scheduler = JobScheduler()
+    upscaler = scheduler.lock(Resource.upscaler)
+    both = scheduler.lock(Resource.sd_model, Resource.upscaler)
+    sd_model = scheduler.lock(Resource.sd_model)
+
+    def job():
+        with both:
+            pass
+
+    upscaler.acquire()
+    thread = run_in_thread(job)
+    wait_for_queue_depth(scheduler, 1)
+
+    # sd_model is free, but a job queued earlier is waiting for it
+    assert not sd_model.acquire(blocking=False)
+
+    upscaler.release()
+    thread.join()
+    assert sd_model.acquire(blocking=False)
+    sd_model.release()
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+import safetensors.torch
+import torch
+
+from modules import metadata_index, sd_models
+
+
+def save_model(filename, metadata):
+    safetensors.torch.save_file({"weight": torch.zeros(2)}, str(filename), metadata=metadata)
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    reads = []
+
+    def read_metadata(filename):
+        reads.append(os.path.basename(filename))
+        return sd_models.read_metadata_from_safetensors(filename)
+
+    monkeypatch.setattr(metadata_index, "read_metadata", read_metadata)
+    return reads
+
+
+def test_index_reads_each_file_once(tmp_path, reads):
+    tag_frequency = '{"tags": {"' + "x" * 1000 + '": 1}}'
+    save_model(tmp_path / "a.safetensors", {"ss_output_name": "alias", "ss_tag_frequency": tag_frequency})
+    save_model(tmp_path / "b.safetensors", {"ss_v2": "True"})
+    filenames = [str(tmp_path / "a.safetensors"), str(tmp_path / "b.safetensors")]
+
+    index = metadata_index.MetadataIndex(str(tmp_path / "cache" / "index.sqlite"))
+    index.update(filenames)
+    assert sorted(reads) == ["a.safetensors", "b.safetensors"]
+
+    assert index.summary(filenames[0]) == {"ss_output_name": "alias"}
+    assert index.metadata(filenames[0]) == {"ss_output_name": "alias", "ss_tag_frequency": {"tags": {"x" * 1000: 1}}}
+    assert index.metadata(filenames[1]) == {"ss_v2": "True"}
+
+    reopened = metadata_index.MetadataIndex(index.filename)
+    reopened.update(filenames)
+    assert reopened.metadata(filenames[0])["ss_tag_frequency"] == {"tags": {"x" * 1000: 1}}
+    assert len(reads) == 2
+
+
+def test_index_notices_changed_and_removed_files(tmp_path, reads):
+    filename = str(tmp_path / "a.safetensors")
+    save_model(filename, {"ss_output_name": "old"})
+    save_model(tmp_path / "b.safetensors", {})
+
+    index = metadata_index.MetadataIndex(str(tmp_path / "cache" / "index.sqlite"))
+    index.update([filename, str(tmp_path / "b.safetensors")])
+
+    save_model(filename, {"ss_output_name": "new name"})
+    assert index.summary(filename) == {"ss_output_name": "new name"}
+
+    os.remove(tmp_path / "b.safetensors")
+    os.utime(tmp_path, (0, 12345))
+    index.update([filename])
+
+    reopened = metadata_index.MetadataIndex(index.filename)
+    reopened.connect()
+    assert list(reopened.entries) == [os.path.abspath(filename)]
+    assert reopened.summary(filename) == {"ss_output_name": "new name"}
+    assert reads == ["a.safetensors", "b.safetensors", "a.safetensors"]
+
+
+def test_index_raises_for_broken_files(tmp_path, reads):
+    filename = tmp_path / "broken.safetensors"
+    filename.write_bytes(b"not a model")
+
+    index = metadata_index.MetadataIndex(str(tmp_path / "cache" / "index.sqlite"))
+    index.update([str(filename)])
+
+    with pytest.raises(AssertionError):
+        index.summary(str(filename))
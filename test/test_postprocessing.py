@@ -0,0 +1,27 @@
+import concurrent.futures
+import threading
+
+from modules import postprocessing
+
+
+def test_prefetch_keeps_order_and_limits_lookahead():
+    started = []
+    release = threading.Event()
+
+    def load(placeholder):
+        started.append(placeholder)
+        release.wait()
+        return placeholder * 2
+
+    data = [(i, f"{i}.png") for i in range(10)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        results = postprocessing.prefetch(executor, load, data, ahead=3)
+
+        future, name = next(results)
+        assert name == "0.png"
+        assert len(started) <= 4
+
+        release.set()
+        assert future.result() == 0
+        assert [(future.result(), name) for future, name in results] == [(i * 2, f"{i}.png") for i in range(1, 10)]
@@ -0,0 +1,65 @@
+import time
+
+from modules import prompt_parser
+
+
+def test_schedules_are_memoized_and_copied():
+    prompt_parser.get_prompt_schedule.cache_clear()
+    prompts = ["a [b:c:0.5] d", "[x|y] z", "a [b:c:0.5] d"]
+
+    first = prompt_parser.get_learned_conditioning_prompt_schedules(prompts, 4)
+    first[0][0][1] = "changed by caller"
+    second = prompt_parser.get_learned_conditioning_prompt_schedules(prompts, 4)
+
+    assert second == [[[2, "a b d"], [4, "a c d"]], [[1, "x z"], [2, "y z"], [3, "x z"], [4, "y z"]], [[2, "a b d"], [4, "a c d"]]]
+    assert prompt_parser.get_prompt_schedule.cache_info().hits == 2
+
+
+def test_schedule_cache_key_includes_scheduling_arguments():
+    g = prompt_parser.get_learned_conditioning_prompt_schedules
+
+    assert g(["a [b:1.5] c"], 10, 10) == [[[5, "a  c"], [10, "a b c"]]]
+    assert g(["a [b:1.5] c"], 10, 10, use_old_scheduling=True) == [[[1, "a  c"], [10, "a b c"]]]
+    assert g(["a [b:0.5] c"], 10) == [[[5, "a  c"], [10, "a b c"]]]
+    assert g(["a [b:0.5] c"], 20) == [[[10, "a  c"], [20, "a b c"]]]
+
+
+def test_attention_is_memoized_and_copied():
+    parsed = prompt_parser.parse_prompt_attention("a (b:1.5) BREAK c")
+    parsed += [["extra", 1.0]]
+
+    assert prompt_parser.parse_prompt_attention("a (b:1.5) BREAK c") == [["a ", 1.0], ["b", 1.5], ["", 1.0], ["BREAK", -1], ["c", 1.0]]
+
+
+def benchmark(count=50, repeats=10):
+    """Prints time to parse prompts that are used over and over, like in an X/Y/Z grid, with and without memoized results; run with `python -m test.test_prompt_parser`."""
+
+    prompts = [f"a photo of a [cat:dog:0.{i % 9 + 1}], ((masterpiece)), [red|blue] sky, (detailed:1.{i % 7}) BREAK seed {i}" for i in range(count)] * repeats
+
+    def schedules(memoized):
+        for prompt in prompts:
+            if not memoized:
+                prompt_parser.get_prompt_schedule.cache_clear()
+            prompt_parser.get_learned_conditioning_prompt_schedules([prompt], 20)
+
+    def attention(memoized):
+        for prompt in prompts:
+            if not memoized:
+                prompt_parser.parse_prompt_attention_cached.cache_clear()
+            prompt_parser.parse_prompt_attention(prompt)
+
+    print(f"{len(prompts)} prompts ({count} different) {'not memoized':>14} {'memoized':>10}")
+    for name, func in [("schedules", schedules), ("attention", attention)]:
+        times = []
+        for memoized in (False, True):
+            prompt_parser.get_prompt_schedule.cache_clear()
+            prompt_parser.parse_prompt_attention_cached.cache_clear()
+            t0 = time.perf_counter()
+            func(memoized)
+            times.append(time.perf_counter() - t0)
+
+        print(f"{name:>28} {times[0] * 1000:>12.1f}ms {times[1] * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    benchmark()
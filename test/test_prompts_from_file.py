@@ -0,0 +1,45 @@
+import types
+
+from scripts import prompts_from_file
+
+
+def test_group_lines_keeps_order_and_batch_size():
+    jobs = [
+        {"prompt": "a"},
+        {"prompt": "b", "seed": 5},
+        {"prompt": "c", "negative_prompt": "d"},
+        {"prompt": "e", "steps": 10},
+        {"prompt": "f", "steps": 10},
+        {"prompt": "g", "batch_size": 2},
+        {"prompt": "h"},
+    ]
+
+    groups = prompts_from_file.group_lines(jobs, 2)
+
+    assert [[args["prompt"] for args in group] for group in groups] == [["a", "b"], ["c"], ["e", "f"], ["g"], ["h"]]
+
+
+def test_group_lines_keeps_extra_networks_apart():
+    jobs = [
+        {"prompt": "a <lora:x:0.5>"},
+        {"prompt": "b <lora:x:0.5>"},
+        {"prompt": "c <lora:x:1>"},
+        {"prompt": "d"},
+        {"prompt": "e", "negative_prompt": "<lora:y:1>"},
+    ]
+
+    groups = prompts_from_file.group_lines(jobs, 4)
+
+    assert [[args["prompt"] for args in group] for group in groups] == [["a <lora:x:0.5>", "b <lora:x:0.5>"], ["c <lora:x:1>"], ["d"], ["e"]]
+
+
+def test_combine_jobs():
+    def job(prompt, seed):
+        return types.SimpleNamespace(prompt=prompt, negative_prompt="", seed=seed, subseed=100, subseed_strength=0, n_iter=2, batch_size=4)
+
+    p = prompts_from_file.combine_jobs([job("a", 1), job("b", 10), job("c", 20)])
+
+    assert p.prompt == ["a", "b", "c", "a", "b", "c"]
+    assert p.seed == [1, 10, 20, 2, 11, 21]
+    assert p.subseed == [100, 100, 100, 101, 101, 101]
+    assert p.batch_size == 3 and p.n_iter == 2
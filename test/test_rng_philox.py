@@ -0,0 +1,67 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from modules import rng_philox
+
+
+def randn_reference(seed, offset, n):
+    """The original whole-tensor implementation, built from philox4_32 and box_muller."""
+
+    counter = np.zeros((4, n), dtype=np.uint32)
+    counter[0] = offset
+    counter[2] = np.arange(n, dtype=np.uint32)
+
+    key = np.empty(n, dtype=np.uint64)
+    key.fill(seed)
+    key = rng_philox.uint32(key)
+
+    g = rng_philox.philox4_32(counter, key)
+    return rng_philox.box_muller(g[0], g[1])
+
+
+def test_randn_matches_stored_samples():
+    # float32 bits of Generator(0).randn((3, 4)), same as torch.randn((3, 4), device='cuda') after torch.manual_seed(0)
+    expected = [
+        [3211572909, 3201943215, 3223925957, 1041541909],
+        [3187116252, 3205785831, 3206509359, 3198689884],
+        [3213462168, 3199856134, 3218466043, 1074855433],
+    ]
+
+    assert rng_philox.Generator(0).randn((3, 4)).view(np.uint32).tolist() == expected
+
+
+@pytest.mark.parametrize("seed, shape, digests", [
+    (0, (1, 4, 64, 64), ["a4acb2fcf4d688e9", "132025bbc81e837a"]),
+    (42, (2, 4, 96, 96), ["81669d2698957e8b", "6d8af3cc579ef8f7"]),
+    (4294967295, (3, 70000), ["8d7e6b76e259b149", "ac7ace149c52eeb2"]),
+])
+@pytest.mark.parametrize("max_threads", [1, 4])
+def test_randn_matches_stored_digests(monkeypatch, seed, shape, digests, max_threads):
+    monkeypatch.setattr(rng_philox, "max_threads", max_threads)
+    g = rng_philox.Generator(seed)
+
+    assert [hashlib.sha256(g.randn(shape).tobytes()).hexdigest()[:16] for _ in digests] == digests
+
+
+@pytest.mark.parametrize("n", [1, 999, 1000, 1001, 4321])
+def test_randn_chunks_match_reference(monkeypatch, n):
+    monkeypatch.setattr(rng_philox, "chunk_size", 1000)
+    g = rng_philox.Generator(12345)
+
+    for offset in range(3):
+        assert np.array_equal(g.randn((n,)).view(np.uint32), randn_reference(12345, offset, n).view(np.uint32))
+
+
+def test_randn_reuses_threads_and_their_buffers(monkeypatch):
+    monkeypatch.setattr(rng_philox, "max_threads", 4)
+    created = []
+    chunk_buffers = rng_philox.ChunkBuffers
+    monkeypatch.setattr(rng_philox, "ChunkBuffers", lambda size: created.append(size) or chunk_buffers(size))
+
+    g = rng_philox.Generator(0)
+    for _ in range(5):
+        g.randn((8, rng_philox.chunk_size))
+
+    assert len(created) <= rng_philox.get_executor()._max_workers
@@ -0,0 +1,60 @@
+import types
+
+import pytest
+import torch
+
+from modules import sd_models_cache, shared
+
+
+@pytest.fixture
+def opts(monkeypatch):
+    opts = types.SimpleNamespace(sd_checkpoint_cache=0, sd_checkpoint_cache_ram=1, sd_checkpoint_cache_storage="RAM")
+    monkeypatch.setattr(shared, "opts", opts)
+    return opts
+
+
+class FakeCheckpointInfo:
+    def __init__(self, title):
+        self.title = title
+
+
+def state_dict(megabytes):
+    return {"weight": torch.zeros(megabytes * 1024 * 1024, dtype=torch.uint8)}
+
+
+def test_evicts_least_recently_used_by_size(opts):
+    opts.sd_checkpoint_cache_ram = 3
+    cache = sd_models_cache.CheckpointCache()
+    a, b, c = FakeCheckpointInfo("a"), FakeCheckpointInfo("b"), FakeCheckpointInfo("c")
+
+    cache.put(a, state_dict(1))
+    cache.put(b, state_dict(1))
+    assert cache.get(a) is not None
+    cache.put(c, state_dict(2))
+
+    assert a in cache and c in cache and b not in cache
+    assert cache.size == 3 * 1024 * 1024
+
+    stats = cache.stats()
+    assert [x["title"] for x in stats["entries"]] == ["a", "c"]
+    assert stats["entries"][0]["hits"] == 1
+    assert stats["evictions"] == 1
+
+
+def test_count_limit_and_disabled_cache(opts):
+    opts.sd_checkpoint_cache = 1
+    opts.sd_checkpoint_cache_ram = 0
+    cache = sd_models_cache.CheckpointCache()
+    a, b = FakeCheckpointInfo("a"), FakeCheckpointInfo("b")
+
+    cache.put(a, state_dict(1))
+    cache.put(b, state_dict(1))
+    assert len(cache) == 1 and b in cache
+
+    opts.sd_checkpoint_cache = 0
+    cache.shrink()
+    assert len(cache) == 0
+
+    cache.put(a, state_dict(1))
+    assert len(cache) == 0
+    assert cache.get(a) is None
@@ -0,0 +1,113 @@
+import types
+
+import pytest
+import safetensors.torch
+import torch
+
+from modules import sd_models, sd_models_merge, shared
+
+
+def weighted_sum(theta0, theta1, alpha):
+    return ((1 - alpha) * theta0) + (alpha * theta1)
+
+
+def get_difference(theta1, theta2):
+    return theta1 - theta2
+
+
+def add_difference(theta0, theta1_2_diff, alpha):
+    return theta0 + (alpha * theta1_2_diff)
+
+
+def make_checkpoint(in_channels, dtype, seed):
+    generator = torch.Generator().manual_seed(seed)
+
+    def randn(*shape):
+        return torch.randn(*shape, generator=generator).to(dtype)
+
+    return {
+        "model.diffusion_model.input_blocks.0.0.weight": randn(8, in_channels, 3, 3),
+        "model.diffusion_model.out.2.bias": randn(4),
+        "first_stage_model.decoder.conv_in.weight": randn(4, 4, 1, 1),
+        "cond_stage_model.transformer.embeddings.position_ids": torch.arange(77, dtype=torch.int64)[None],
+        "cond_stage_model.transformer.encoder.layers.0.mlp.fc1.weight": randn(6, 4),
+        "alphas_cumprod": randn(10).float(),
+    }
+
+
+def merge_in_memory(merger, theta_0, theta_1, theta_2):
+    """The same steps as extras.run_modelmerger does when it loads whole checkpoints."""
+
+    if theta_2 is not None:
+        for key in theta_1:
+            theta_1[key] = merger.difference(key, theta_1[key], theta_2.get(key))
+
+    for key in theta_0:
+        if theta_1 and merger.is_merged(key, theta_1):
+            theta_0[key] = merger.merge(key, theta_0[key], theta_1[key])
+
+    for key in list(theta_0):
+        if merger.keep(key):
+            theta_0[key] = merger.finish(key, theta_0[key])
+        else:
+            theta_0.pop(key)
+
+    return theta_0
+
+
+@pytest.mark.parametrize("theta_func1, theta_func2, save_as_half, threads", [
+    (None, weighted_sum, False, 1),
+    (get_difference, add_difference, True, 1),
+    (None, None, True, 1),
+    (get_difference, add_difference, False, 3),
+])
+def test_streaming_merge_matches_in_memory_merge(tmp_path, monkeypatch, theta_func1, theta_func2, save_as_half, threads):
+    monkeypatch.setattr(shared, "state", types.SimpleNamespace(sampling_steps=0, sampling_step=0))
+
+    checkpoints = [make_checkpoint(9, torch.float32, 0), make_checkpoint(4, torch.float16, 1), make_checkpoint(4, torch.float32, 2)]
+    del checkpoints[2]["model.diffusion_model.out.2.bias"]
+    checkpoints = checkpoints[:1 + bool(theta_func2) + bool(theta_func1)]
+
+    filenames = []
+    for i, checkpoint in enumerate(checkpoints):
+        filenames.append(str(tmp_path / f"{i}.safetensors"))
+        safetensors.torch.save_file(checkpoint, filenames[-1])
+
+    vae_dict = {"decoder.conv_in.weight": torch.ones(4, 4, 1, 1)}
+    metadata = {"format": "pt"}
+
+    merger = sd_models_merge.CheckpointMerger(theta_func1, theta_func2, 0.3, save_as_half, discard_weights="alphas")
+    merger.vae_dict = vae_dict
+    state_dicts = [sd_models.get_state_dict_from_checkpoint(safetensors.torch.load_file(x)) for x in filenames]
+    expected = merge_in_memory(merger, *state_dicts, *[None] * (3 - len(state_dicts)))
+
+    streaming_merger = sd_models_merge.CheckpointMerger(theta_func1, theta_func2, 0.3, save_as_half, discard_weights="alphas")
+    streaming_merger.vae_dict = vae_dict
+    streaming_merge = sd_models_merge.StreamingMerge(streaming_merger, *filenames)
+    assert streaming_merger.is_inpainting == merger.is_inpainting
+
+    result_filename = str(tmp_path / "result.safetensors")
+    streaming_merge.save(result_filename, metadata=metadata, threads=threads)
+
+    with safetensors.safe_open(result_filename, framework="pt") as file:
+        assert file.metadata() == metadata
+        result = {key: file.get_tensor(key) for key in file.keys()}
+
+    assert result.keys() == expected.keys()
+    for key, tensor in expected.items():
+        assert result[key].dtype == tensor.dtype, key
+        assert torch.equal(result[key], tensor), key
+
+    assert shared.state.sampling_step == len(expected)
+    assert not (tmp_path / "result.safetensors.tmp").exists()
+
+
+def test_streaming_merge_reports_errors_before_writing(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, "state", types.SimpleNamespace(sampling_steps=0, sampling_step=0))
+
+    filenames = [str(tmp_path / "a.safetensors"), str(tmp_path / "b.safetensors")]
+    safetensors.torch.save_file(make_checkpoint(4, torch.float32, 0), filenames[0])
+    safetensors.torch.save_file(make_checkpoint(9, torch.float32, 1), filenames[1])
+
+    with pytest.raises(RuntimeError, match="A must be the inpainting model"):
+        sd_models_merge.StreamingMerge(sd_models_merge.CheckpointMerger(None, weighted_sum, 0.5, False), *filenames)
@@ -0,0 +1,57 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from modules import paths_internal, script_loading
+
+soft_inpainting_path = os.path.join(paths_internal.script_path, "extensions-builtin", "soft-inpainting", "scripts", "soft_inpainting.py")
+
+
+@pytest.fixture(scope="module")
+def soft_inpainting():
+    return script_loading.load_module(soft_inpainting_path)
+
+
+@pytest.mark.parametrize("max_radius", [1, 2, 3])
+@pytest.mark.parametrize("shape", [(1, 1), (2, 17), (12, 9)])
+@pytest.mark.parametrize("percentiles", [(0.9, 1, 1), (0.25, 0.75, 1), (0.5, 0.5, 3)])
+def test_weighted_histogram_filter_matches_reference(soft_inpainting, max_radius, shape, percentiles):
+    rng = np.random.default_rng(max_radius)
+    img = rng.random(shape).astype(np.float32)
+    img[::2] = np.round(img[::2] * 4) / 4  # make sure there are ties to sort
+    kernel, kernel_center = soft_inpainting.get_gaussian_kernel(stddev_radius=1.5, max_radius=max_radius)
+
+    expected = soft_inpainting.weighted_histogram_filter_reference(img, kernel, kernel_center, *percentiles)
+    actual = soft_inpainting.weighted_histogram_filter(img, kernel, kernel_center, *percentiles)
+
+    assert actual.dtype == expected.dtype
+    assert np.array_equal(actual, expected)
+
+
+def benchmark(sizes=(32, 64, 128), radii=(1, 2, 3)):
+    """Prints the time taken by the reference and vectorized filters; run with `python -m test.test_soft_inpainting`."""
+
+    soft_inpainting = script_loading.load_module(soft_inpainting_path)
+    rng = np.random.default_rng(0)
+
+    print(f"{'size':>6} {'radius':>6} {'reference':>10} {'vectorized':>10} {'speedup':>8}")
+    for size in sizes:
+        img = rng.random((size, size)).astype(np.float32)
+
+        for radius in radii:
+            kernel, kernel_center = soft_inpainting.get_gaussian_kernel(stddev_radius=1.5, max_radius=radius)
+
+            t0 = time.perf_counter()
+            expected = soft_inpainting.weighted_histogram_filter_reference(img, kernel, kernel_center, 0.9, 1, 1)
+            t1 = time.perf_counter()
+            actual = soft_inpainting.weighted_histogram_filter(img, kernel, kernel_center, 0.9, 1, 1)
+            t2 = time.perf_counter()
+
+            assert np.array_equal(actual, expected)
+            print(f"{size:>6} {radius:>6} {t1 - t0:>9.3f}s {t2 - t1:>9.3f}s {(t1 - t0) / (t2 - t1):>7.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,3 +1,4 @@
+import base64
 
 import pytest
 import requests
@@ -88,3 +89,21 @@ def test_txt2img_multiple_batches_performed(url_txt2img, simple_txt2img_request)
 def test_txt2img_batch_performed(url_txt2img, simple_txt2img_request):
     simple_txt2img_request["batch_size"] = 2
     assert requests.post(url_txt2img, json=simple_txt2img_request).status_code == 200
+
+
+def test_txt2img_image_format_performed(url_txt2img, simple_txt2img_request):
+    simple_txt2img_request["image_format"] = "webp"
+    simple_txt2img_request["image_lossless"] = True
+    response = requests.post(url_txt2img, json=simple_txt2img_request)
+    assert response.status_code == 200
+    assert base64.b64decode(response.json()["images"][0])[8:12] == b"WEBP"
+
+
+def test_txt2img_multipart_response_performed(url_txt2img, simple_txt2img_request):
+    simple_txt2img_request["batch_size"] = 2
+    simple_txt2img_request["image_format"] = "png"
+    simple_txt2img_request["image_compression"] = 1
+    response = requests.post(url_txt2img, json=simple_txt2img_request, headers={"Accept": "multipart/mixed"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("multipart/mixed")
+    assert response.content.count(b"Content-Type: image/png") == 3  # grid and two images
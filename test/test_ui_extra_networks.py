@@ -0,0 +1,84 @@
+import json
+import os
+import types
+
+import pytest
+
+from modules import shared, ui_extra_networks
+
+
+class ExtraNetworksPageTest(ui_extra_networks.ExtraNetworksPage):
+    def __init__(self, root):
+        super().__init__("Test")
+        self.root = root
+
+    def list_items(self):
+        names = ["b", "a10", "a9", os.path.join(".hidden", "secret")]
+        for index, name in enumerate(names):
+            yield {
+                "name": os.path.basename(name),
+                "filename": os.path.join(self.root, name + ".safetensors"),
+                "prompt": f"'<test:{name}>'",
+                "local_preview": os.path.join(self.root, name + ".png"),
+                "search_terms": [name, f"hash{index}"],
+                "description": "a description" if name == "b" else None,
+                "sort_keys": {"default": index, "name": name},
+            }
+
+    def allowed_directories_for_previews(self):
+        return [self.root]
+
+
+@pytest.fixture
+def page(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(
+        extra_networks_hidden_models="When searched",
+        extra_networks_card_show_desc=True,
+        extra_networks_card_description_is_html=False,
+        extra_networks_card_height=0,
+        extra_networks_card_width=0,
+        extra_networks_card_text_scale=1.0,
+        extra_networks_cards_per_request=2,
+        extra_networks_card_order="Ascending",
+        extra_networks_card_order_field="Path",
+        extra_networks_tree_view_default_enabled=True,
+        extra_networks_tree_view_style="Dirs",
+        extra_networks_tree_view_default_width=180,
+        extra_networks_show_hidden_directories=True,
+        extra_networks_dir_button_function=False,
+        samples_format="png",
+    ))
+
+    page = ExtraNetworksPageTest(str(tmp_path))
+    monkeypatch.setattr(ui_extra_networks, "extra_pages", [page])
+    page.create_html("txt2img")
+    return page
+
+
+def names(items):
+    return [item["name"] for item in items]
+
+
+def test_find_items_searches_and_sorts_like_browser(page):
+    assert names(page.find_items()) == ["b", "a10", "a9"]
+    assert names(page.find_items(sort="name")) == ["a10", "a9", "b"]
+    assert names(page.find_items(sort="default", reverse=True)) == ["a9", "a10", "b"]
+    assert names(page.find_items(search="DESCRIPTION")) == ["b"]
+    assert names(page.find_items(search="has")) == ["b", "a10", "a9"]
+    assert names(page.find_items(search="secr")) == ["secret"]
+
+    shared.opts.extra_networks_hidden_models = "Never"
+    page.card_index = None
+    assert names(page.find_items(search="secr")) == []
+
+
+def test_get_cards_returns_cards_in_parts(page):
+    assert page.create_card_view_html("txt2img", none_message=None) == "<div class='extra-network-more-cards'></div>"
+
+    first = json.loads(ui_extra_networks.get_cards(page="test", tabname="txt2img", sort="name").body)
+    assert first["offset"] == 2 and first["total"] == 3
+    assert 'data-name="a10"' in first["html"] and 'data-name="a9"' in first["html"]
+
+    second = json.loads(ui_extra_networks.get_cards(page="test", tabname="txt2img", sort="name", offset=2).body)
+    assert second["offset"] == 3 and second["total"] == 3
+    assert 'data-name="b"' in second["html"]
@@ -0,0 +1,143 @@
+import time
+import types
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from modules import images, shared, upscaler_utils
+
+
+class NearestUpscaler(torch.nn.Module):
+    def __init__(self, scale=2, max_batch_size=None):
+        super().__init__()
+        self.scale = scale
+        self.max_batch_size = max_batch_size
+        self.batch_sizes = []
+        self.weight = torch.nn.Parameter(torch.ones(1))
+
+    def forward(self, x):
+        if self.max_batch_size is not None and x.shape[0] > self.max_batch_size:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+        self.batch_sizes.append(x.shape[0])
+        return x.repeat_interleave(self.scale, dim=2).repeat_interleave(self.scale, dim=3) * self.weight
+
+
+class ConvUpscaler(torch.nn.Module):
+    """Something that costs about as much per pixel as a small real upscaler, for benchmark."""
+
+    def __init__(self, features=32, blocks=4):
+        super().__init__()
+        layers = [torch.nn.Conv2d(3, features, 3, padding=1)]
+        for _ in range(blocks):
+            layers += [torch.nn.LeakyReLU(0.2), torch.nn.Conv2d(features, features, 3, padding=1)]
+        layers += [torch.nn.Conv2d(features, 3 * 4, 3, padding=1), torch.nn.PixelShuffle(2)]
+        self.body = torch.nn.Sequential(*layers)
+
+    def forward(self, x):
+        return self.body(x)
+
+
+@pytest.fixture
+def opts(monkeypatch):
+    opts = types.SimpleNamespace(upscaler_tile_batch_size=4, enable_upscale_progressbar=False)
+    monkeypatch.setattr(shared, "opts", opts)
+    monkeypatch.setattr(shared, "state", types.SimpleNamespace(interrupted=False, skipped=False))
+    return opts
+
+
+def random_image(width, height):
+    return Image.fromarray(np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 32])
+def test_tiled_upscale_matches_untiled(opts, batch_size):
+    opts.upscaler_tile_batch_size = batch_size
+    img = random_image(100, 70)
+    model = NearestUpscaler()
+
+    expected = np.array(upscaler_utils.upscale_with_model(model, img, tile_size=0))
+    result = np.array(upscaler_utils.upscale_with_model(model, img, tile_size=32, tile_overlap=8))
+
+    assert result.shape == (140, 200, 3)
+    assert np.array_equal(result, expected)
+    assert max(model.batch_sizes) == min(batch_size, 12)
+
+
+def test_tile_batches_shrink_when_out_of_memory(opts, monkeypatch):
+    monkeypatch.setattr(upscaler_utils.devices, "torch_gc", lambda: None)
+    opts.upscaler_tile_batch_size = 8
+    img = random_image(64, 64)
+    model = NearestUpscaler(max_batch_size=3)
+
+    expected = np.array(upscaler_utils.upscale_with_model(NearestUpscaler(), img, tile_size=0))
+    result = np.array(upscaler_utils.upscale_with_model(model, img, tile_size=24, tile_overlap=4))
+
+    assert np.array_equal(result, expected)
+    assert set(model.batch_sizes) == {2, 1}
+
+
+def test_tiled_upscale_2_batches_tiles(opts):
+    tensor = torch.rand(1, 3, 50, 40)
+    model = NearestUpscaler()
+
+    result = upscaler_utils.tiled_upscale_2(tensor, model, tile_size=16, tile_overlap=4, scale=2, device=torch.device("cpu"))
+
+    assert torch.allclose(result, model(tensor))
+    assert model.batch_sizes[:2] == [4, 4]
+
+
+def test_automatic_tile_batch_size(opts):
+    opts.upscaler_tile_batch_size = 0
+
+    assert upscaler_utils.tile_batch_size(torch.device("cpu")) == 1
+    assert upscaler_utils.tile_batch_size(torch.device("cuda")) == 4
+
+    opts.upscaler_tile_batch_size = 8
+    assert upscaler_utils.tile_batch_size(torch.device("cpu")) == 8
+
+
+def upscale_pil_tiles(model, img, tile_size, tile_overlap):
+    """Upscales img one PIL tile at a time, like upscale_with_model did before tiles were batched."""
+
+    grid = images.split_grid(img, tile_size, tile_size, tile_overlap)
+    newtiles = []
+    for y, h, row in grid.tiles:
+        newrow = []
+        for x, w, tile in row:
+            output = upscaler_utils.upscale_pil_patch(model, tile)
+            scale = output.width // tile.width
+            newrow.append([x * scale, w * scale, output])
+        newtiles.append([y * scale, h * scale, newrow])
+
+    return images.combine_grid(images.Grid(newtiles, grid.tile_w * scale, grid.tile_h * scale, grid.image_w * scale, grid.image_h * scale, grid.overlap * scale))
+
+
+def benchmark(sizes=((1024, 1024), (2048, 2048)), batch_sizes=(1, 4, 8), tile_size=192, tile_overlap=8):
+    """Prints time to upscale images on CPU one PIL tile at a time and with different numbers of tiles per model call; run with `python -m test.test_upscaler_utils`."""
+
+    shared.opts = types.SimpleNamespace(upscaler_tile_batch_size=1, enable_upscale_progressbar=False)
+    shared.state = types.SimpleNamespace(interrupted=False, skipped=False)
+    model = ConvUpscaler().eval()
+
+    print(f"{'size':>10} {'pil':>10} " + " ".join(f"{f'batch {n}':>10}" for n in batch_sizes))
+    for width, height in sizes:
+        img = random_image(width, height)
+
+        t0 = time.perf_counter()
+        upscale_pil_tiles(model, img, tile_size, tile_overlap)
+        times = [time.perf_counter() - t0]
+
+        for batch_size in batch_sizes:
+            shared.opts.upscaler_tile_batch_size = batch_size
+            t0 = time.perf_counter()
+            upscaler_utils.upscale_with_model(model, img, tile_size=tile_size, tile_overlap=tile_overlap)
+            times.append(time.perf_counter() - t0)
+
+        print(f"{f'{width}x{height}':>10} " + " ".join(f"{t:>9.2f}s" for t in times))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,74 @@
+import types
+
+from PIL import Image
+
+from scripts import xyz_grid
+
+
+def test_plan_cells_keeps_inner_axes_values_across_rows():
+    cells = xyz_grid.plan_cells([0, 1], [0, 1, 2], [0], 'x', 'y')
+
+    assert cells == [(0, 0, 0), (0, 1, 0), (0, 2, 0), (1, 2, 0), (1, 1, 0), (1, 0, 0)]
+
+    cells = xyz_grid.plan_cells([0, 1], [0, 1], [0, 1], 'z', 'y')
+    assert sorted(cells) == sorted((ix, iy, iz) for ix in range(2) for iy in range(2) for iz in range(2))
+    assert [c[2] for c in cells] == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert all(sum(a != b for a, b in zip(c1, c2)) == 1 for c1, c2 in zip(cells, cells[1:]))
+
+
+def test_group_cells():
+    keys = {0: "a", 1: "b", 2: "a", 3: None, 4: "a", 5: "a"}
+
+    assert xyz_grid.group_cells(list(keys), keys.get, 3) == [[0, 2, 4], [1], [3], [5]]
+    assert xyz_grid.group_cells(list(keys), keys.get, 1) == [[0], [1], [2], [3], [4], [5]]
+
+
+def test_cell_parameters_hash(monkeypatch):
+    monkeypatch.setattr(xyz_grid, "opts", types.SimpleNamespace(
+        data={"CLIP_stop_at_last_layers": 2, "samples_format": "png"},
+        data_labels={"CLIP_stop_at_last_layers": types.SimpleNamespace(default=1, infotext="Clip skip"), "samples_format": types.SimpleNamespace(default="png", infotext=None)},
+    ))
+
+    def make_p(**kwargs):
+        fields = dict(prompt="a cat", negative_prompt="", seed=1, subseed=-1, subseed_strength=0, override_settings={}, sd_model=object(), outpath_samples="outputs")
+        return types.SimpleNamespace(**{**fields, **kwargs})
+
+    h = xyz_grid.cell_parameters_hash
+    key = h(make_p(), [True, 0.5])
+
+    assert h(make_p(outpath_samples="elsewhere"), [True, 0.5]) == key
+    assert h(make_p(seed=2), [True, 0.5]) != key
+    assert h(make_p(override_settings={"CLIP_stop_at_last_layers": 1}), [True, 0.5]) != key
+    assert h(make_p(), [True, 0.6]) != key
+    assert h(make_p(init_images=[Image.new("RGB", (8, 8), "red")]), []) != h(make_p(init_images=[Image.new("RGB", (8, 8), "blue")]), [])
+    assert h(make_p(prompt="a dog", seed=2), [], exclude=("prompt", "negative_prompt", "seed")) == h(make_p(), [], exclude=("prompt", "negative_prompt", "seed"))
+
+    assert h(make_p(seed=-1), []) is None
+    assert h(make_p(), [object()]) is None
+
+
+def test_cell_batch_key_keeps_extra_networks_apart(monkeypatch):
+    monkeypatch.setattr(xyz_grid, "opts", types.SimpleNamespace(data={}, data_labels={}))
+
+    def make_p(prompt, seed=1):
+        return types.SimpleNamespace(prompt=prompt, negative_prompt="", seed=seed, subseed=-1, subseed_strength=0, override_settings={})
+
+    key = xyz_grid.cell_batch_key(make_p("a cat <lora:x:0.2>"), [])
+
+    assert xyz_grid.cell_batch_key(make_p("a dog <lora:x:0.2>", seed=2), []) == key
+    assert xyz_grid.cell_batch_key(make_p("a cat <lora:x:0.6>"), []) != key
+    assert xyz_grid.cell_batch_key(make_p("a cat"), []) != key
+    assert xyz_grid.cell_batch_key(make_p("a cat", seed=-1), []) is None
+
+
+def test_cell_cache(tmp_path):
+    cell_cache = xyz_grid.CellCache(str(tmp_path))
+    key = "ab" * 32
+
+    assert cell_cache.load(key) is None
+
+    cell_cache.save(key, Image.new("RGB", (8, 8), "red"), "a cat\nSteps: 20")
+    image, infotext = cell_cache.load(key)
+
+    assert image.getpixel((0, 0)) == (255, 0, 0)
+    assert infotext == "a cat\nSteps: 20"
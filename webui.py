@@ -44,6 +44,9 @@ def api_only():
         root_path=f"/{cmd_opts.subpath}" if cmd_opts.subpath else ""
     )
 
+    from modules import image_saver
+    image_saver.saver.flush()
+
 
 def webui():
     from modules.shared_cmd_options import cmd_opts
@@ -51,7 +54,7 @@ def webui():
     launch_api = cmd_opts.api
     initialize.initialize()
 
-    from modules import shared, ui_tempdir, script_callbacks, ui, progress, ui_extra_networks
+    from modules import shared, ui_tempdir, script_callbacks, ui, progress, ui_extra_networks, image_saver
 
     while 1:
         if shared.opts.clean_temp_dir_at_start:
@@ -133,6 +136,8 @@ def webui():
             print('Caught KeyboardInterrupt, stopping...')
             server_command = "stop"
 
+        image_saver.saver.flush()
+
         if server_command == "stop":
             print("Stopping server...")
             # If we catch a keyboard interrupt, we want to stop the server and exit.